@@ -3,39 +3,744 @@
 功能：将大型TXT小说文件按章节分割，每10章保存为一个文件
 """
 
+import codecs
+import contextlib
+import functools
+import glob
+import io
+import json
+import mmap
 import os
 import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
 
 # 每个文件包含的章节数
 CHAPTERS_PER_FILE = 20
+# 分割模式：
+#   "full"   = 整篇读入内存后分割
+#   "stream" = 流式分割（逐行读取，每凑满一组立即写盘，内存占用只与单组大小有关）
+#   "index"  = 基于 mmap 的章节索引（索引保存为旁路文件，修改每文件章节数后重跑无需重新扫描）
+SPLIT_MODE = "stream"
+
+# 分组方式：
+#   "chapters" = 每个文件固定 CHAPTERS_PER_FILE 章
+#   "budget"   = 按字数或估算 token 数分组，让每个文件的大小（即每次总结请求的耗时）更均匀
+GROUP_MODE = "chapters"
+# 预算单位："chars" = 非空白字符数，"tokens" = 估算 token 数
+BUDGET_UNIT = "chars"
+# 每个文件的目标大小：累计达到后结束当前分组
+GROUP_TARGET_SIZE = 40000
+# 每个文件的下限：末尾分组小于下限时并入前一组（合并后不超过上限时）
+GROUP_MIN_SIZE = 15000
+# 每个文件的上限：加入下一章会超过上限时先结束当前分组；单章超过上限时独占一个文件，章节不会被拆开
+GROUP_MAX_SIZE = 60000
+
+# token 估算系数：每个汉字（含中文标点）、每个其他非空白字符分别约合多少 token
+CJK_TOKENS_PER_CHAR = 0.7
+OTHER_TOKENS_PER_CHAR = 0.3
+
+# 批量分割：小说所在目录或通配符（如 "novels" 或 "novels/*.txt"），为空时只处理 main() 中的 INPUT_FILE
+BATCH_INPUT = ""
+# 批量分割输出根目录，每部小说输出到其下与小说同名的子目录
+BATCH_OUTPUT_ROOT = "TXT"
+# 批量分割进程数（0 表示使用全部 CPU 核心）
+BATCH_WORKERS = 0
+
+# 编码探测时从文件开头采样的字节数
+ENCODING_SNIFF_BYTES = 256 * 1024
+# 转码为 UTF-8 时每次读取的字节数
+TRANSCODE_CHUNK_BYTES = 4 * 1024 * 1024
+
+# 额外启用的章节标题格式（EXTRA_HEADING_FORMATS 中的名称），默认只识别“第X章”
+HEADING_FORMATS = []
+
+# 中文数字：数字字符、节内单位（十百千）、节单位（万亿），含大写与繁体写法
+CHINESE_DIGITS = {
+    '零': 0, '〇': 0, '一': 1, '壹': 1, '二': 2, '贰': 2, '貳': 2, '两': 2, '兩': 2,
+    '三': 3, '叁': 3, '參': 3, '四': 4, '肆': 4, '五': 5, '伍': 5, '六': 6, '陆': 6, '陸': 6,
+    '七': 7, '柒': 7, '八': 8, '捌': 8, '九': 9, '玖': 9,
+}
+CHINESE_UNITS = {'十': 10, '拾': 10, '百': 100, '佰': 100, '千': 1000, '仟': 1000}
+CHINESE_SECTION_UNITS = {'万': 10 ** 4, '萬': 10 ** 4, '亿': 10 ** 8, '億': 10 ** 8}
+
+# 章节号可用的字符：中文数字或阿拉伯数字（含全角数字）
+CHAPTER_NUM_PATTERN = (
+    '[' + ''.join(CHINESE_DIGITS) + ''.join(CHINESE_UNITS) + ''.join(CHINESE_SECTION_UNITS) + r'\d]+'
+)
+
+# 默认章节标题格式，{num} 处为章节号
+DEFAULT_HEADING_FORMAT = '第{num}章'
+
+# 可选的额外章节标题格式（英文字母不区分大小写）
+EXTRA_HEADING_FORMATS = {
+    'chapter': 'Chapter[ \t]*{num}',
+    '卷': '卷{num}',
+    '回': '第{num}回',
+    '节': '第{num}节',
+}
+
+# 标题解析结果缓存条数
+HEADING_CACHE_SIZE = 16384
+
+
+def _section_to_chinese(section: int) -> str:
+    """将 1~9999 转换为中文数字（不处理开头的“一十”）"""
+    result = []
+    pending_zero = False
+    for unit_value, unit in ((1000, '千'), (100, '百'), (10, '十'), (1, '')):
+        digit = section // unit_value % 10
+        if digit == 0:
+            pending_zero = bool(result)
+            continue
+        if pending_zero:
+            result.append('零')
+            pending_zero = False
+        result.append('零一二三四五六七八九'[digit] + unit)
+    return ''.join(result)
+
+
+def num_to_chinese(num: int) -> str:
+    """
+    将阿拉伯数字转换为规范的中文数字（支持 0 ~ 10^12-1）
+
+    Args:
+        num: 非负整数，如 12300
+
+    Returns:
+        中文数字，如“一万二千三百”
+    """
+    if num < 0 or num >= 10 ** 12:
+        raise ValueError(f"超出支持范围: {num}")
+    if num == 0:
+        return '零'
+
+    result = []
+    need_zero = False
+    for section_value, section_unit in ((10 ** 8, '亿'), (10 ** 4, '万'), (1, '')):
+        section = num // section_value % 10000
+        if section == 0:
+            need_zero = bool(result)
+            continue
+        # 高位节非零而本节不足千位时补“零”，如 一万零五、一亿零五万
+        if result and (need_zero or section < 1000):
+            result.append('零')
+        result.append(_section_to_chinese(section) + section_unit)
+        need_zero = False
+
+    chinese = ''.join(result)
+    # 10~19 开头习惯写作“十X”而不是“一十X”
+    return chinese[1:] if chinese.startswith('一十') else chinese
+
+
+def _parse_chinese_number(chinese: str) -> int:
+    """
+    逐字符查表解析中文数字，单次遍历
+
+    数字字符按位累加（支持“一〇二四”这类逐位写法），十百千乘到当前节，
+    万把当前节乘一万后并入结果，亿把此前全部结果乘一亿。
+    """
+    result = 0
+    section = 0
+    temp = 0
+    for char in chinese:
+        digit = CHINESE_DIGITS.get(char)
+        if digit is None:
+            digit = unicodedata.decimal(char, None)
+        if digit is not None:
+            temp = temp * 10 + digit
+            continue
+
+        unit = CHINESE_UNITS.get(char)
+        if unit is not None:
+            section += (temp or 1) * unit
+            temp = 0
+            continue
+
+        section_unit = CHINESE_SECTION_UNITS.get(char)
+        if section_unit is None:
+            # 无法识别的字符直接忽略
+            continue
+        if section_unit == 10 ** 8:
+            result = (result + section + temp or 1) * section_unit
+        else:
+            result += (section + temp or 1) * section_unit
+        section = 0
+        temp = 0
+
+    return result + section + temp
+
+
+# 常用范围 1~9999 的规范写法预先建表，章节标题解析时直接查表
+_SMALL_CHINESE_NUMBERS = {num_to_chinese(num): num for num in range(1, 10000)}
+
+
+def chinese_to_num(chinese: str) -> int:
+    """
+    将中文数字转换为阿拉伯数字
+
+    支持格式：一百二十三、一千零五、十、二十一、一万二千三百、三亿、两百、一〇二四、
+    壹佰贰拾、全角数字１２３ 等
+
+    Args:
+        chinese: 中文数字字符串
+
+    Returns:
+        对应的阿拉伯数字
+    """
+    if not chinese:
+        return 0
+
+    number = _SMALL_CHINESE_NUMBERS.get(chinese)
+    if number is not None:
+        return number
+
+    # 处理纯阿拉伯数字（含全角数字）的情况
+    if chinese.isdecimal():
+        return int(chinese)
+
+    return _parse_chinese_number(chinese)
+
+
+class HeadingMatcher:
+    """
+    章节标题匹配器
+
+    所有标题格式只在注册时编译一次；标题行判断、全文切分和章节号解析共用这些预编译正则，
+    章节号解析结果按标题文本做 LRU 缓存。
+    """
+
+    def __init__(self, number_parser: Callable[[str], int], formats: Optional[List[str]] = None):
+        """
+        Args:
+            number_parser: 将章节号文本（如“一百二十三”“123”）转换为整数的函数
+            formats: 额外注册的标题格式，{num} 处为章节号
+        """
+        self._number_parser = number_parser
+        self._formats = []
+        self.register(DEFAULT_HEADING_FORMAT)
+        for fmt in formats or []:
+            self.register(fmt)
+
+    def register(self, fmt: str) -> None:
+        """
+        注册一种章节标题格式并重新编译匹配正则
+
+        Args:
+            fmt: 标题格式正则，{num} 处为章节号，如 '第{num}回'、'Chapter[ \\t]*{num}'
+        """
+        if '{num}' not in fmt:
+            raise ValueError(f"标题格式缺少 {{num}} 占位符: {fmt}")
+        if fmt not in self._formats:
+            self._formats.append(fmt)
+            self._compile()
+
+    @property
+    def formats(self) -> List[str]:
+        """已注册的标题格式（按注册顺序）"""
+        return list(self._formats)
+
+    def _compile(self) -> None:
+        flags = 0
+        if any(c.isascii() and c.isalpha() for fmt in self._formats for c in fmt.replace('{num}', '')):
+            flags = re.IGNORECASE
+
+        markers = '|'.join(fmt.replace('{num}', CHAPTER_NUM_PATTERN) for fmt in self._formats)
+        # 标题行：行首允许空格、制表符、全角空格，标题格式之后可跟任意标题文字
+        # 注意：这里不能使用 \s（会匹配换行），否则会把下一行正文误并入章节标题
+        heading = rf'[ \t\u3000]*(?:{markers})(?:[．。.:：、 \t\u3000—-]*[^\n]*)?$'
+        self.line_pattern = re.compile(rf'(^{heading})', flags | re.MULTILINE)
+        # 去掉首尾空白后以标题行开头的文本块，匹配时不必先复制出 strip() 后的字符串
+        self._block_pattern = re.compile(rf'\s*{heading}', flags | re.MULTILINE)
+        # 不带行首锚点的标题格式：以字面字符开头，正则引擎可以快速跳过正文，比逐位置尝试 ^ 快得多
+        self._marker_pattern = re.compile(markers, flags)
+        self._number_patterns = [
+            re.compile(fmt.replace('{num}', f'({CHAPTER_NUM_PATTERN})'), flags)
+            for fmt in self._formats
+        ]
+
+        # 字节级扫描：先找各格式的字面前缀，再确认其位于行首，供 ChapterIndex 在 mmap 上使用
+        prefixes = list(dict.fromkeys(_literal_prefix(fmt) for fmt in self._formats))
+        if all(prefixes):
+            self._lead_pattern = re.compile(
+                b'|'.join(re.escape(p.encode('utf-8')) for p in prefixes), flags
+            )
+        else:
+            # 某个格式没有字面前缀时只能逐行检查
+            self._lead_pattern = None
+
+        self.parse_heading = functools.lru_cache(maxsize=HEADING_CACHE_SIZE)(self._parse_heading)
+
+    def split(self, content: str) -> list:
+        """
+        按标题行切分全文，结果与 self.line_pattern.split(content) 相同（正文、标题交替）
+
+        先用不带锚点的标题格式定位候选位置，再确认其前面只有行首缩进并整行复核。
+        """
+        parts = []
+        last_end = 0
+        for match in self._marker_pattern.finditer(content):
+            start = match.start()
+            if start < last_end:
+                continue
+            line_start = content.rfind('\n', 0, start) + 1
+            if start != line_start and content[line_start:start].strip(' \t\u3000'):
+                continue
+            heading = self.line_pattern.match(content, line_start)
+            if heading is None:
+                continue
+            parts.append(content[last_end:line_start])
+            parts.append(heading.group(1))
+            last_end = heading.end()
+        parts.append(content[last_end:])
+        return parts
+
+    def iter_heading_lines(self, data):
+        """
+        在 UTF-8 字节数据（如 mmap）中查找标题行
+
+        Args:
+            data: 字节串或 mmap 对象
+
+        Yields:
+            (行起始偏移, 行结束偏移, 行文本)，行结束偏移不含换行符
+        """
+        if self._lead_pattern is None:
+            for match in re.finditer(rb'^[^\n]*', data, flags=re.MULTILINE):
+                line = match.group().decode('utf-8', errors='replace')
+                if self.is_heading(line):
+                    yield match.start(), match.end(), line
+            return
+
+        last_end = 0
+        for match in self._lead_pattern.finditer(data):
+            start = match.start()
+            if start < last_end:
+                continue
+            line_start = data.rfind(b'\n', 0, start) + 1
+            if start != line_start and _INDENT_BYTES.fullmatch(data, line_start, start) is None:
+                continue
+            line_end = data.find(b'\n', start)
+            if line_end < 0:
+                line_end = len(data)
+            last_end = line_end
+            line = data[line_start:line_end].decode('utf-8', errors='replace')
+            if self.is_heading(line):
+                yield line_start, line_end, line
+
+    def is_heading(self, text: str) -> bool:
+        """判断文本是否以章节标题行开头"""
+        return self.line_pattern.match(text) is not None
+
+    def starts_with_heading(self, text: str) -> bool:
+        """判断文本去掉首尾空白后是否以章节标题行开头，等价于 is_heading(text.strip())"""
+        return self._block_pattern.match(text) is not None
+
+    def parse_number(self, title: str) -> int:
+        """解析标题中的章节号，无法提取时返回0"""
+        return self.parse_heading(title)[1]
+
+    def _parse_heading(self, title: str) -> Tuple[int, int]:
+        # (格式序号, 章节号)：去重时按格式区分，“卷一”和“第一章”不算同一章
+        for kind, pattern in enumerate(self._number_patterns):
+            match = pattern.search(title)
+            if match:
+                return kind, self._number_parser(match.group(1))
+        return -1, 0
+
+
+# 行首缩进（空格、制表符、全角空格）的 UTF-8 字节形式
+_INDENT_BYTES = re.compile(rb'(?:[ \t]|\xe3\x80\x80)*')
+
+
+def _literal_prefix(fmt: str) -> str:
+    """取标题格式开头不含正则元字符的字面前缀"""
+    prefix = []
+    for c in fmt:
+        if c in '\\.^$*+?{}[]()|':
+            break
+        prefix.append(c)
+    return ''.join(prefix)
+
+
+# 解码错误处理器：把无法解码的字节替换为 U+FFFD 并计数，代替 errors='ignore' 静默丢弃；
+# 按线程计数，总结opencode.py 在多个线程中同时读取文件时互不干扰
+DECODE_ERRORS = 'novel-count-replace'
+_decode_local = threading.local()
+
+
+def _count_and_replace(exc: UnicodeDecodeError) -> tuple:
+    _decode_local.replaced = getattr(_decode_local, 'replaced', 0) + exc.end - exc.start
+    return '\ufffd', exc.end
+
+
+codecs.register_error(DECODE_ERRORS, _count_and_replace)
+
+
+def take_replaced_byte_count() -> int:
+    """取出当前线程自上次调用以来解码时被替换的字节数，并将计数清零"""
+    count = getattr(_decode_local, 'replaced', 0)
+    _decode_local.replaced = 0
+    return count
+
+
+def detect_encoding(path: str, sample_bytes: int = ENCODING_SNIFF_BYTES) -> str:
+    """
+    根据文件开头的采样判断文本编码
+
+    依次检查 BOM、无 BOM 的 UTF-16（NUL 字节比例），再尝试严格解码 UTF-8 与 GB18030；
+    都不能严格解码时选择替换字符最少的编码。
+
+    Args:
+        path: 文件路径
+        sample_bytes: 采样字节数
+
+    Returns:
+        编码名称：utf-8、utf-8-sig、gb18030、utf-16、utf-16-le 或 utf-16-be
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(sample_bytes)
+        at_eof = not f.read(1)
+
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+
+    # 正常的 UTF-8/GB18030 文本几乎不含 NUL 字节，而 UTF-16 中 ASCII 字符和不少汉字都带 NUL 字节；
+    # 再按两种字节序解码后“像正常文本”的字符比例判断字节序
+    if sample.count(0) * 200 > len(sample):
+        even_sample = sample[:len(sample) // 2 * 2]
+        return max(('utf-16-le', 'utf-16-be'),
+                   key=lambda encoding: _plain_text_score(even_sample.decode(encoding, errors='replace')))
+
+    for encoding in ('utf-8', 'gb18030'):
+        try:
+            # 采样可能截断在多字节字符中间，未读到文件末尾时不要求结尾完整
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=at_eof)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+
+    return min(('utf-8', 'gb18030'),
+               key=lambda encoding: sample.decode(encoding, errors='replace').count('\ufffd'))
+
+
+def _plain_text_score(text: str) -> int:
+    """统计文本中常见字符（可打印 ASCII、换行、CJK 标点与汉字、全角字符）的个数"""
+    return sum(
+        1 for c in text
+        if ' ' <= c <= '~' or c in '\r\n\t' or '\u3000' <= c <= '\u9fff' or '\uff00' <= c <= '\uffef'
+    )
+
+
+def transcode_to_utf8(src: str, dst: str, encoding: str,
+                      chunk_bytes: int = TRANSCODE_CHUNK_BYTES) -> None:
+    """
+    按固定大小分块把文件转码为 UTF-8（去掉 BOM），内存中同时只有一个分块
+
+    先写入临时文件再改名，中途失败不会留下不完整的目标文件。
+
+    Args:
+        src: 源文件路径
+        dst: 目标文件路径
+        encoding: 源文件编码
+        chunk_bytes: 每次读取的字节数
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors=DECODE_ERRORS)
+    tmp_path = f"{dst}.tmp"
+    with open(src, 'rb') as fin, open(tmp_path, 'wb') as fout:
+        while True:
+            chunk = fin.read(chunk_bytes)
+            if not chunk:
+                break
+            fout.write(decoder.decode(chunk).encode('utf-8'))
+        fout.write(decoder.decode(b'', final=True).encode('utf-8'))
+    os.replace(tmp_path, dst)
+
+
+# 汉字与中日韩标点、全角字符
+_CJK_PATTERN = re.compile('[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def count_visible_chars(text: str) -> int:
+    """统计非空白字符数（与换行符风格、空行无关）"""
+    return sum(map(len, text.split()))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数
+
+    汉字在常见分词器中约 0.5~1 个 token，英文等其他字符约 4 个字符一个 token，
+    按 CJK_TOKENS_PER_CHAR / OTHER_TOKENS_PER_CHAR 分别计数，空白不计。
+    """
+    visible = count_visible_chars(text)
+    cjk = _CJK_PATTERN.subn('', text)[1]
+    return int(cjk * CJK_TOKENS_PER_CHAR + (visible - cjk) * OTHER_TOKENS_PER_CHAR + 0.5)
+
+
+def iter_budget_groups(items, size_of: Callable, target_size: int, min_size: int, max_size: int):
+    """
+    按大小预算把连续的章节分组，章节不会被拆开
+
+    加入下一章会超过 max_size 时先结束当前分组；加入后累计达到 target_size 时结束当前分组；
+    最后一组小于 min_size 且与前一组合并后不超过 max_size 时并入前一组。
+    为了能合并末组，min_size > 0 时会多保留一个已完成的分组，内存中最多同时有两组。
+
+    Args:
+        items: 章节可迭代对象（可以是流式生成器）
+        size_of: 计算单个章节大小的函数
+        target_size: 目标大小
+        min_size: 末组下限（0 表示不合并末组）
+        max_size: 上限
+
+    Yields:
+        章节列表，每个列表为一个输出分组
+    """
+    pending = None
+    pending_size = 0
+    group = []
+    group_size = 0
+
+    for item in items:
+        size = size_of(item)
+        if group and group_size + size > max_size:
+            if min_size <= 0:
+                yield group
+            else:
+                if pending is not None:
+                    yield pending
+                pending, pending_size = group, group_size
+            group, group_size = [], 0
+
+        group.append(item)
+        group_size += size
+        if group_size >= target_size:
+            if min_size <= 0:
+                yield group
+            else:
+                if pending is not None:
+                    yield pending
+                pending, pending_size = group, group_size
+            group, group_size = [], 0
+
+    if group and pending is not None and group_size < min_size and pending_size + group_size <= max_size:
+        pending.extend(group)
+        group = []
+    if pending is not None:
+        yield pending
+    if group:
+        yield group
+
+
+class ChapterIndex:
+    """
+    章节边界索引
+
+    在输入文件的 mmap 上做一次字节级正则扫描，记录每个“第X章”标题行的字节偏移、长度、
+    标题格式序号、章节号以及标题之后的正文是否为空。索引可保存为旁路文件，修改每文件章节数后重跑
+    只需做偏移运算，不必重新扫描全文。只扫描 UTF-8 字节，其他编码的输入需先转码。
+    """
+
+    VERSION = 5
+
+    # 只由空白字符组成的字节串（与 str.strip() 认定的空白一致）
+    _BLANK_PATTERN = re.compile(
+        rb'(?:[\s\x1c-\x1f]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]'
+        rb'|\xe2\x81\x9f|\xe3\x80\x80)*'
+    )
+
+    def __init__(self, file_size: int, mtime_ns: int, formats: List[str],
+                 headings: List[Tuple[int, int, int, int, bool]]):
+        """
+        Args:
+            file_size: 建立索引时输入文件的字节数
+            mtime_ns: 建立索引时输入文件的修改时间（纳秒）
+            formats: 建立索引时使用的章节标题格式
+            headings: 标题行列表，每个元素为(字节偏移, 字节长度, 标题格式序号, 章节号, 正文是否非空)
+        """
+        self.file_size = file_size
+        self.mtime_ns = mtime_ns
+        self.formats = formats
+        self.headings = headings
+
+    @classmethod
+    def build(cls, data, mtime_ns: int, matcher: HeadingMatcher) -> "ChapterIndex":
+        """
+        对整个文件做一次正则扫描建立索引
+
+        Args:
+            data: 输入文件的字节视图（通常是 mmap 对象）
+            mtime_ns: 输入文件的修改时间（纳秒）
+            matcher: 章节标题匹配器，用于筛选候选标题行并解析章节号
+
+        Returns:
+            章节索引
+        """
+        positions = [
+            (start, end - start, *matcher.parse_heading(line.strip()))
+            for start, end, line in matcher.iter_heading_lines(data)
+        ]
+
+        file_size = len(data)
+        headings = []
+        # 第一个标题行之前的文本也可能被 split_chapters 当作标题，按一段正文处理
+        prefix = cls._promoted_body(data, 0, positions[0][0] if positions else file_size, matcher)
+        if prefix is not None:
+            headings.append(prefix)
+        for i, (offset, length, kind, number) in enumerate(positions):
+            body_end = positions[i + 1][0] if i + 1 < len(positions) else file_size
+            has_content = cls._BLANK_PATTERN.fullmatch(data, offset + length, body_end) is None
+            promoted = cls._promoted_body(data, offset + length, body_end, matcher) if has_content else None
+            headings.append((offset, length, kind, number, has_content and promoted is None))
+            if promoted is not None:
+                headings.append(promoted)
+
+        return cls(file_size, mtime_ns, matcher.formats, headings)
+
+    @classmethod
+    def _promoted_body(cls, data, start: int, end: int,
+                       matcher: HeadingMatcher) -> Optional[Tuple[int, int, int, int, bool]]:
+        """
+        正文去掉首尾空白后以标题行开头时（如行首为不间断空格的标题），split_chapters 会把整段正文当作标题；
+        此时返回把整段正文作为一个无正文标题行的索引项，否则返回 None
+        """
+        text_start = cls._BLANK_PATTERN.match(data, start, end).end()
+        if text_start >= end:
+            return None
+        line_end = data.find(b'\n', text_start, end)
+        if line_end < 0:
+            line_end = end
+        if not matcher.is_heading(data[text_start:line_end].decode('utf-8', errors='replace')):
+            return None
+        body = data[start:end].decode('utf-8', errors='replace').strip()
+        return (start, end - start, *matcher.parse_heading(body), False)
+
+    @classmethod
+    def load(cls, index_file: Path, file_size: int, mtime_ns: int,
+             formats: List[str]) -> Optional["ChapterIndex"]:
+        """
+        读取旁路索引文件，文件大小、修改时间或标题格式与当前不一致时视为失效
+
+        Returns:
+            章节索引；索引文件不存在、损坏或已失效时返回 None
+        """
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if (
+            raw.get('version') != cls.VERSION
+            or raw.get('size') != file_size
+            or raw.get('mtime_ns') != mtime_ns
+            or raw.get('formats') != formats
+        ):
+            return None
+        headings = [(offset, length, kind, number, bool(has_content))
+                    for offset, length, kind, number, has_content in raw.get('headings', [])]
+        return cls(file_size, mtime_ns, formats, headings)
+
+    def save(self, index_file: Path) -> None:
+        """将索引保存为旁路文件"""
+        raw = {
+            'version': self.VERSION,
+            'size': self.file_size,
+            'mtime_ns': self.mtime_ns,
+            'formats': self.formats,
+            'headings': [[offset, length, kind, number, int(has_content)]
+                         for offset, length, kind, number, has_content in self.headings],
+        }
+        with open(index_file, 'w', encoding='utf-8') as f:
+            json.dump(raw, f, separators=(',', ':'))
+
+    def chapters(self) -> List[Tuple[int, List[Tuple[int, int]]]]:
+        """
+        按与 NovelSplitter.split_chapters 相同的规则（同一标题格式下重复的章节号只保留第一次出现、
+        正文为空的章节丢弃）把标题行组装为章节
+
+        Returns:
+            章节列表，每个元素为(章节号, 正文字节区间列表)
+        """
+        chapters = []
+        seen_headings = set()
+        current = None
+
+        for i, (offset, length, kind, number, has_content) in enumerate(self.headings):
+            body_end = self.headings[i + 1][0] if i + 1 < len(self.headings) else self.file_size
+            body = (offset + length, body_end)
+
+            # 重复章节号的标题行跳过，其后正文并入当前章节
+            if number > 0 and (kind, number) in seen_headings:
+                if current is not None and has_content:
+                    current[1].append(body)
+                continue
+
+            if current is not None and current[1]:
+                chapters.append(current)
+
+            current = (number, [])
+            if number > 0:
+                seen_headings.add((kind, number))
+            if has_content:
+                current[1].append(body)
+
+        if current is not None and current[1]:
+            chapters.append(current)
+
+        return chapters
+
+
 class NovelSplitter:
     """小说分割器类"""
 
-    def __init__(self, input_file: str, output_dir: str = "TXT", chapters_per_file: int = 10):
+    def __init__(self, input_file: str, output_dir: str = "TXT", chapters_per_file: int = 10,
+                 heading_formats: Optional[List[str]] = None, group_mode: str = "chapters",
+                 budget_unit: str = "chars", target_size: int = GROUP_TARGET_SIZE,
+                 min_size: int = GROUP_MIN_SIZE, max_size: int = GROUP_MAX_SIZE):
         """
         初始化分割器
 
         Args:
             input_file: 输入的小说文件路径
             output_dir: 输出文件夹名称（默认TXT）
-            chapters_per_file: 每个文件包含的章节数（默认10章）
+            chapters_per_file: 每个文件包含的章节数（默认10章，仅 group_mode="chapters" 时使用）
+            heading_formats: 额外识别的章节标题格式，{num} 处为章节号（默认只识别“第X章”）
+            group_mode: 分组方式，"chapters" 按固定章节数，"budget" 按大小预算
+            budget_unit: 预算单位，"chars" 为非空白字符数，"tokens" 为估算 token 数
+            target_size: 每个文件的目标大小（按预算分组时使用）
+            min_size: 末尾分组的下限（按预算分组时使用）
+            max_size: 每个文件的上限（按预算分组时使用，单章超过上限时独占一个文件）
         """
+        if group_mode not in ("chapters", "budget"):
+            raise ValueError(f"不支持的分组方式: {group_mode}")
+        if budget_unit not in ("chars", "tokens"):
+            raise ValueError(f"不支持的预算单位: {budget_unit}")
+
         self.input_file = input_file
         self.output_dir = output_dir
         self.chapters_per_file = chapters_per_file
+        self.group_mode = group_mode
+        self.budget_unit = budget_unit
+        self.target_size = target_size
+        self.min_size = min_size
+        self.max_size = max_size
+        # 输入文件编码，首次读取时自动探测
+        self.encoding = None
+        # 最近一次处理中解码时被替换的字节数
+        self.replaced_bytes = 0
 
-        # 中文数字到阿拉伯数字的映射
-        self.chinese_nums = {
-            '零': 0, '一': 1, '二': 2, '三': 3, '四': 4,
-            '五': 5, '六': 6, '七': 7, '八': 8, '九': 9,
-            '十': 10, '百': 100, '千': 1000, '万': 10000
-        }
+        self.heading_matcher = HeadingMatcher(self.chinese_to_num, heading_formats)
 
     def chinese_to_num(self, chinese: str) -> int:
         """
-        将中文数字转换为阿拉伯数字
-        支持格式：一百二十三、一千零五、十、二十一等
+        将中文数字转换为阿拉伯数字，见模块级函数 chinese_to_num
 
         Args:
             chinese: 中文数字字符串
@@ -43,29 +748,7 @@ class NovelSplitter:
         Returns:
             对应的阿拉伯数字
         """
-        if not chinese:
-            return 0
-
-        # 处理纯阿拉伯数字的情况
-        if chinese.isdigit():
-            return int(chinese)
-
-        result = 0
-        temp = 0
-
-        for char in chinese:
-            if char in self.chinese_nums:
-                num = self.chinese_nums[char]
-                if num >= 10:  # 十、百、千、万
-                    if temp == 0:
-                        temp = 1
-                    result += temp * num
-                    temp = 0
-                else:
-                    temp = temp * 10 + num if temp > 0 else num
-
-        result += temp
-        return result
+        return chinese_to_num(chinese)
 
     def extract_chapter_number(self, title: str) -> int:
         """
@@ -77,14 +760,9 @@ class NovelSplitter:
         Returns:
             章节号（阿拉伯数字），如果无法提取则返回0
         """
-        # 匹配"第X章"格式，X可以是中文数字或阿拉伯数字
+        # 匹配"第X章"及额外注册的格式，X可以是中文数字或阿拉伯数字
         # 支持如：第1章．神奇的任务 / 第十二章 / 第12章
-        match = re.search(r'第([一二三四五六七八九十百千万零\d]+)章', title)
-        if match:
-            num_str = match.group(1)
-            return self.chinese_to_num(num_str)
-
-        return 0
+        return self.heading_matcher.parse_number(title)
 
     def split_chapters(self, content: str) -> list:
         """
@@ -96,39 +774,49 @@ class NovelSplitter:
         Returns:
             章节列表，每个元素为(章节标题, 章节内容)的元组
         """
-        chapters = []
+        # 分割文本
+        parts = self.heading_matcher.split(content)
+        return list(self._iter_chapters(parts))
 
-        # 章节标题匹配模式（支持如：第1章．神奇的任务）
-        # 注意：这里不能使用 \s（会匹配换行），否则会把下一行正文误并入章节标题
-        chapter_pattern = r'(^[ \t\u3000]*第[一二三四五六七八九十百千万零\d]+章(?:[．。.:：、 \t\u3000—-]*[^\n]*)?$)'
+    def _iter_chapters(self, parts):
+        """
+        将 re.split 风格的片段序列（正文、标题交替）组装为章节
 
-        # 分割文本
-        parts = re.split(chapter_pattern, content, flags=re.MULTILINE)
+        Args:
+            parts: 片段可迭代对象，偶数下标为正文、奇数下标为标题行；
+                可以是列表，也可以是逐行读取时产生的生成器
 
+        Yields:
+            (章节标题, 章节内容) 元组，某章只有在下一个有效标题出现后才会产出
+        """
+        starts_with_heading = self.heading_matcher.starts_with_heading
+        parse_heading = self.heading_matcher.parse_heading
         current_title = None
-        seen_chapter_numbers = set()
+        seen_headings = set()
         current_content = []
 
-        for part in parts:
-            if not part.strip():
+        for i, part in enumerate(parts):
+            if not part or part.isspace():
                 continue
 
-            # 检查是否是章节标题
-            if re.match(chapter_pattern, part.strip(), flags=re.MULTILINE):
+            # 检查是否是章节标题：奇数下标必定是切分出的标题行；
+            # 正文片段去掉首尾空白后仍可能以标题行开头（如行首为不间断空格），需要复核
+            if i % 2 == 1 or starts_with_heading(part):
                 new_title = part.strip()
-                chapter_num = self.extract_chapter_number(new_title)
+                heading_key = parse_heading(new_title)
 
-                # 重复章节号仅保留第一次出现，后续同章节号标题行直接跳过
-                if chapter_num > 0 and chapter_num in seen_chapter_numbers:
+                # 同一标题格式下重复的章节号仅保留第一次出现，后续同章节号标题行直接跳过；
+                # 不同格式（如“卷一”与“第一章”）各自计数
+                if heading_key[1] > 0 and heading_key in seen_headings:
                     continue
 
                 # 保存上一章节
                 if current_title and current_content:
-                    chapters.append((current_title, '\n'.join(current_content)))
+                    yield current_title, '\n'.join(current_content)
 
                 current_title = new_title
-                if chapter_num > 0:
-                    seen_chapter_numbers.add(chapter_num)
+                if heading_key[1] > 0:
+                    seen_headings.add(heading_key)
                 current_content = []
             else:
                 # 章节内容
@@ -138,13 +826,143 @@ class NovelSplitter:
 
         # 保存最后一章
         if current_title and current_content:
-            chapters.append((current_title, '\n'.join(current_content)))
+            yield current_title, '\n'.join(current_content)
 
-        return chapters
+    def _iter_line_parts(self, lines):
+        """
+        逐行识别章节标题，产出与 split_chapters 中整篇切分完全相同的片段序列
+
+        标题行末尾的换行符归入下一个正文片段，与整篇 re.split 的切分位置保持一致。
+
+        Args:
+            lines: 文本行迭代器（保留行尾换行符，如文本模式打开的文件对象）
+
+        Yields:
+            正文片段与标题片段交替出现的字符串
+        """
+        is_heading = self.heading_matcher.is_heading
+        pending = []
+        for line in lines:
+            body = line.rstrip('\n')
+            if is_heading(body):
+                yield ''.join(pending)
+                yield body
+                pending = [line[len(body):]]
+            else:
+                pending.append(line)
+        yield ''.join(pending)
+
+    def measure(self, text: str) -> int:
+        """按预算单位计算一段正文的大小"""
+        if self.budget_unit == "tokens":
+            return estimate_tokens(text)
+        return count_visible_chars(text)
+
+    def _iter_groups(self, chapters):
+        """
+        把章节序列切成输出分组
+
+        Args:
+            chapters: (标题或章节号, 章节内容) 的可迭代对象，可以是流式生成器
+
+        Yields:
+            (该组第一章在全部章节中的下标, 该组章节列表)
+        """
+        if self.group_mode == "budget":
+            groups = iter_budget_groups(
+                chapters, lambda chapter: self.measure(chapter[1]),
+                self.target_size, self.min_size, self.max_size,
+            )
+        else:
+            groups = iter_budget_groups(
+                chapters, lambda chapter: 1, self.chapters_per_file, 0, self.chapters_per_file
+            )
+
+        start_idx = 0
+        for group in groups:
+            yield start_idx, group
+            start_idx += len(group)
 
-    def process(self) -> None:
+    def _write_group(self, output_path: Path, group_chapters: list, start_idx: int) -> tuple:
+        """
+        将一组章节写入输出文件
+
+        Args:
+            output_path: 输出目录
+            group_chapters: 该组的 (章节标题, 章节内容) 列表
+            start_idx: 该组第一章在全部章节中的下标（从0开始）
+
+        Returns:
+            (文件名, 起始章节号, 结束章节号)
+        """
+        return self._write_group_file(
+            output_path,
+            self.extract_chapter_number(group_chapters[0][0]),
+            self.extract_chapter_number(group_chapters[-1][0]),
+            start_idx,
+            len(group_chapters),
+            (chapter_content for _, chapter_content in group_chapters),
+        )
+
+    def _write_group_file(self, output_path: Path, start_chapter: int, end_chapter: int,
+                          start_idx: int, count: int, contents) -> tuple:
+        """
+        按起止章节号生成文件名并写入一组章节正文
+
+        Args:
+            output_path: 输出目录
+            start_chapter: 该组第一章的章节号（0 表示无法提取）
+            end_chapter: 该组最后一章的章节号（0 表示无法提取）
+            start_idx: 该组第一章在全部章节中的下标（从0开始）
+            count: 该组章节数
+            contents: 该组各章正文的可迭代对象
+
+        Returns:
+            (文件名, 起始章节号, 结束章节号)
+        """
+        end_idx = start_idx + count
+
+        # 如果无法提取章节号，使用索引代替
+        if start_chapter == 0:
+            start_chapter = start_idx + 1
+        if end_chapter == 0:
+            end_chapter = end_idx
+
+        # 生成文件名
+        filename = f"{start_chapter:05d}-{end_chapter:05d}.txt"
+        filepath = output_path / filename
+        chapter_range = f"第{start_chapter:05d}-{end_chapter:05d}章"
+
+        # 写入文件：过滤空行，不输出空行
+        output_lines = [chapter_range]
+        for chapter_content in contents:
+            output_lines.extend(
+                line for line in chapter_content.splitlines() if line.strip()
+            )
+
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(output_lines))
+
+        return filename, start_chapter, end_chapter
+
+    def detect_input_encoding(self) -> str:
+        """探测输入文件编码（只探测一次）"""
+        if self.encoding is None:
+            self.encoding = detect_encoding(self.input_file)
+            print(f"检测到文件编码: {self.encoding}")
+        return self.encoding
+
+    def _log_decode_stats(self) -> None:
+        """把本次处理中解码替换的字节数记入日志"""
+        self.replaced_bytes = take_replaced_byte_count()
+        print(f"文件编码: {self.encoding}，解码时替换了 {self.replaced_bytes} 个无法识别的字节")
+
+    def process(self) -> int:
         """
         执行分割处理
+
+        Returns:
+            检测到的章节数（出错或未检测到章节时为0）
         """
         try:
             # 检查输入文件是否存在
@@ -153,11 +971,14 @@ class NovelSplitter:
 
             print(f"正在读取文件: {self.input_file}")
 
-            # 读取文件内容（使用UTF-8编码）
-            with open(self.input_file, 'r', encoding='utf-8', errors='ignore') as f:
+            # 读取文件内容（自动探测编码，无法解码的字节替换为 U+FFFD 并计数）
+            encoding = self.detect_input_encoding()
+            take_replaced_byte_count()
+            with open(self.input_file, 'r', encoding=encoding, errors=DECODE_ERRORS) as f:
                 content = f.read()
 
             print(f"文件读取完成，共 {len(content)} 字符")
+            self._log_decode_stats()
 
             # 分割章节
             print("正在分析章节结构...")
@@ -165,53 +986,93 @@ class NovelSplitter:
 
             if not chapters:
                 print('未检测到章节标题，请检查文件格式是否为"第X章．标题"格式')
-                return
+                return 0
 
             print(f"共检测到 {len(chapters)} 个章节")
 
             # 创建输出目录
             output_path = Path(self.output_dir)
-            output_path.mkdir(exist_ok=True)
+            output_path.mkdir(parents=True, exist_ok=True)
             print(f"输出目录: {output_path.absolute()}")
 
-            # 按每N章分组保存
-            total_groups = (len(chapters) + self.chapters_per_file - 1) // self.chapters_per_file
+            # 按每N章或大小预算分组保存
+            total_groups = 0
+            for start_idx, group_chapters in self._iter_groups(chapters):
+                filename, start_chapter, end_chapter = self._write_group(
+                    output_path, group_chapters, start_idx
+                )
+                total_groups += 1
+                print(f"已保存: {filename} (包含第{start_chapter}章到第{end_chapter}章)")
 
-            for group_idx in range(total_groups):
-                start_idx = group_idx * self.chapters_per_file
-                end_idx = min(start_idx + self.chapters_per_file, len(chapters))
+            print(f"分割完成！共生成 {total_groups} 个文件，保存在 {output_path.absolute()} 目录下")
+            return len(chapters)
 
-                # 获取该组的章节
-                group_chapters = chapters[start_idx:end_idx]
+        except FileNotFoundError as e:
+            print(f"错误: {e}")
+        except PermissionError:
+            print(f"错误: 没有权限访问文件或目录")
+        except UnicodeDecodeError as e:
+            print(f"错误: 文件编码错误，请确保文件使用UTF-8编码 - {e}")
+        except Exception as e:
+            print(f"处理过程中发生错误: {e}")
 
-                # 获取起始和结束章节号
-                start_chapter = self.extract_chapter_number(group_chapters[0][0])
-                end_chapter = self.extract_chapter_number(group_chapters[-1][0])
+        return 0
 
-                # 如果无法提取章节号，使用索引代替
-                if start_chapter == 0:
-                    start_chapter = start_idx + 1
-                if end_chapter == 0:
-                    end_chapter = end_idx
+    def process_streaming(self, on_file: Optional[Callable[[Path], None]] = None) -> int:
+        """
+        流式执行分割处理
 
-                # 生成文件名
-                filename = f"{start_chapter:05d}-{end_chapter:05d}.txt"
-                filepath = output_path / filename
-                chapter_range = f"第{start_chapter:05d}-{end_chapter:05d}章"
+        逐行读取输入文件并增量识别章节标题，每凑满一个分组立即写盘，
+        峰值内存只与输出分组的大小有关；输出文件与 process() 逐字节一致。
 
-                # 写入文件：过滤空行，不输出空行
-                output_lines = [chapter_range]
-                for _, chapter_content in group_chapters:
-                    output_lines.extend(
-                        line for line in chapter_content.splitlines() if line.strip()
-                    )
+        Args:
+            on_file: 每写完一个输出文件后调用，参数为该文件路径（供流水线立即处理）
+
+        Returns:
+            检测到的章节数（出错或未检测到章节时为0）
+        """
+        try:
+            # 检查输入文件是否存在
+            if not os.path.exists(self.input_file):
+                raise FileNotFoundError(f"输入文件不存在: {self.input_file}")
 
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write('\n'.join(output_lines))
+            print(f"正在流式读取文件: {self.input_file}")
 
-                print(f"已保存: {filename} (包含第{start_chapter}章到第{end_chapter}章)")
+            output_path = Path(self.output_dir)
+            chapter_count = 0
+            group_count = 0
 
-            print(f"分割完成！共生成 {total_groups} 个文件，保存在 {output_path.absolute()} 目录下")
+            def counted_chapters(chapters):
+                nonlocal chapter_count
+                for chapter in chapters:
+                    if chapter_count == 0:
+                        # 检测到第一个章节后再创建输出目录，与 process() 行为一致
+                        output_path.mkdir(parents=True, exist_ok=True)
+                        print(f"输出目录: {output_path.absolute()}")
+                    chapter_count += 1
+                    yield chapter
+
+            encoding = self.detect_input_encoding()
+            take_replaced_byte_count()
+            with open(self.input_file, 'r', encoding=encoding, errors=DECODE_ERRORS) as f:
+                chapters = counted_chapters(self._iter_chapters(self._iter_line_parts(f)))
+                for start_idx, group_chapters in self._iter_groups(chapters):
+                    filename, start_chapter, end_chapter = self._write_group(
+                        output_path, group_chapters, start_idx
+                    )
+                    group_count += 1
+                    print(f"已保存: {filename} (包含第{start_chapter}章到第{end_chapter}章)")
+                    if on_file is not None:
+                        on_file(output_path / filename)
+
+            self._log_decode_stats()
+            if chapter_count == 0:
+                print('未检测到章节标题，请检查文件格式是否为"第X章．标题"格式')
+                return 0
+
+            print(f"共检测到 {chapter_count} 个章节")
+            print(f"分割完成！共生成 {group_count} 个文件，保存在 {output_path.absolute()} 目录下")
+            return chapter_count
 
         except FileNotFoundError as e:
             print(f"错误: {e}")
@@ -222,6 +1083,280 @@ class NovelSplitter:
         except Exception as e:
             print(f"处理过程中发生错误: {e}")
 
+        return 0
+
+    def index_file_path(self) -> Path:
+        """章节索引旁路文件路径（与输入文件同目录）"""
+        return Path(f"{self.input_file}.chapters.idx")
+
+    def utf8_source_path(self) -> str:
+        """
+        返回供 mmap 扫描的 UTF-8 文件路径
+
+        输入已是无 BOM 的 UTF-8 时直接使用原文件；否则分块转码为同目录下的 <输入文件>.utf8，
+        转码结果比原文件新时直接复用。
+        """
+        encoding = self.detect_input_encoding()
+        if encoding == 'utf-8':
+            return self.input_file
+
+        utf8_path = f"{self.input_file}.utf8"
+        if (not os.path.exists(utf8_path)
+                or os.path.getmtime(utf8_path) < os.path.getmtime(self.input_file)):
+            print(f"正在转码为 UTF-8: {utf8_path}")
+            transcode_to_utf8(self.input_file, utf8_path, encoding)
+        return utf8_path
+
+    def process_indexed(self) -> int:
+        """
+        基于 mmap 章节索引执行分割处理
+
+        首次运行对文件做一次字节级扫描并保存旁路索引；之后重跑（例如只修改了每文件章节数）
+        直接复用索引做偏移运算。每组输出只从 mmap 中切出该组章节的字节区间解码写入，
+        不会把整部小说解码到内存中；输出文件与 process() 逐字节一致。非 UTF-8 输入先分块转码。
+
+        Returns:
+            检测到的章节数（出错或未检测到章节时为0）
+        """
+        try:
+            # 检查输入文件是否存在
+            if not os.path.exists(self.input_file):
+                raise FileNotFoundError(f"输入文件不存在: {self.input_file}")
+
+            take_replaced_byte_count()
+            source_file = self.utf8_source_path()
+            stat = os.stat(source_file)
+            if stat.st_size == 0:
+                print('未检测到章节标题，请检查文件格式是否为"第X章．标题"格式')
+                return 0
+
+            index_file = self.index_file_path()
+            with open(source_file, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                index = ChapterIndex.load(
+                    index_file, stat.st_size, stat.st_mtime_ns, self.heading_matcher.formats
+                )
+                if index is None:
+                    print(f"正在建立章节索引: {self.input_file}")
+                    index = ChapterIndex.build(mm, stat.st_mtime_ns, self.heading_matcher)
+                    index.save(index_file)
+                    print(f"章节索引已保存: {index_file}")
+                else:
+                    print(f"复用章节索引: {index_file}")
+
+                chapters = index.chapters()
+                if not chapters:
+                    print('未检测到章节标题，请检查文件格式是否为"第X章．标题"格式')
+                    return 0
+
+                print(f"共检测到 {len(chapters)} 个章节")
+
+                # 创建输出目录
+                output_path = Path(self.output_dir)
+                output_path.mkdir(parents=True, exist_ok=True)
+                print(f"输出目录: {output_path.absolute()}")
+
+                # 逐章从 mmap 切出字节区间解码，内存中只保留正在分组的章节
+                decoded_chapters = (
+                    (number, '\n'.join(mm[start:end].decode('utf-8', errors=DECODE_ERRORS)
+                                       for start, end in ranges))
+                    for number, ranges in chapters
+                )
+                total_groups = 0
+                for start_idx, group_chapters in self._iter_groups(decoded_chapters):
+                    filename, start_chapter, end_chapter = self._write_group_file(
+                        output_path,
+                        group_chapters[0][0],
+                        group_chapters[-1][0],
+                        start_idx,
+                        len(group_chapters),
+                        (chapter_content for _, chapter_content in group_chapters),
+                    )
+                    total_groups += 1
+                    print(f"已保存: {filename} (包含第{start_chapter}章到第{end_chapter}章)")
+
+            self._log_decode_stats()
+            print(f"分割完成！共生成 {total_groups} 个文件，保存在 {output_path.absolute()} 目录下")
+            return len(chapters)
+
+        except FileNotFoundError as e:
+            print(f"错误: {e}")
+        except PermissionError:
+            print(f"错误: 没有权限访问文件或目录")
+        except Exception as e:
+            print(f"处理过程中发生错误: {e}")
+
+        return 0
+
+
+def configured_heading_formats() -> List[str]:
+    """按 HEADING_FORMATS 配置取出额外启用的章节标题格式"""
+    return [EXTRA_HEADING_FORMATS[name] for name in HEADING_FORMATS]
+
+
+def configured_group_options() -> dict:
+    """按 GROUP_MODE 等配置生成分割器的分组参数"""
+    return {
+        'group_mode': GROUP_MODE,
+        'budget_unit': BUDGET_UNIT,
+        'target_size': GROUP_TARGET_SIZE,
+        'min_size': GROUP_MIN_SIZE,
+        'max_size': GROUP_MAX_SIZE,
+    }
+
+
+def _run_splitter(splitter: NovelSplitter, split_mode: str) -> int:
+    """按分割模式执行分割器，返回检测到的章节数"""
+    if split_mode == "index":
+        return splitter.process_indexed()
+    if split_mode == "stream":
+        return splitter.process_streaming()
+    return splitter.process()
+
+
+def collect_novel_files(source: str) -> List[Path]:
+    """
+    收集待分割的小说文件
+
+    Args:
+        source: 目录（取其中全部 .txt 文件）或通配符
+
+    Returns:
+        按文件名排序的小说文件列表
+    """
+    if os.path.isdir(source):
+        return sorted(Path(source).glob("*.txt"), key=lambda p: p.name)
+    return sorted((Path(p) for p in glob.glob(source, recursive=True) if os.path.isfile(p)),
+                  key=lambda p: p.name)
+
+
+def batch_output_dirs(novel_files: List[Path], output_root: str) -> Dict[Path, Path]:
+    """
+    为批量分割的每部小说确定输出目录
+
+    通常为 output_root/<小说文件名>；递归通配符可能匹配到不同目录下的同名小说，
+    这些小说改用相对于共同上级目录的路径命名（如 a/书.txt -> output_root/a_书），避免多个进程写入同一目录。
+
+    Returns:
+        小说文件到输出目录的映射
+    """
+    stem_counts: Dict[str, int] = {}
+    for novel_file in novel_files:
+        stem_counts[novel_file.stem] = stem_counts.get(novel_file.stem, 0) + 1
+    duplicates = [novel_file for novel_file in novel_files if stem_counts[novel_file.stem] > 1]
+    root = Path(os.path.commonpath([str(p.resolve().parent) for p in duplicates])) if duplicates else None
+
+    output_dirs = {}
+    for novel_file in novel_files:
+        name = novel_file.stem
+        if stem_counts[name] > 1:
+            relative = novel_file.resolve().with_suffix('').relative_to(root)
+            name = "_".join(relative.parts)
+            print(f"警告: 存在多部同名小说 {novel_file.name}，{novel_file} 输出到 {Path(output_root) / name}")
+        output_dirs[novel_file] = Path(output_root) / name
+    return output_dirs
+
+
+def _split_one_novel(input_file: str, output_dir: str, chapters_per_file: int, split_mode: str) -> dict:
+    """
+    在子进程中分割单部小说（批量模式的工作函数）
+
+    分割器逐组打印的日志会被收集起来，只在未检测到章节时随结果返回，避免多进程输出交错。
+
+    Returns:
+        包含文件名、字节数、章节数、耗时、编码、替换字节数和日志的字典
+    """
+    start_time = time.perf_counter()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        splitter = NovelSplitter(
+            input_file=input_file,
+            output_dir=output_dir,
+            chapters_per_file=chapters_per_file,
+            heading_formats=configured_heading_formats(),
+            **configured_group_options(),
+        )
+        chapter_count = _run_splitter(splitter, split_mode)
+
+    return {
+        'input_file': input_file,
+        'output_dir': output_dir,
+        'size': os.path.getsize(input_file),
+        'chapters': chapter_count,
+        'seconds': time.perf_counter() - start_time,
+        'encoding': splitter.encoding,
+        'replaced_bytes': splitter.replaced_bytes,
+        'log': log.getvalue() if chapter_count == 0 else '',
+    }
+
+
+def batch_split(source: str, output_root: str = "TXT", chapters_per_file: int = CHAPTERS_PER_FILE,
+                split_mode: str = SPLIT_MODE, workers: int = 0) -> List[dict]:
+    """
+    使用进程池批量分割多部小说
+
+    Args:
+        source: 小说所在目录或通配符
+        output_root: 输出根目录，每部小说输出到 output_root/<小说文件名> 子目录（同名小说见 batch_output_dirs）
+        chapters_per_file: 每个文件包含的章节数
+        split_mode: 分割模式（"full" / "stream" / "index"）
+        workers: 进程数（0 表示使用全部 CPU 核心）
+
+    Returns:
+        每部小说的分割结果列表（按完成顺序）
+    """
+    novel_files = collect_novel_files(source)
+    if not novel_files:
+        print(f"错误: 未找到待分割的小说文件: {source}")
+        return []
+
+    output_dirs = batch_output_dirs(novel_files, output_root)
+    workers = workers or os.cpu_count() or 1
+    # 大文件先提交，避免最后只剩一个大文件在单核上跑
+    novel_files.sort(key=lambda p: p.stat().st_size, reverse=True)
+    print(f"批量分割: 共 {len(novel_files)} 部小说，使用 {workers} 个进程")
+
+    results = []
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                _split_one_novel,
+                str(novel_file),
+                str(output_dirs[novel_file]),
+                chapters_per_file,
+                split_mode,
+            ): novel_file
+            for novel_file in novel_files
+        }
+        for future in as_completed(futures):
+            novel_file = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"[{len(results) + 1}/{len(novel_files)}] 失败: {novel_file.name} - {e}")
+                continue
+
+            results.append(result)
+            size_mb = result['size'] / 1024 / 1024
+            print(
+                f"[{len(results)}/{len(novel_files)}] {novel_file.name}: "
+                f"{result['chapters']} 章, {size_mb:.1f} MB, 耗时 {result['seconds']:.2f}s, "
+                f"编码 {result['encoding']}, 替换 {result['replaced_bytes']} 字节"
+            )
+            if result['log']:
+                print(result['log'].rstrip())
+
+    elapsed = time.perf_counter() - start_time
+    total_mb = sum(result['size'] for result in results) / 1024 / 1024
+    total_chapters = sum(result['chapters'] for result in results)
+    throughput = total_mb / elapsed if elapsed > 0 else 0.0
+    print(
+        f"批量分割完成！{len(results)} 部小说，共 {total_chapters} 章，{total_mb:.1f} MB，"
+        f"总耗时 {elapsed:.2f}s，吞吐 {throughput:.1f} MB/s"
+    )
+    return results
+
 
 def main():
     """
@@ -236,14 +1371,26 @@ def main():
 
     # =================================================
 
+    if BATCH_INPUT:
+        batch_split(
+            BATCH_INPUT,
+            output_root=BATCH_OUTPUT_ROOT,
+            chapters_per_file=CHAPTERS_PER_FILE,
+            split_mode=SPLIT_MODE,
+            workers=BATCH_WORKERS,
+        )
+        return
+
     # 创建分割器实例并执行
     splitter = NovelSplitter(
         input_file=INPUT_FILE,
         output_dir=OUTPUT_DIR,
-        chapters_per_file=CHAPTERS_PER_FILE
+        chapters_per_file=CHAPTERS_PER_FILE,
+        heading_formats=configured_heading_formats(),
+        **configured_group_options(),
     )
 
-    splitter.process()
+    _run_splitter(splitter, SPLIT_MODE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+"""
+分割程序性能基准
+功能：生成合成小说，对比 HeadingMatcher 与原先逐次 re.split/re.match/re.search 实现的章节识别速度；
+      对比新旧中文数字转换的速度（转换的正确性见 测试_中文数字.py）
+"""
+
+import random
+import re
+import time
+
+from 分割 import NovelSplitter, chinese_to_num, num_to_chinese
+
+# 合成小说章节数
+CHAPTER_COUNT = 10000
+# 每章正文段落数
+PARAGRAPHS_PER_CHAPTER = 30
+# 每种实现重复运行次数（取最快一次）
+ROUNDS = 5
+# 每个分组包含的章节数（模拟分组时重复提取起止章节号）
+CHAPTERS_PER_FILE = 20
+
+_LEGACY_PATTERN = r'(^[ \t　]*第[一二三四五六七八九十百千万零\d]+章(?:[．。.:：、 \t　—-]*[^\n]*)?$)'
+def build_synthetic_novel(chapter_count: int = CHAPTER_COUNT, seed: int = 1) -> str:
+    """生成合成小说：阿拉伯数字与中文数字标题交替，每章若干段正文"""
+    rng = random.Random(seed)
+    lines = ['合成小说', '']
+    for num in range(1, chapter_count + 1):
+        number = str(num) if num % 2 else num_to_chinese(num)
+        lines.append(f'第{number}章．标题{num}')
+        for _ in range(PARAGRAPHS_PER_CHAPTER):
+            lines.append('　　' + '正文内容。' * rng.randint(4, 20))
+    return '\n'.join(lines)
+
+
+def _legacy_chinese_to_num(chinese: str) -> int:
+    chinese_nums = {
+        '零': 0, '一': 1, '二': 2, '三': 3, '四': 4,
+        '五': 5, '六': 6, '七': 7, '八': 8, '九': 9,
+        '十': 10, '百': 100, '千': 1000, '万': 10000
+    }
+    if not chinese:
+        return 0
+    if chinese.isdigit():
+        return int(chinese)
+    result = 0
+    temp = 0
+    for char in chinese:
+        if char in chinese_nums:
+            num = chinese_nums[char]
+            if num >= 10:
+                if temp == 0:
+                    temp = 1
+                result += temp * num
+                temp = 0
+            else:
+                temp = temp * 10 + num if temp > 0 else num
+    result += temp
+    return result
+
+
+def _legacy_extract_chapter_number(title: str) -> int:
+    match = re.search(r'第([一二三四五六七八九十百千万零\d]+)章', title)
+    if match:
+        return _legacy_chinese_to_num(match.group(1))
+    return 0
+
+
+def _legacy_split_chapters(content: str) -> list:
+    """原先的实现：每个片段都重新 re.match，每个标题都重新 re.search"""
+    chapters = []
+    parts = re.split(_LEGACY_PATTERN, content, flags=re.MULTILINE)
+    current_title = None
+    seen_chapter_numbers = set()
+    current_content = []
+    for part in parts:
+        if not part.strip():
+            continue
+        if re.match(_LEGACY_PATTERN, part.strip(), flags=re.MULTILINE):
+            new_title = part.strip()
+            chapter_num = _legacy_extract_chapter_number(new_title)
+            if chapter_num > 0 and chapter_num in seen_chapter_numbers:
+                continue
+            if current_title and current_content:
+                chapters.append((current_title, '\n'.join(current_content)))
+            current_title = new_title
+            if chapter_num > 0:
+                seen_chapter_numbers.add(chapter_num)
+            current_content = []
+        else:
+            clean_part = part.strip('\r\n')
+            if current_title and clean_part.strip():
+                current_content.append(clean_part)
+    if current_title and current_content:
+        chapters.append((current_title, '\n'.join(current_content)))
+    return chapters
+
+
+def _group_numbers(chapters: list, extract) -> list:
+    """模拟分组写盘时对每组起止标题的章节号提取"""
+    numbers = []
+    for start in range(0, len(chapters), CHAPTERS_PER_FILE):
+        group = chapters[start:start + CHAPTERS_PER_FILE]
+        numbers.append((extract(group[0][0]), extract(group[-1][0])))
+    return numbers
+
+
+def run_legacy(content: str) -> tuple:
+    chapters = _legacy_split_chapters(content)
+    return chapters, _group_numbers(chapters, _legacy_extract_chapter_number)
+
+
+def run_matcher(content: str) -> tuple:
+    splitter = NovelSplitter('', chapters_per_file=CHAPTERS_PER_FILE)
+    chapters = splitter.split_chapters(content)
+    return chapters, _group_numbers(chapters, splitter.extract_chapter_number)
+
+
+def _best_seconds(func, content: str) -> tuple:
+    best = None
+    result = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        result = func(content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_chinese_numerals() -> None:
+    """对比新旧中文数字转换的速度（1~9999，章节号最常见的范围）"""
+    numerals = [num_to_chinese(num) for num in range(1, 10000)]
+    timings = []
+    for name, func in (("原实现", _legacy_chinese_to_num), ("查表实现", chinese_to_num)):
+        best = None
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            for numeral in numerals:
+                func(numeral)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings.append(best)
+        print(f"{name:<16} {best * 1000:8.1f} ms  {len(numerals) / best:10.0f} 个/秒")
+    print(f"加速比: {timings[0] / timings[1]:.2f}x")
+
+
+def main():
+    bench_chinese_numerals()
+
+    content = build_synthetic_novel()
+    print(f"合成小说: {CHAPTER_COUNT} 章, {len(content)} 字符, 每种实现运行 {ROUNDS} 次取最快")
+
+    legacy_seconds, legacy_result = _best_seconds(run_legacy, content)
+    matcher_seconds, matcher_result = _best_seconds(run_matcher, content)
+    if legacy_result != matcher_result:
+        print("错误: 两种实现的分割结果不一致")
+        return
+
+    for name, seconds in (("原实现", legacy_seconds), ("HeadingMatcher", matcher_seconds)):
+        print(f"{name:<16} {seconds * 1000:8.1f} ms  {CHAPTER_COUNT / seconds:10.0f} 章/秒")
+    print(f"加速比: {legacy_seconds / matcher_seconds:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
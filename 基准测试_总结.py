@@ -0,0 +1,307 @@
+"""
+总结程序性能基准
+功能：启动本地模拟的 OpenAI 兼容接口（/v1/chat/completions），可配置延迟分布、429/5xx 注入、
+      Retry-After 与 SSE 流式输出；用 分割.py 把合成小说切成 TXT 后调用 总结opencode.summarize_files，
+      统计每分钟文件数、请求延迟 p50/p95/p99、重试次数与尾部耗时。全程离线，可作为回归门禁
+"""
+
+import contextlib
+import io
+import json
+import math
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import 总结opencode as summarizer
+from 分割 import NovelSplitter
+from 基准测试_分割 import build_synthetic_novel
+
+# 合成小说章节数与每个 TXT 文件的章节数（决定文件数）
+CHAPTER_COUNT = 2000
+CHAPTERS_PER_FILE = 10
+# 依次测试的引擎
+ENGINES = ["threads", "asyncio"]
+# 模拟接口场景：延迟为对数正态分布（中位数 latency_median 秒，离散度 latency_sigma，上限 LATENCY_MAX）；
+# p429 / p5xx 为注入错误的概率，retry_after 为 429/503 响应携带的 Retry-After 秒数（None 表示不带）
+SCENARIOS = [
+    {"name": "正常", "latency_median": 0.3, "latency_sigma": 0.5, "p429": 0.0, "p5xx": 0.0,
+     "retry_after": None, "stream": False},
+    {"name": "限流", "latency_median": 0.3, "latency_sigma": 0.5, "p429": 0.1, "p5xx": 0.0,
+     "retry_after": 1, "stream": False},
+    {"name": "故障", "latency_median": 0.3, "latency_sigma": 0.5, "p429": 0.0, "p5xx": 0.05,
+     "retry_after": None, "stream": False},
+    {"name": "长尾", "latency_median": 0.3, "latency_sigma": 1.2, "p429": 0.0, "p5xx": 0.0,
+     "retry_after": None, "stream": False},
+    {"name": "流式", "latency_median": 0.3, "latency_sigma": 0.5, "p429": 0.0, "p5xx": 0.0,
+     "retry_after": None, "stream": True},
+]
+LATENCY_MAX = 10.0
+# 模拟总结的字数（需不少于 总结opencode 的最短长度 Words // 4）
+SUMMARY_CHARS = 800
+# 流式输出：每块字数与块间隔（秒）
+STREAM_CHUNK_CHARS = 40
+STREAM_CHUNK_DELAY = 0.002
+# 模拟的 APIKey 个数
+KEY_COUNT = 4
+# 基准中的重试间隔（秒），远小于线上配置，避免注入错误时等待过久
+RETRY_DELAY = 1
+# 回归门禁：任一场景每分钟文件数低于该值则以退出码 1 结束（0 表示不检查）
+MIN_FILES_PER_MINUTE = 0
+# 回归门禁：任一场景失败文件数超过该值则以退出码 1 结束
+MAX_FAILED_FILES = 0
+# 结果另存为 JSON（空字符串表示不保存），便于不同提交之间对比
+REPORT_FILE = ""
+# 是否隐藏 总结opencode 的运行日志
+QUIET = True
+SEED = 1
+
+
+class MockChatServer:
+    """本地模拟的 /v1/chat/completions：按场景注入延迟和错误，并记录每个请求的状态与耗时"""
+
+    def __init__(self, scenario: dict, seed: int = SEED):
+        self.scenario = scenario
+        self.records: List[dict] = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-chat-server", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _draw(self) -> tuple:
+        # 抽取本次请求的延迟和结果（状态码）
+        scenario = self.scenario
+        with self._lock:
+            latency = self._rng.lognormvariate(math.log(scenario["latency_median"]), scenario["latency_sigma"])
+            roll = self._rng.random()
+        if roll < scenario["p429"]:
+            status = 429
+        elif roll < scenario["p429"] + scenario["p5xx"]:
+            status = 503
+        else:
+            status = 200
+        return min(latency, LATENCY_MAX), status
+
+    def _record(self, started: float, status: int) -> None:
+        finished = time.monotonic()
+        with self._lock:
+            self.records.append({"status": status, "start": started, "end": finished, "latency": finished - started})
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                started = time.monotonic()
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                latency, status = mock._draw()
+                time.sleep(latency)
+                if status != 200:
+                    self._send_json(status, {"error": {"message": f"injected {status}"}})
+                    mock._record(started, status)
+                    return
+                request = json.loads(body)
+                summary = _mock_summary(zlib.crc32(body))
+                if request.get("stream"):
+                    self._send_stream(summary)
+                else:
+                    self._send_json(200, {
+                        "model": request.get("model", ""),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": summary},
+                                     "finish_reason": "stop"}],
+                    })
+                mock._record(started, status)
+
+            def _send_json(self, status: int, data: dict) -> None:
+                out = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                if status in (429, 503) and mock.scenario["retry_after"] is not None:
+                    self.send_header("Retry-After", str(mock.scenario["retry_after"]))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def _send_stream(self, summary: str) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for start in range(0, len(summary), STREAM_CHUNK_CHARS):
+                        chunk = {"choices": [{"index": 0, "delta": {"content": summary[start:start + STREAM_CHUNK_CHARS]}}]}
+                        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        time.sleep(STREAM_CHUNK_DELAY)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前截断
+                    pass
+
+        return Handler
+
+
+_MOCK_CHARS = "林逸楚梦瑶陈雨舒学校宿舍老师同学家族势力保镖任务危机冲突化解误会真相计划行动夜晚城市公司酒店比赛考试旅行朋友敌人报仇秘密身份功夫医术合作背叛救援约定回忆告白离开归来决定发现追查调查交易试探隐瞒"
+
+
+def _mock_summary(seed: int) -> str:
+    # 不重复的假总结，避免触发 总结opencode.py 的重复检测
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < SUMMARY_CHARS:
+        sentence = "".join(rng.choice(_MOCK_CHARS) for _ in range(rng.randint(8, 20))) + rng.choice("，。")
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)[:SUMMARY_CHARS - 1] + "。"
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+def prepare_files(work_dir: Path) -> List[Path]:
+    """生成合成小说并用 分割.py 切成 TXT 文件"""
+    novel = work_dir / "合成小说.txt"
+    novel.write_text(build_synthetic_novel(CHAPTER_COUNT, seed=SEED), encoding="utf-8")
+    splitter = NovelSplitter(
+        input_file=str(novel), output_dir=str(work_dir / "TXT"), chapters_per_file=CHAPTERS_PER_FILE
+    )
+    splitter.process()
+    return summarizer.list_txt_files(work_dir / "TXT")
+
+
+def run_scenario(files: List[Path], work_dir: Path, scenario: dict, engine: str) -> dict:
+    """在指定场景下用指定引擎总结全部文件，返回统计结果"""
+    server = MockChatServer(scenario)
+    server.start()
+    summarizer.API_URL = server.url
+    summarizer.API_KEYS = [f"sk-bench-{i}" for i in range(1, KEY_COUNT + 1)]
+    summarizer.BASE_DIR = work_dir
+    summarizer.SUMMARY_CACHE_ENABLED = False
+    summarizer.RETRY_DELAY = RETRY_DELAY
+    summarizer.FILE_RETRY_DELAY = RETRY_DELAY
+    summarizer.STREAM_MODE = scenario["stream"]
+    # 每次运行使用新的 APIKey 池，避免上一场景的冷却和熔断状态影响结果
+    summarizer._key_pool = None
+    output_file = work_dir / f"总结_{engine}.txt"
+    log = io.StringIO()
+    started = time.monotonic()
+    try:
+        with contextlib.redirect_stdout(log) if QUIET else contextlib.nullcontext():
+            summarizer.summarize_files(files, output_file, clean_tmp=True, tmp_exists_mode=1, engine=engine)
+    finally:
+        wall = time.monotonic() - started
+        server.stop()
+
+    manifest = summarizer.PartManifest(work_dir / "tmp")
+    failed = sum(1 for record in manifest.records.values() if record.get("status") != "done")
+    failed += len(files) - len(manifest.records)
+    file_latencies = [float(record.get("latency") or 0.0) for record in manifest.records.values()]
+
+    records = server.records
+    statuses: Dict[int, int] = {}
+    for record in records:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+    latencies = [record["latency"] for record in records]
+    # 尾部耗时：90% 的成功请求完成之后，到最后一个成功请求完成之间的时间
+    done_times = sorted(record["end"] - started for record in records if record["status"] == 200)
+    tail = done_times[-1] - _percentile(done_times, 90) if done_times else 0.0
+    return {
+        "scenario": scenario["name"],
+        "engine": engine,
+        "files": len(files),
+        "failed": failed,
+        "wall_seconds": wall,
+        "files_per_minute": len(files) / wall * 60 if wall > 0 else 0.0,
+        "requests": len(records),
+        "retries": len(records) - statuses.get(200, 0),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "latency_p50": _percentile(latencies, 50),
+        "latency_p95": _percentile(latencies, 95),
+        "latency_p99": _percentile(latencies, 99),
+        "file_latency_p99": _percentile(file_latencies, 99),
+        "tail_seconds": tail,
+    }
+
+
+def _print_result(result: dict) -> None:
+    status_text = " ".join(f"{status}×{count}" for status, count in result["statuses"].items())
+    print(
+        f"{result['scenario']:<4} {result['engine']:<8} "
+        f"{result['files_per_minute']:8.0f} 文件/分  用时 {result['wall_seconds']:6.1f}s  "
+        f"请求延迟 p50/p95/p99 {result['latency_p50']:.2f}/{result['latency_p95']:.2f}/{result['latency_p99']:.2f}s  "
+        f"文件 p99 {result['file_latency_p99']:.2f}s  重试 {result['retries']:3d}  "
+        f"尾部 {result['tail_seconds']:5.1f}s  失败 {result['failed']}  [{status_text}]",
+        flush=True,
+    )
+
+
+def main() -> int:
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_summary_") as tmp:
+        work_dir = Path(tmp)
+        with contextlib.redirect_stdout(io.StringIO()):
+            files = prepare_files(work_dir)
+        print(
+            f"合成小说: {CHAPTER_COUNT} 章，每 {CHAPTERS_PER_FILE} 章一个文件，共 {len(files)} 个文件，"
+            f"{KEY_COUNT} 个模拟 key，线程 {summarizer.THREAD_COUNT} / asyncio 并发 {summarizer.ASYNC_CONCURRENCY}"
+        )
+        for scenario in SCENARIOS:
+            for engine in ENGINES:
+                result = run_scenario(files, work_dir, scenario, engine)
+                _print_result(result)
+                results.append(result)
+
+    if REPORT_FILE:
+        Path(REPORT_FILE).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"结果已保存到：{REPORT_FILE}")
+
+    problems = []
+    for result in results:
+        name = f"{result['scenario']}/{result['engine']}"
+        if result["failed"] > MAX_FAILED_FILES:
+            problems.append(f"{name} 失败 {result['failed']} 个文件（上限 {MAX_FAILED_FILES}）")
+        if MIN_FILES_PER_MINUTE > 0 and result["files_per_minute"] < MIN_FILES_PER_MINUTE:
+            problems.append(
+                f"{name} 仅 {result['files_per_minute']:.0f} 文件/分（下限 {MIN_FILES_PER_MINUTE}）"
+            )
+    for problem in problems:
+        print(f"错误: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,12 @@
 ﻿import json
+import os
+import queue
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 try:
     import requests  # type: ignore
@@ -28,6 +33,159 @@ REQUEST_TIMEOUT = 40
 RETRY_TIMES = 3
 RETRY_DELAY = 3
 
+# 同时处理的文件数
+THREAD_COUNT = 5
+# 对冲请求：当前模型超过对冲阈值仍未返回时，再向下一个模型发一个请求，先得到合格总结的胜出；
+# 其余模型不再重试，已在途的请求无法中断，结束后丢弃结果且不计入成绩表
+HEDGE_ENABLED = True
+# 对冲阈值取该模型成功请求延迟的分位数；样本少于 HEDGE_MIN_SAMPLES 时使用 HEDGE_DEFAULT_SECONDS
+HEDGE_PERCENTILE = 90
+HEDGE_MIN_SAMPLES = 5
+HEDGE_DEFAULT_SECONDS = 20
+# 同一文件最多同时在途的模型数
+HEDGE_MAX_PARALLEL = 2
+# 合格总结的最少字数；所有模型都不合格时退而使用最长的一份
+MIN_ACCEPT_CHARS = MIN_SUMMARY_CHARS // 2
+# 模型成绩表：按接口地址和模型记录成功率、延迟、输出长度和过短率，跨运行保存
+SCOREBOARD_FILE = Path("model_scoreboard.json")
+# 每个模型保留的最近延迟样本数
+SCOREBOARD_WINDOW = 200
+# 探索流量占比：这部分文件优先交给样本最少的模型，避免成绩表只认一个模型
+ROUTER_EXPLORE_RATE = 0.1
+
+
+_log_lock = threading.Lock()
+
+
+def _log(message: str) -> None:
+    # 文件线程和对冲线程同时输出：加时间戳，整行在锁内写出并立即刷新，避免多行交错
+    with _log_lock:
+        print(f"{time.strftime('%H:%M:%S')} {message}", flush=True)
+
+
+class RequestCancelled(Exception):
+    """对冲中已有其他模型胜出，本模型不再发起请求或重试"""
+
+
+class ModelScoreboard:
+    """
+    模型成绩表：按（接口地址, 模型）记录成功、失败、过短次数，最近的成功延迟和输出字数，保存到 SCOREBOARD_FILE。
+    用于计算对冲阈值，并按“得到合格总结的期望耗时”为每个文件选择模型。
+    """
+
+    def __init__(self, path: Path = SCOREBOARD_FILE, endpoint: Optional[str] = None):
+        self.path = path
+        self.endpoint = endpoint or API_URL
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+        self._entries: Dict[str, dict] = {}
+        if path.exists():
+            try:
+                self._entries = json.loads(path.read_text(encoding="utf-8")).get("entries", {})
+            except (OSError, ValueError) as exc:
+                print(f"模型成绩表读取失败，重新统计：{exc}")
+
+    def _entry(self, model: str) -> dict:
+        key = f"{self.endpoint} {model}"
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {
+                "endpoint": self.endpoint,
+                "model": model,
+                "success": 0,
+                "failure": 0,
+                "too_short": 0,
+                "output_chars": 0,
+                "latencies": [],
+            }
+        return entry
+
+    def record(self, model: str, latency: float, outcome: str, output_chars: int = 0) -> None:
+        # outcome：ok（合格）、short（返回了但过短）、fail（请求失败）
+        with self._lock:
+            entry = self._entry(model)
+            if outcome == "fail":
+                entry["failure"] += 1
+                return
+            entry["success"] += 1
+            entry["too_short"] += int(outcome == "short")
+            entry["output_chars"] += output_chars
+            entry["latencies"] = (entry["latencies"] + [round(latency, 3)])[-SCOREBOARD_WINDOW:]
+
+    def _percentile(self, model: str, pct: float) -> Optional[float]:
+        samples = sorted(self._entry(model)["latencies"])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def attempts(self, model: str) -> int:
+        with self._lock:
+            entry = self._entry(model)
+            return entry["success"] + entry["failure"]
+
+    def hedge_delay(self, model: str) -> float:
+        with self._lock:
+            value = self._percentile(model, HEDGE_PERCENTILE)
+        return HEDGE_DEFAULT_SECONDS if value is None else value
+
+    def expected_seconds(self, model: str) -> float:
+        # 得到一次合格总结的期望耗时 ≈ 延迟中位数 / 合格率（合格率做加一平滑）
+        with self._lock:
+            median = self._percentile(model, 50)
+            entry = self._entry(model)
+            accepted = entry["success"] - entry["too_short"]
+            attempts = entry["success"] + entry["failure"]
+        if median is None:
+            median = HEDGE_DEFAULT_SECONDS
+        return median / ((accepted + 1) / (attempts + 2))
+
+    def ordered(self, models: List[str]) -> List[str]:
+        # 稳定排序：样本不足的模型期望耗时相同，保持传入的轮换顺序
+        return sorted(models, key=self.expected_seconds)
+
+    def route(self, models: List[str]) -> List[str]:
+        # 按期望耗时排序；小部分流量用于探索，把样本最少的模型提到最前
+        order = self.ordered(models)
+        if len(order) > 1 and self._rng.random() < ROUTER_EXPLORE_RATE:
+            explore = min(order[1:], key=lambda model: (self.attempts(model), self._rng.random()))
+            order.remove(explore)
+            order.insert(0, explore)
+        return order
+
+    def save(self) -> None:
+        with self._lock:
+            data = json.dumps(
+                {"updated": time.strftime("%Y-%m-%d %H:%M:%S"), "entries": self._entries},
+                ensure_ascii=False,
+                indent=1,
+            )
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(data, encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    def report(self, models: List[str]) -> None:
+        print("模型成绩表（按期望耗时排序）：")
+        for model in self.ordered(models):
+            with self._lock:
+                entry = self._entry(model)
+                p50 = self._percentile(model, 50)
+                p95 = self._percentile(model, 95)
+            attempts = entry["success"] + entry["failure"]
+            if not attempts:
+                continue
+            success = entry["success"]
+
+            def seconds_text(value: Optional[float]) -> str:
+                return f"{value:.1f}s" if value is not None else "-"
+
+            print(
+                f"  {model}: 请求 {attempts} 次，成功率 {success / attempts:.0%}，"
+                f"过短率 {entry['too_short'] / max(1, success):.0%}，"
+                f"延迟 p50 {seconds_text(p50)} / p95 {seconds_text(p95)}，"
+                f"平均输出 {entry['output_chars'] // max(1, success)} 字，"
+                f"期望耗时 {self.expected_seconds(model):.1f}s"
+            )
+
 
 def find_input_dir() -> Path:
     candidates = [Path("txt"), Path("TXT")]
@@ -82,7 +240,7 @@ def _post_with_urllib(payload: dict, headers: dict) -> dict:
     return json.loads(body)
 
 
-def call_api(messages: list, model: str) -> str:
+def call_api(messages: list, model: str, cancel: Optional[threading.Event] = None) -> str:
     if not API_KEY:
         raise ValueError("API_KEY 为空，请在脚本中填写或改为环境变量")
 
@@ -94,6 +252,9 @@ def call_api(messages: list, model: str) -> str:
 
     last_err = None
     for attempt in range(1, RETRY_TIMES + 1):
+        # 已在途的 HTTP 请求无法中断，只在发起请求前和重试等待中检查是否已被取消
+        if cancel is not None and cancel.is_set():
+            raise RequestCancelled(model)
         try:
             if requests is not None:
                 response = requests.post(
@@ -110,48 +271,133 @@ def call_api(messages: list, model: str) -> str:
         except Exception as exc:
             last_err = exc
             if attempt < RETRY_TIMES:
-                time.sleep(RETRY_DELAY)
+                if cancel is not None:
+                    cancel.wait(RETRY_DELAY)
+                else:
+                    time.sleep(RETRY_DELAY)
 
     raise RuntimeError(f"API 调用失败（模型: {model}）：{last_err}")
 
 
+def _is_acceptable(summary: str) -> bool:
+    return len(summary.strip()) >= MIN_ACCEPT_CHARS
+
+
+def summarize_with_hedge(
+    messages: list, model_try_order: List[str], stats: ModelScoreboard, name: str
+) -> Tuple[str, str]:
+    """
+    按顺序尝试模型：当前模型失败就换下一个；开启对冲时，最近发出的请求超过该模型的对冲阈值仍未返回，
+    也提前向下一个模型发请求。先得到合格总结的模型胜出，其余模型不再重试；
+    已在途的落败请求会自行跑完，但结果丢弃，延迟和结果也不写入成绩表，以免按“最后返回”的模型偏置路由。
+
+    Returns:
+        (模型, 总结)
+    """
+    cancel = threading.Event()
+    results: "queue.Queue[tuple]" = queue.Queue()
+    pending = list(model_try_order)
+    in_flight = 0
+    last_model = ""
+    last_launch = 0.0
+
+    def attempt(model: str) -> None:
+        started = time.monotonic()
+        try:
+            summary = call_api(messages, model, cancel)
+        except RequestCancelled as exc:
+            results.put((model, None, exc))
+        except Exception as exc:
+            if not cancel.is_set():
+                stats.record(model, time.monotonic() - started, "fail")
+            results.put((model, None, exc))
+        else:
+            # 胜者选定后才结束的请求不计入成绩表
+            if not cancel.is_set():
+                outcome = "ok" if _is_acceptable(summary) else "short"
+                stats.record(model, time.monotonic() - started, outcome, len(summary.strip()))
+            results.put((model, summary, None))
+
+    def launch(reason: str) -> None:
+        nonlocal in_flight, last_model, last_launch
+        model = pending.pop(0)
+        _log(f"  {name} 尝试模型: {model}{reason}")
+        threading.Thread(target=attempt, args=(model,), name=f"summary-{model}", daemon=True).start()
+        in_flight += 1
+        last_model = model
+        last_launch = time.monotonic()
+
+    fallback: Optional[Tuple[str, str]] = None
+    last_err = None
+    launch("")
+    while in_flight:
+        timeout = None
+        if HEDGE_ENABLED and pending and in_flight < HEDGE_MAX_PARALLEL:
+            timeout = max(0.0, stats.hedge_delay(last_model) - (time.monotonic() - last_launch))
+        try:
+            model, summary, exc = results.get(timeout=timeout)
+        except queue.Empty:
+            launch(f"（{last_model} 超过对冲阈值 {stats.hedge_delay(last_model):.1f}s 未返回）")
+            continue
+        in_flight -= 1
+        if summary is not None and _is_acceptable(summary):
+            cancel.set()
+            return model, summary
+        if summary is not None:
+            _log(f"  {name} 模型 {model} 总结过短（{len(summary.strip())} 字），换下一个模型")
+            if fallback is None or len(summary) > len(fallback[1]):
+                fallback = (model, summary)
+        else:
+            last_err = exc
+            _log(f"  {name} 模型失败: {model} -> {exc}")
+        if pending and in_flight < HEDGE_MAX_PARALLEL:
+            launch("")
+
+    cancel.set()
+    if fallback is not None:
+        return fallback
+    raise RuntimeError(f"{name} 总结失败，所有模型均不可用：{last_err}")
+
+
+def summarize_one_file(file_path: Path, idx: int, total: int, stats: ModelScoreboard) -> str:
+    _log(f"[{idx}/{total}] 处理 {file_path.name}")
+    text = read_text(file_path)
+    messages = build_messages(text)
+
+    # 按成绩表选择模型；没有样本的模型之间仍按文件序号轮换起始模型。当前模型失败后按顺序切到下一个模型
+    start_model_idx = (idx - 1) % len(MODELS)
+    model_try_order = stats.route(MODELS[start_model_idx:] + MODELS[:start_model_idx])
+
+    used_model, summary = summarize_with_hedge(messages, model_try_order, stats, file_path.name)
+    _log(f"[{idx}/{total}] 完成 {file_path.name}：{used_model}")
+    return f"第{file_path.name}章总结：{used_model}\n{'=' * 40}\n{summary}"
+
+
 def summarize_files(input_dir: Path, output_file: Path) -> None:
     files = list_txt_files(input_dir)
-    print(f"发现 {len(files)} 个 TXT 文件，开始总结...")
+    print(f"发现 {len(files)} 个 TXT 文件，开始总结（{THREAD_COUNT} 个文件并发）...")
 
-    # 每次运行先清空旧文件，再逐条追加，避免中途失败导致全部丢失
+    # 每次运行先清空旧文件，再按顺序逐条追加，避免中途失败导致全部丢失
     output_file.write_text("", encoding="utf-8")
 
-    for idx, file_path in enumerate(files, start=1):
-        print(f"[{idx}/{len(files)}] 处理 {file_path.name}")
-        text = read_text(file_path)
-        messages = build_messages(text)
-
-        # 每个文件轮换起始模型；当前模型失败后按顺序切到下一个模型重试
-        start_model_idx = (idx - 1) % len(MODELS)
-        model_try_order = MODELS[start_model_idx:] + MODELS[:start_model_idx]
-
-        summary = None
-        used_model = None
-        last_err = None
-        for model in model_try_order:
-            try:
-                print(f"  尝试模型: {model}")
-                summary = call_api(messages, model)
-                used_model = model
-                break
-            except Exception as exc:
-                last_err = exc
-                print(f"  模型失败: {model} -> {exc}")
-
-        if summary is None or used_model is None:
-            raise RuntimeError(f"{file_path.name} 总结失败，所有模型均不可用：{last_err}")
-
-        part = f"第{file_path.name}章总结：{used_model}\n{'=' * 40}\n{summary}"
-        with output_file.open("a", encoding="utf-8") as f:
-            if idx > 1:
-                f.write("\n\n")
-            f.write(part)
+    stats = ModelScoreboard()
+    executor = ThreadPoolExecutor(max_workers=THREAD_COUNT, thread_name_prefix="summary-file")
+    try:
+        futures = [
+            executor.submit(summarize_one_file, file_path, idx, len(files), stats)
+            for idx, file_path in enumerate(files, start=1)
+        ]
+        for idx, future in enumerate(futures, start=1):
+            part = future.result()
+            with output_file.open("a", encoding="utf-8") as f:
+                if idx > 1:
+                    f.write("\n\n")
+                f.write(part)
+            stats.save()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        stats.save()
+        stats.report(MODELS)
 
     print(f"完成，已输出到：{output_file}")
 
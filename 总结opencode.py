@@ -1,10 +1,22 @@
+import asyncio
+import contextvars
+import hashlib
+import importlib.util
+import itertools
 import json
+import os
+import queue
 import time
 import threading
 import re
 import random
+import sqlite3
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import urllib.error
 
 try:
@@ -12,14 +24,48 @@ try:
 except ImportError:
     requests = None
 
+try:
+    import httpx  # type: ignore
+except ImportError:
+    httpx = None
+
 import urllib.request
 
+from 分割 import CJK_TOKENS_PER_CHAR, DECODE_ERRORS, detect_encoding, take_replaced_byte_count
+from 分割 import estimate_tokens as _estimate_text_tokens
+from 分割 import HeadingMatcher, chinese_to_num, configured_heading_formats
+
 BASE_DIR = Path(__file__).resolve().parent
 
 # 从第几个文件开始继续跑（从 1 开始）
 START_INDEX = 1
 #线程数
 THREAD_COUNT = 20
+# 并发引擎："threads" = 多线程；"asyncio" = 单线程协程 + 共享连接池的 HTTP 客户端（可开到上百并发）
+ENGINE = "threads"
+# asyncio 引擎同时在途的请求数
+ASYNC_CONCURRENCY = 100
+# 自适应并发：遇到 429 或延迟明显升高时减少在途请求，恢复正常后逐步加回（上限为线程数/ASYNC_CONCURRENCY）
+ADAPTIVE_CONCURRENCY = True
+ADAPTIVE_MIN_CONCURRENCY = 1
+# 触发 429 时并发上限乘以该系数
+ADAPTIVE_DECREASE_FACTOR = 0.5
+# 短期平均延迟超过长期平均延迟的倍数时视为延迟升高
+ADAPTIVE_LATENCY_RISE_RATIO = 2.0
+# 每个 APIKey 每分钟最多发起的请求数（令牌桶），0 表示不限
+KEY_RATE_PER_MINUTE = 0
+# 令牌桶容量：空闲后允许的突发请求数
+KEY_BURST = 5
+# 429 没有 Retry-After 时该 key 的冷却秒数
+KEY_COOLDOWN_SECONDS = 10
+# 同一个 key 连续出现多少次 401/403/429 后熔断
+KEY_BREAKER_THRESHOLD = 3
+# 熔断后多少秒再放行一次试探请求
+KEY_BREAKER_SECONDS = 120
+# 吞吐日志的输出间隔（秒）
+THROUGHPUT_LOG_SECONDS = 30
+# 任务领取顺序："index" = 按文件序号；"size" = 大文件优先（长任务先开始，缩短收尾的长尾）
+QUEUE_ORDER = "index"
 Words=2000
 API_URL = "https://opencode.ai/zen/v1/chat/completions"
 API_KEYS = [
@@ -29,9 +75,19 @@ API_KEYS = [
     "sk-LbbDOpqt28LlYqZk0YKwsPUlzNYXfdHMw0MEBAAY03HvL6DocQXyMsJXzqGwzBLc",
 ]
 MODEL = "minimax-m2.5-free"
+# 多服务商：每项为 {"name", "url", "keys", "model", "concurrency", "weight"}，同一次运行按权重和空闲程度
+# 把文件分给各服务商，各自使用独立的 APIKey 池和并发限制；为空时只使用上面的 API_URL / API_KEYS / MODEL
+PROVIDERS: List[dict] = []
 
 # 0 表示不截断，完整读取文件
 MAX_INPUT_CHARS = 0
+# 超长文件自动分段：超过分段上限的文件按章节/段落边界切成若干段并行总结，再用一次合并请求汇总成一篇；
+# 关闭时沿用截断行为（超过 MAX_INPUT_CHARS 时保留首尾、省略中间）
+AUTO_CHUNK = True
+# 分段上限（字符）；实际上限取它、MAX_INPUT_CHARS（大于 0 时）与上下文窗口折算字数中的最小值
+CHUNK_MAX_CHARS = 60000
+# 编码探测时从文件开头采样的字节数
+ENCODING_SNIFF_BYTES = 256 * 1024
 REQUEST_CONNECT_TIMEOUT = 20
 REQUEST_READ_TIMEOUT = 40
 RETRY_TIMES = 13
@@ -41,8 +97,69 @@ FILE_RETRY_DELAY = 8
 IDLE_RETRY_SECONDS = 60
 # 是否启动时清空 tmp（True=清空后重跑，False=保留以便断点续跑）
 CLEAN_TMP_ON_START = False
-# 临时文件已存在时的处理方式：0=跳过（不再调用 API），1=覆盖（重新调用 API）
+# 临时文件已存在时的处理方式：0=跳过（不再调用 API），1=覆盖（重新生成，命中摘要缓存时仍不调用 API）
 TMP_EXISTS_MODE = 0
+# 流式输出（SSE）：边生成边写入 tmp/NNN.txt.partial，并统计首字延迟和生成速度
+STREAM_MODE = False
+# 流式输出超过目标字数的多少倍后提前结束生成（在最近的句末截断），0 表示不截断
+STREAM_STOP_RATIO = 1.5
+# tmp 目录下的清单文件（每写完一个临时文件追加一行 JSON）与增量合并状态
+MANIFEST_NAME = "manifest.jsonl"
+MERGE_STATE_NAME = "merge_state.json"
+# 检查是否完整.py 写出的重跑清单（tmp/retry_list.json）：存在时只重新总结其中列出的序号（缺失、失败、过短或原文已变化），
+# 不必把 TMP_EXISTS_MODE 改成 1 全部重跑；列出的序号全部完成后自动删除
+USE_RETRY_LIST = True
+RETRY_LIST_NAME = "retry_list.json"
+# 分层汇总：逐文件总结之外，每 ARC_SIZE 个文件汇总成一卷梗概，再由各卷汇总成全书梗概
+HIERARCHY_MODE = False
+ARC_SIZE = 10
+ARC_WORDS = 3000
+BOOK_WORDS = 5000
+# 摘要缓存：按输入文本、模型、提示词和生成参数的哈希保存结果，与文件序号无关
+SUMMARY_CACHE_ENABLED = True
+SUMMARY_CACHE_FILE = BASE_DIR / "summary_cache.sqlite3"
+# 缓存总大小上限（MB），超出后按最久未使用淘汰
+SUMMARY_CACHE_MAX_MB = 512
+# 指标 HTTP 端口：大于 0 时在 METRICS_HOST 上提供 /metrics（Prometheus 文本）和 /metrics.json；0 表示不开启
+METRICS_PORT = 0
+METRICS_HOST = "127.0.0.1"
+# 每隔多少秒把指标快照写入 tmp/metrics.json（0 表示只在运行结束时写一次）
+METRICS_SNAPSHOT_SECONDS = 30
+METRICS_SNAPSHOT_NAME = "metrics.json"
+# 每个文件一条追踪记录（含每次请求的 key、状态、耗时、字节数），追加到 tmp/trace.jsonl
+TRACE_ENABLED = True
+TRACE_NAME = "trace.jsonl"
+# 运行前规划：估算每个文件的提示词 token、总费用和预计耗时，并标出超出上下文窗口的文件
+PLAN_BEFORE_RUN = True
+# 只输出规划，不调用 API
+PLAN_ONLY = False
+# 模型上下文窗口（token），提示词加上预留的输出 token 超过它的文件会被标出
+CONTEXT_WINDOW_TOKENS = 196608
+# 可选的真实分词器：tiktoken 编码名（如 "cl100k_base"）；为空或未安装 tiktoken 时使用 分割.py 的快速估算
+# （系数见 分割.CJK_TOKENS_PER_CHAR / OTHER_TOKENS_PER_CHAR，与按 token 预算分组时一致）
+TOKENIZER_NAME = ""
+# 每百万 token 价格（输入 / 输出），免费模型为 0
+PRICE_INPUT_PER_MTOKEN = 0.0
+PRICE_OUTPUT_PER_MTOKEN = 0.0
+PRICE_CURRENCY = "元"
+# 预计单次请求耗时（秒）；tmp/metrics.json 中有上次运行的实测值时优先使用实测值
+PLAN_REQUEST_SECONDS = 60
+# 总结质量校验：长度上下限、禁用词、标题/说明、拒答、中文占比和重复检测；不合格时先在本地去掉多余的标题，
+# 仍不合格再发一次简短的修复请求（续写或改写），而不是等 FILE_RETRY_DELAY 后整篇重新生成
+VALIDATION_ENABLED = True
+# 每个总结最多追加几次修复请求（0 表示只校验不修复）
+REPAIR_TIMES = 2
+# 总结长度上限为 Words 的多少倍（下限沿用 Words // 4），0 表示不检查上限
+SUMMARY_MAX_RATIO = 2.0
+# 提示词要求不要出现的字眼
+BANNED_PHRASES = ["主要人物", "重要转折", "主要情节"]
+# 拒答/套话特征，出现在开头部分时视为拒答
+REFUSAL_PHRASES = ["抱歉", "无法提供", "无法完成", "作为AI", "作为一个AI", "作为人工智能", "I'm sorry", "I cannot"]
+# 字母和汉字中汉字的最低占比
+MIN_CJK_RATIO = 0.6
+# 重复检测：长度为 REPEAT_NGRAM 的片段中重复出现的比例超过 MAX_REPEAT_RATIO 视为复读
+REPEAT_NGRAM = 12
+MAX_REPEAT_RATIO = 0.2
 DEFAULT_HEADERS = {
     "Content-Type": "application/json",
     "Accept": "application/json",
@@ -55,6 +172,26 @@ DEFAULT_HEADERS = {
 }
 
 
+# 安装了 h2 时 httpx 使用 HTTP/2，多个请求复用同一连接
+HTTP2_AVAILABLE = httpx is not None and importlib.util.find_spec("h2") is not None
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    # 所有线程共享一个 requests.Session，复用 keep-alive 连接，避免每次请求重新握手 TLS
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            pool_size = max(THREAD_COUNT, ASYNC_CONCURRENCY)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
 def _build_headers(api_key: str) -> dict:
     headers = DEFAULT_HEADERS.copy()
     headers["Authorization"] = f"Bearer {api_key}"
@@ -71,13 +208,6 @@ def _available_api_keys() -> List[str]:
     return [key.strip() for key in API_KEYS if key and key.strip()]
 
 
-def _pick_random_key_index(key_count: int, excluded_indices: set) -> Optional[int]:
-    candidates = [idx for idx in range(key_count) if idx not in excluded_indices]
-    if not candidates:
-        return None
-    return random.choice(candidates)
-
-
 def _retry_delay_seconds(attempt: int, base_delay: int) -> int:
     # Exponential backoff: 1x, 2x, 4x...
     return base_delay * (2 ** (attempt - 1))
@@ -98,6 +228,8 @@ def _extract_http_status(exc: Exception) -> Optional[int]:
             if one_exc.response is not None:
                 return one_exc.response.status_code
             continue
+        if httpx is not None and isinstance(one_exc, httpx.HTTPStatusError):
+            return one_exc.response.status_code
         if isinstance(one_exc, urllib.error.HTTPError):
             return one_exc.code
 
@@ -115,6 +247,8 @@ def _extract_retry_after_seconds(exc: Exception) -> Optional[int]:
         if requests is not None and isinstance(one_exc, requests.exceptions.HTTPError):
             if one_exc.response is not None:
                 retry_after_raw = one_exc.response.headers.get("Retry-After")
+        elif httpx is not None and isinstance(one_exc, httpx.HTTPStatusError):
+            retry_after_raw = one_exc.response.headers.get("Retry-After")
         elif isinstance(one_exc, urllib.error.HTTPError):
             retry_after_raw = one_exc.headers.get("Retry-After")
 
@@ -154,6 +288,9 @@ def _is_retryable_exception(exc: Exception) -> bool:
     ):
         return True
 
+    if httpx is not None and isinstance(exc, httpx.TransportError):
+        return True
+
     if isinstance(exc, (urllib.error.URLError, TimeoutError)):
         return True
 
@@ -169,6 +306,801 @@ def _is_retryable_exception(exc: Exception) -> bool:
     return any(word in msg for word in transient_words)
 
 
+def _grant_waiter(waiter: "asyncio.Future") -> None:
+    # 等待者已被取消时不再设置结果，名额由它自己的取消分支归还
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AdaptiveConcurrencyLimiter:
+    """所有线程/协程共享的 AIMD 并发限制器。
+
+    每次成功把上限加 1/上限（约每轮加 1）；触发 429 时乘以 ADAPTIVE_DECREASE_FACTOR，
+    短期延迟明显高于长期延迟时小幅下调。Retry-After 由 APIKeyPool 按 key 冷却，
+    所有 key 都在冷却时全体等待。
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = ADAPTIVE_MIN_CONCURRENCY):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(self.max_limit)
+        self.inflight = 0
+        self._cond = threading.Condition()
+        # 排队等待的协程（loop, future），按先来后到在 release 时唤醒
+        self._async_waiters: deque = deque()
+        self._last_decrease = 0.0
+        self._short_latency: Optional[float] = None
+        self._long_latency: Optional[float] = None
+        self._window_started = time.monotonic()
+        self._window_done = 0
+        self._window_rate_limited = 0
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+
+    async def acquire_async(self) -> None:
+        with self._cond:
+            if not self._async_waiters and self.inflight < int(self.limit):
+                self.inflight += 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._async_waiters.append((loop, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._cond:
+                try:
+                    self._async_waiters.remove((loop, waiter))
+                except ValueError:
+                    # 已经出队说明名额已经记到这个协程头上，取消时要还回去
+                    self.inflight -= 1
+                    self._wake_async_waiters()
+            raise
+
+    def _wake_async_waiters(self) -> None:
+        # 调用方持有 self._cond；名额在出队时就占上，release 可能来自其他线程
+        while self._async_waiters and self.inflight < int(self.limit):
+            loop, waiter = self._async_waiters.popleft()
+            self.inflight += 1
+            loop.call_soon_threadsafe(_grant_waiter, waiter)
+
+    def _decrease(self, factor: float, now: float) -> None:
+        # 同一批在途请求的失败只算一次，避免上限被连续砍到底
+        if now - self._last_decrease < (self._short_latency or 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+
+    def release(self, latency: float, exc: Optional[Exception] = None) -> None:
+        with self._cond:
+            now = time.monotonic()
+            self.inflight -= 1
+            if exc is None:
+                self._window_done += 1
+                self._short_latency = (
+                    latency if self._short_latency is None else 0.8 * self._short_latency + 0.2 * latency
+                )
+                self._long_latency = (
+                    latency if self._long_latency is None else 0.98 * self._long_latency + 0.02 * latency
+                )
+                if self._short_latency > self._long_latency * ADAPTIVE_LATENCY_RISE_RATIO:
+                    self._decrease(0.9, now)
+                else:
+                    self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            elif _is_rate_limit_exception(exc):
+                self._window_rate_limited += 1
+                self._decrease(ADAPTIVE_DECREASE_FACTOR, now)
+            self._maybe_log_throughput(now)
+            self._wake_async_waiters()
+            self._cond.notify_all()
+
+    def cancel(self) -> None:
+        # 归还一个没有真正发出请求的名额，不参与 AIMD 调整
+        with self._cond:
+            self.inflight -= 1
+            self._wake_async_waiters()
+            self._cond.notify_all()
+
+    def _maybe_log_throughput(self, now: float) -> None:
+        elapsed = now - self._window_started
+        if elapsed < THROUGHPUT_LOG_SECONDS:
+            return
+        print(
+            f"{time.strftime('%H:%M:%S')} [{MODEL}] 吞吐：最近 {elapsed:.0f}s 完成 {self._window_done} 个请求"
+            f"（{self._window_done * 60 / elapsed:.1f}/min），429 {self._window_rate_limited} 次，"
+            f"并发上限 {int(self.limit)}/{self.max_limit}，在途 {self.inflight}",
+            flush=True,
+        )
+        self._window_started = now
+        self._window_done = 0
+        self._window_rate_limited = 0
+
+
+class _KeyState:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.tokens = float(KEY_BURST)
+        self.refilled_at = time.monotonic()
+        self.cooldown_until = 0.0
+        self.breaker_until = 0.0
+        self.strikes = 0
+        self.inflight = 0
+        self.success = 0
+        self.latency_total = 0.0
+        self.errors: Counter = Counter()
+        self.breaker_trips = 0
+
+    def refill(self, now: float) -> None:
+        if KEY_RATE_PER_MINUTE > 0:
+            rate = KEY_RATE_PER_MINUTE / 60.0
+            self.tokens = min(float(KEY_BURST), self.tokens + (now - self.refilled_at) * rate)
+        self.refilled_at = now
+
+    def ready_at(self, now: float) -> float:
+        # 该 key 最早可以发请求的时间点
+        ready = max(self.cooldown_until, self.breaker_until)
+        if self.strikes >= KEY_BREAKER_THRESHOLD and self.inflight > 0:
+            # 熔断后的半开状态：同一时间只放行一个试探请求
+            ready = max(ready, now + 1.0)
+        if KEY_RATE_PER_MINUTE > 0 and self.tokens < 1.0:
+            ready = max(ready, now + (1.0 - self.tokens) * 60.0 / KEY_RATE_PER_MINUTE)
+        return ready
+
+
+class APIKeyPool:
+    """进程内共享的 APIKey 池。
+
+    每个 key 有令牌桶限速、Retry-After 冷却和连续 401/403/429 熔断；
+    选 key 时在可用的 key 里挑在途请求最少的，并统计成功数、延迟和错误。
+    """
+
+    def __init__(self, api_keys: List[str]):
+        if not api_keys:
+            raise ValueError("API_KEYS 为空，请在脚本中填写有效 key")
+        self.keys = list(api_keys)
+        self._states = [_KeyState(key) for key in self.keys]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _try_acquire(self, excluded_indices: set) -> Tuple[Optional[int], float]:
+        with self._lock:
+            now = time.monotonic()
+            for state in self._states:
+                state.refill(now)
+            ready = [idx for idx, state in enumerate(self._states) if state.ready_at(now) <= now]
+            if not ready:
+                wait_seconds = min(state.ready_at(now) for state in self._states) - now
+                return None, max(0.05, wait_seconds)
+
+            # 优先换一个本次调用还没失败过的 key
+            candidates = [idx for idx in ready if idx not in excluded_indices] or ready
+            least_load = min(self._states[idx].inflight for idx in candidates)
+            key_index = random.choice(
+                [idx for idx in candidates if self._states[idx].inflight == least_load]
+            )
+            state = self._states[key_index]
+            state.inflight += 1
+            if KEY_RATE_PER_MINUTE > 0:
+                state.tokens -= 1.0
+            return key_index, 0.0
+
+    def acquire(self, excluded_indices: set) -> int:
+        while True:
+            key_index, wait_seconds = self._try_acquire(excluded_indices)
+            if key_index is not None:
+                return key_index
+            time.sleep(wait_seconds)
+
+    async def acquire_async(self, excluded_indices: set) -> int:
+        while True:
+            key_index, wait_seconds = self._try_acquire(excluded_indices)
+            if key_index is not None:
+                return key_index
+            await asyncio.sleep(wait_seconds)
+
+    def release(self, key_index: int, latency: float, exc: Optional[Exception] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            state = self._states[key_index]
+            state.inflight -= 1
+            if exc is None:
+                state.success += 1
+                state.latency_total += latency
+                state.strikes = 0
+                return
+
+            status = _extract_http_status(exc)
+            state.errors[str(status) if status is not None else type(exc).__name__] += 1
+            strike = status in (401, 403)
+            if status == 429:
+                # 同一批并发请求一起收到的 429 只记一次
+                strike = now >= state.cooldown_until
+                retry_after_seconds = _extract_retry_after_seconds(exc)
+                cooldown = KEY_COOLDOWN_SECONDS if retry_after_seconds is None else retry_after_seconds
+                state.cooldown_until = max(state.cooldown_until, now + cooldown)
+            if strike:
+                state.strikes += 1
+                if state.strikes >= KEY_BREAKER_THRESHOLD and now >= state.breaker_until:
+                    state.breaker_until = now + KEY_BREAKER_SECONDS
+                    state.breaker_trips += 1
+                    print(
+                        f"{time.strftime('%H:%M:%S')} [{MODEL}] APIKey {_mask_api_key(state.api_key)} "
+                        f"连续 {state.strikes} 次 {status}，熔断 {KEY_BREAKER_SECONDS}s",
+                        flush=True,
+                    )
+
+    def log_stats(self) -> None:
+        print(f"[{MODEL}] APIKey 使用统计：", flush=True)
+        with self._lock:
+            for state in self._states:
+                avg_latency = state.latency_total / state.success if state.success else 0.0
+                errors = "，".join(f"{kind}×{count}" for kind, count in state.errors.most_common()) or "无"
+                print(
+                    f"[{MODEL}]   {_mask_api_key(state.api_key)}：成功 {state.success} 次，"
+                    f"平均延迟 {avg_latency:.1f}s，错误 {errors}，熔断 {state.breaker_trips} 次",
+                    flush=True,
+                )
+
+
+_key_pool: Optional[APIKeyPool] = None
+_key_pool_lock = threading.Lock()
+
+
+def _get_key_pool() -> APIKeyPool:
+    global _key_pool
+    with _key_pool_lock:
+        if _key_pool is None:
+            _key_pool = APIKeyPool(_available_api_keys())
+        return _key_pool
+
+
+class Provider:
+    """一个服务商：接口地址、模型、独立的 APIKey 池和并发限制器，以及当前分到的文件数。"""
+
+    def __init__(self, name: str, url: str, model: str, key_pool: APIKeyPool, concurrency: int, weight: float):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.key_pool = key_pool
+        self.concurrency = max(1, concurrency)
+        self.weight = max(weight, 1e-6)
+        self.limiter: Optional[AdaptiveConcurrencyLimiter] = None
+        self.active_files = 0
+        self.done_files = 0
+
+
+_providers: List[Provider] = []
+_providers_lock = threading.Lock()
+# 当前文件分到的服务商；线程各自独立，asyncio 任务和分段线程创建时复制上下文
+_current_provider: contextvars.ContextVar = contextvars.ContextVar("summary_provider", default=None)
+
+
+def total_concurrency(default: int) -> int:
+    # 配置了多服务商时，同时处理的文件数为各服务商并发上限之和
+    if not PROVIDERS:
+        return default
+    return sum(max(1, int(cfg.get("concurrency", default))) for cfg in PROVIDERS)
+
+
+def _build_providers(default_concurrency: int) -> List[Provider]:
+    if not PROVIDERS:
+        return [Provider("default", API_URL, MODEL, _get_key_pool(), default_concurrency, 1.0)]
+    providers = []
+    for cfg in PROVIDERS:
+        keys = [key.strip() for key in cfg.get("keys", []) if key and key.strip()]
+        providers.append(
+            Provider(
+                cfg.get("name") or cfg["model"],
+                cfg["url"],
+                cfg["model"],
+                APIKeyPool(keys),
+                int(cfg.get("concurrency", default_concurrency)),
+                float(cfg.get("weight", 1.0)),
+            )
+        )
+    return providers
+
+
+def _get_providers() -> List[Provider]:
+    # 运行期间由 begin_run 创建；单独调用 call_api 时按当前配置临时创建
+    global _providers
+    with _providers_lock:
+        if not _providers:
+            _providers = _build_providers(THREAD_COUNT)
+        return _providers
+
+
+def _active_provider() -> Provider:
+    # 文件任务使用分到的服务商；分卷/全书等不属于单个文件的请求使用第一个服务商
+    return _current_provider.get() or _get_providers()[0]
+
+
+def _pick_provider(excluded: Optional[set] = None) -> Provider:
+    # 在有空闲并发的服务商中选 (已分文件数+1)/权重 最小的；排除本文件已失败的服务商（都失败时不排除）
+    providers = _get_providers()
+    with _providers_lock:
+        candidates = [p for p in providers if p.name not in (excluded or set())] or providers
+        free = [p for p in candidates if p.active_files < p.concurrency] or candidates
+        provider = min(free, key=lambda p: ((p.active_files + 1) / p.weight, -p.weight))
+        provider.active_files += 1
+        return provider
+
+
+def _release_provider(provider: Provider, done: bool) -> None:
+    with _providers_lock:
+        provider.active_files -= 1
+        provider.done_files += int(done)
+
+
+# 编码探测与计数的解码错误处理器与 分割.py 共用（见 分割.detect_encoding / 分割.DECODE_ERRORS）
+_decode_stats_lock = threading.Lock()
+_decode_stats = {"encodings": Counter(), "replaced_bytes": 0}
+
+
+def _decode_stats_text() -> str:
+    with _decode_stats_lock:
+        encodings = "，".join(f"{name}×{count}" for name, count in _decode_stats["encodings"].most_common())
+        return f"输入编码：{encodings or '无'}；解码共替换 {_decode_stats['replaced_bytes']} 个无法识别的字节"
+
+
+class SummaryCache:
+    """SQLite 持久化的摘要缓存，键为请求内容的 SHA-256，容量超限时按最近访问时间淘汰。"""
+
+    def __init__(self, db_path: Path, max_bytes: int):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "key TEXT PRIMARY KEY, summary TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS summaries_accessed ON summaries(accessed)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM summaries").fetchone()
+        self.entries, self.total_bytes = row
+
+    @staticmethod
+    def make_key(payload: dict) -> str:
+        # payload 已包含模型、完整提示词（模板 + 原文 + Words）和生成参数
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE summaries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, summary: str) -> None:
+        size = len(summary.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM summaries WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+                self.entries -= 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, summary, size, now, now),
+            )
+            self.total_bytes += size
+            self.entries += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # 淘汰到上限的 90%，避免每次写入都触发淘汰
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT key, size FROM summaries ORDER BY accessed").fetchall()
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            self._conn.execute("DELETE FROM summaries WHERE key = ?", (key,))
+            self.total_bytes -= size
+            self.entries -= 1
+            self.evicted += 1
+
+    def stats_text(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (
+            f"摘要缓存：命中 {self.hits} 次，未命中 {self.misses} 次（命中率 {hit_rate:.0%}），"
+            f"淘汰 {self.evicted} 条，现有 {self.entries} 条 / {self.total_bytes / 1024 / 1024:.1f}MB"
+        )
+
+
+_summary_cache: Optional[SummaryCache] = None
+_summary_cache_lock = threading.Lock()
+
+
+def _get_summary_cache() -> Optional[SummaryCache]:
+    global _summary_cache
+    if not SUMMARY_CACHE_ENABLED:
+        return None
+    with _summary_cache_lock:
+        if _summary_cache is None:
+            _summary_cache = SummaryCache(SUMMARY_CACHE_FILE, SUMMARY_CACHE_MAX_MB * 1024 * 1024)
+        return _summary_cache
+
+
+METRICS_PREFIX = "novel_summary_"
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+SIZE_BUCKETS = (1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000)
+
+# 指标名 -> (类型, 说明)
+METRIC_HELP = {
+    "requests_total": ("counter", "API 请求次数，按 APIKey 和状态（HTTP 状态码或异常类型）区分"),
+    "request_seconds": ("histogram", "单次 API 请求耗时（秒）"),
+    "request_bytes_total": ("counter", "请求体字节数（direction=out）与响应体字节数（direction=in）"),
+    "prompt_chars": ("histogram", "每次请求提示词的字符数"),
+    "retries_total": ("counter", "请求级重试次数，按原因区分"),
+    "file_retries_total": ("counter", "文件级重试次数，按原因区分"),
+    "cache_hits_total": ("counter", "摘要缓存命中次数"),
+    "chunked_files_total": ("counter", "超过分段上限、被切成多段总结的文件数"),
+    "summary_checks_total": ("counter", "总结质量校验次数，按模型和结果（passed/repaired/unresolved）区分"),
+    "summary_problems_total": ("counter", "总结质量问题次数，按模型和问题类型区分"),
+    "repair_requests_total": ("counter", "总结修复请求次数，按模型和方式（continue/redo/rewrite）区分"),
+    "files_total": ("counter", "处理完的文件数，按结果区分"),
+    "file_seconds": ("histogram", "单个文件从开始到得到总结的耗时（秒），含重试"),
+    "inflight_requests": ("gauge", "正在进行的 API 请求数"),
+    "queue_depth": ("gauge", "等待领取的任务数"),
+    "active_workers": ("gauge", "正在处理任务的线程/协程数"),
+}
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    """进程内指标：计数器、仪表和直方图，按（名称, 标签）聚合，可导出为 Prometheus 文本或 JSON 快照。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, float] = {}
+        self._gauges: Dict[tuple, float] = {}
+        # (名称, 标签) -> [各桶计数, 总和, 次数]；桶边界按名称记录
+        self._histograms: Dict[tuple, list] = {}
+        self._buckets: Dict[str, tuple] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge_add(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def gauge_set(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            buckets = self._buckets.setdefault(name, buckets)
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[0][i] += 1
+                    break
+            hist[1] += value
+            hist[2] += 1
+
+    def counter_total(self, name: str, **labels) -> float:
+        # 对名称相同、包含给定标签的计数器求和
+        wanted = {(k, str(v)) for k, v in labels.items()}
+        with self._lock:
+            return sum(v for (n, ls), v in self._counters.items() if n == name and wanted <= set(ls))
+
+    def quantile(self, name: str, q: float) -> Optional[float]:
+        # 合并同名直方图，按桶上界估算分位数；超出最大桶时返回 None
+        with self._lock:
+            buckets = self._buckets.get(name)
+            hists = [h for (n, _), h in self._histograms.items() if n == name]
+            if not buckets or not hists:
+                return None
+            counts = [sum(h[0][i] for h in hists) for i in range(len(buckets))]
+            total = sum(h[2] for h in hists)
+        if total == 0:
+            return None
+        cumulative = 0
+        for bound, count in zip(buckets, counts):
+            cumulative += count
+            if cumulative >= q * total:
+                return bound
+        return None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            def entries(items):
+                return [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(items)
+                ]
+
+            histograms = []
+            for (name, labels), (counts, total_sum, count) in sorted(self._histograms.items()):
+                cumulative = list(itertools.accumulate(counts))
+                histograms.append({
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": count,
+                    "sum": round(total_sum, 6),
+                    "buckets": {str(bound): c for bound, c in zip(self._buckets[name], cumulative)},
+                })
+            return {
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "model": MODEL,
+                "counters": entries(self._counters.items()),
+                "gauges": entries(self._gauges.items()),
+                "histograms": histograms,
+            }
+
+    def render_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        series: Dict[str, List[str]] = {}
+
+        def labels_text(labels: dict, extra: str = "") -> str:
+            parts = [f'{k}="{_escape_label(v)}"' for k, v in labels.items()]
+            if extra:
+                parts.append(extra)
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        for kind in ("counters", "gauges"):
+            for entry in snapshot[kind]:
+                full_name = METRICS_PREFIX + entry["name"]
+                series.setdefault(entry["name"], []).append(
+                    f"{full_name}{labels_text(entry['labels'])} {entry['value']:g}"
+                )
+        for entry in snapshot["histograms"]:
+            full_name = METRICS_PREFIX + entry["name"]
+            lines = series.setdefault(entry["name"], [])
+            bounds = [*entry["buckets"].items(), ("+Inf", entry["count"])]
+            for bound, count in bounds:
+                le = 'le="' + bound + '"'
+                lines.append(f"{full_name}_bucket{labels_text(entry['labels'], le)} {count}")
+            lines.append(f"{full_name}_sum{labels_text(entry['labels'])} {entry['sum']:g}")
+            lines.append(f"{full_name}_count{labels_text(entry['labels'])} {entry['count']}")
+
+        out = []
+        for name, lines in series.items():
+            metric_type, help_text = METRIC_HELP.get(name, ("untyped", name))
+            out.append(f"# HELP {METRICS_PREFIX}{name} {help_text}")
+            out.append(f"# TYPE {METRICS_PREFIX}{name} {metric_type}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+    def summary_text(self) -> str:
+        requests_count = self.counter_total("requests_total")
+        failed = requests_count - self.counter_total("requests_total", status="200")
+        p50 = self.quantile("request_seconds", 0.5)
+        p95 = self.quantile("request_seconds", 0.95)
+
+        def bound_text(value: Optional[float]) -> str:
+            return f"≤{value:g}s" if value is not None else f">{LATENCY_BUCKETS[-1]:g}s"
+
+        return (
+            f"指标：请求 {requests_count:.0f} 次（失败 {failed:.0f}），"
+            f"重试 {self.counter_total('retries_total'):.0f} 次，"
+            f"延迟 p50 {bound_text(p50)} / p95 {bound_text(p95)}，"
+            f"发送 {self.counter_total('request_bytes_total', direction='out') / 1024 / 1024:.1f} MB，"
+            f"接收 {self.counter_total('request_bytes_total', direction='in') / 1024 / 1024:.1f} MB"
+        )
+
+
+_metrics = Metrics()
+
+
+class MetricsExporter:
+    """导出指标：可选的 HTTP 端点（/metrics、/metrics.json），以及定期写入的 JSON 快照文件。"""
+
+    def __init__(self, metrics: Metrics, snapshot_file: Path, port: int = 0, interval: float = 0):
+        self.metrics = metrics
+        self.snapshot_file = snapshot_file
+        self.port = port
+        self.interval = interval
+        self._stop = threading.Event()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if self.port > 0:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def log_message(self, format, *args):
+                    pass
+
+                def do_GET(self):
+                    path = self.path.split("?", 1)[0]
+                    if path == "/metrics":
+                        body = metrics.render_prometheus().encode("utf-8")
+                        content_type = "text/plain; version=0.0.4; charset=utf-8"
+                    elif path == "/metrics.json":
+                        body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+                        content_type = "application/json; charset=utf-8"
+                    else:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            try:
+                self._server = ThreadingHTTPServer((METRICS_HOST, self.port), Handler)
+            except OSError as exc:
+                print(f"[{MODEL}] 指标端口 {METRICS_HOST}:{self.port} 启动失败：{exc}", flush=True)
+            else:
+                self._server.daemon_threads = True
+                self._threads.append(
+                    threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+                )
+                print(f"[{MODEL}] 指标端点：http://{METRICS_HOST}:{self.port}/metrics", flush=True)
+        if self.interval > 0:
+            self._threads.append(threading.Thread(target=self._snapshot_loop, name="metrics-snapshot", daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def _snapshot_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write_snapshot()
+
+    def write_snapshot(self) -> None:
+        try:
+            self.snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+            _atomic_write_text(self.snapshot_file, json.dumps(self.metrics.snapshot(), ensure_ascii=False, indent=1))
+        except OSError as exc:
+            print(f"[{MODEL}] 写入指标快照失败：{exc}", flush=True)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for t in self._threads:
+            t.join(timeout=5)
+        self.write_snapshot()
+
+
+_metrics_exporter: Optional[MetricsExporter] = None
+
+# 当前线程/协程正在处理的文件追踪记录；线程各自独立，asyncio 任务创建时复制上下文
+_current_span: contextvars.ContextVar = contextvars.ContextVar("summary_span", default=None)
+_trace_lock = threading.Lock()
+
+
+class TraceSpan:
+    """单个文件的追踪记录：开始、结束、每次 API 请求和关键事件，结束时追加一行到 tmp/trace.jsonl。"""
+
+    def __init__(self, name: str, idx: int, worker: str):
+        self.record = {
+            "trace_id": uuid.uuid4().hex,
+            "span": "file",
+            "file": name,
+            "idx": idx,
+            "worker": worker,
+            "model": MODEL,
+            "start": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "requests": [],
+            "events": [],
+        }
+        self._started = time.monotonic()
+
+    def offset(self) -> float:
+        return round(time.monotonic() - self._started, 3)
+
+    def add_request(
+        self, model: str, key: str, status: str, latency: float, bytes_out: int, bytes_in: int
+    ) -> None:
+        self.record["requests"].append({
+            "at": round(self.offset() - latency, 3),
+            "model": model,
+            "key": key,
+            "status": status,
+            "latency": round(latency, 3),
+            "bytes_out": bytes_out,
+            "bytes_in": bytes_in,
+        })
+
+    def add_event(self, name: str, **fields) -> None:
+        self.record["events"].append({"at": self.offset(), "event": name, **fields})
+
+    def finish(self, status: str) -> float:
+        duration = time.monotonic() - self._started
+        self.record["status"] = status
+        self.record["duration"] = round(duration, 3)
+        if TRACE_ENABLED:
+            trace_file = BASE_DIR / "tmp" / TRACE_NAME
+            line = json.dumps(self.record, ensure_ascii=False) + "\n"
+            with _trace_lock:
+                trace_file.parent.mkdir(parents=True, exist_ok=True)
+                with trace_file.open("a", encoding="utf-8") as f:
+                    f.write(line)
+        return duration
+
+
+def _start_span(name: str, idx: int, worker: str) -> Tuple[TraceSpan, contextvars.Token]:
+    span = TraceSpan(name, idx, worker)
+    return span, _current_span.set(span)
+
+
+def _finish_span(span: TraceSpan, token: contextvars.Token, summary: str) -> None:
+    _current_span.reset(token)
+    status = "failed" if summary.startswith("[总结失败]") else "done"
+    _metrics.observe("file_seconds", span.finish(status))
+    _metrics.inc("files_total", status=status)
+
+
+def _span_event(name: str, **fields) -> None:
+    span = _current_span.get()
+    if span is not None:
+        span.add_event(name, **fields)
+
+
+def _failure_reason(exc: Exception) -> str:
+    # 指标中的失败原因：HTTP 状态码，或异常类型名
+    status = _extract_http_status(exc)
+    return str(status) if status is not None else type(exc).__name__
+
+
+class _WireSizes:
+    """一次请求实际发送的请求体和收到的响应体字节数，由 HTTP 辅助函数在收发时填写。"""
+
+    def __init__(self):
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+
+def _record_request(
+    payload: dict, api_key: str, latency: float, sizes: _WireSizes, exc: Optional[Exception] = None
+) -> None:
+    # 一次 API 请求结束：记录到指标和当前文件的追踪记录
+    key = _mask_api_key(api_key)
+    status = "200" if exc is None else _failure_reason(exc)
+    bytes_out = sizes.bytes_out
+    bytes_in = sizes.bytes_in
+    prompt_chars = sum(len(message.get("content", "")) for message in payload.get("messages", []))
+    _metrics.inc("requests_total", key=key, status=status)
+    _metrics.observe("request_seconds", latency, outcome="ok" if exc is None else "error")
+    _metrics.inc("request_bytes_total", bytes_out, direction="out")
+    _metrics.inc("request_bytes_total", bytes_in, direction="in")
+    _metrics.observe("prompt_chars", prompt_chars, buckets=SIZE_BUCKETS)
+    span = _current_span.get()
+    if span is not None:
+        span.add_request(payload.get("model", ""), key, status, latency, bytes_out, bytes_in)
+
+
 def find_input_dir() -> Path:
     candidates = [BASE_DIR / "txt", BASE_DIR / "TXT", Path("txt"), Path("TXT")]
     for path in candidates:
@@ -185,7 +1117,23 @@ def list_txt_files(input_dir: Path) -> List[Path]:
 
 
 def read_text(file_path: Path, max_chars: int = MAX_INPUT_CHARS) -> str:
-    content = file_path.read_text(encoding="utf-8", errors="ignore")
+    encoding = detect_encoding(str(file_path), ENCODING_SNIFF_BYTES)
+    take_replaced_byte_count()
+    # 文本模式由 TextIOWrapper 分块解码，原始字节不会整份驻留内存
+    with file_path.open("r", encoding=encoding, errors=DECODE_ERRORS) as f:
+        content = f.read()
+    replaced = take_replaced_byte_count()
+
+    with _decode_stats_lock:
+        _decode_stats["encodings"][encoding] += 1
+        _decode_stats["replaced_bytes"] += replaced
+    if encoding != "utf-8" or replaced:
+        print(
+            f"{time.strftime('%H:%M:%S')} [{MODEL}] {file_path.name} 编码: {encoding}，"
+            f"解码替换 {replaced} 个无法识别的字节",
+            flush=True,
+        )
+
     if max_chars <= 0:
         return content
     if len(content) <= max_chars:
@@ -212,124 +1160,738 @@ def build_messages(text: str) -> list:
     ]
 
 
-def _post_with_urllib(payload: dict, headers: dict) -> dict:
+# 与 分割.py 使用同一套章节标题格式（含 HEADING_FORMATS 中额外启用的格式）识别正文中的标题行
+_heading_matcher = HeadingMatcher(chinese_to_num, configured_heading_formats())
+
+
+def _heading_starts(text: str) -> List[int]:
+    # split 的结果正文、标题交替，累加长度即得各标题行的起始位置
+    starts = []
+    pos = 0
+    for i, part in enumerate(_heading_matcher.split(text)):
+        if i % 2 == 1:
+            starts.append(pos)
+        pos += len(part)
+    return starts
+
+
+def _chunk_limit() -> int:
+    # 分段上限：CHUNK_MAX_CHARS、MAX_INPUT_CHARS 与上下文窗口折算字数中的最小正值
+    reserve_tokens = estimate_tokens("字" * Words) + 1000
+    window_chars = int((CONTEXT_WINDOW_TOKENS - reserve_tokens) / max(CJK_TOKENS_PER_CHAR, 0.1))
+    limits = [n for n in (CHUNK_MAX_CHARS, MAX_INPUT_CHARS, window_chars) if n > 0]
+    return min(limits) if limits else 0
+
+
+def split_text_chunks(text: str, max_chars: int) -> List[str]:
+    """
+    把超长文本切成不超过 max_chars 的若干段：优先在章节标题处切分，单章过长时在段落（行）处切分，
+    单行过长时硬切。各段长度尽量接近，按顺序拼接后与原文完全相同。
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+    piece_count = -(-len(text) // max_chars)
+    target = -(-len(text) // piece_count)
+
+    starts = _heading_starts(text)
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = starts + [len(text)]
+    units: List[str] = []
+    for start, end in zip(bounds, bounds[1:]):
+        block = text[start:end]
+        units.extend([block] if len(block) <= max_chars else block.splitlines(keepends=True))
+
+    pieces: List[str] = []
+    current = ""
+    for unit in units:
+        while len(unit) > max_chars:
+            # 单行过长只能硬切：先把当前段补到目标长度
+            take = target - len(current)
+            if take <= 0:
+                pieces.append(current)
+                current, take = "", target
+            pieces.append(current + unit[:take])
+            current, unit = "", unit[take:]
+        size = len(current) + len(unit)
+        # 超过上限必须另起一段；超过目标长度时，看放入后还是放入前更接近目标
+        if current and (size > max_chars or (size > target and size - target > target - len(current))):
+            pieces.append(current)
+            current = unit
+        else:
+            current += unit
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def build_reduce_messages(sections: List[Tuple[str, str]], words: int, target: str) -> list:
+    # 把若干段按顺序排列的下级总结合并为一篇更高层的梗概
+    body = "\n\n".join(f"【{title}】\n{content}" for title, content in sections)
+    prompt = (
+        f"以下是同一部小说按顺序排列的 {len(sections)} 段剧情总结，请合并为一篇连贯的{target}。要求："
+        f"\n1. 长度约 {words} 字"
+        "\n2. 按时间顺序交代主线发展、关键人物变化和重要转折"
+        "\n3. 合并重复信息，不要逐段罗列"
+        "\n4. 只输出梗概正文，不要额外标题或说明"
+        "\n\n分段总结：\n"
+        + body
+    )
+    return [
+        {"role": "system", "content": "你是擅长长篇小说情节压缩的中文编辑。"},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _encode_body(payload: dict, sizes: Optional[_WireSizes]) -> bytes:
+    data = json.dumps(payload).encode("utf-8")
+    if sizes is not None:
+        sizes.bytes_out = len(data)
+    return data
+
+
+def _count_bytes_in(sizes: Optional[_WireSizes], count: int) -> None:
+    if sizes is not None:
+        sizes.bytes_in += count
+
+
+def _post_with_urllib(
+    payload: dict, headers: dict, url: Optional[str] = None, sizes: Optional[_WireSizes] = None
+) -> dict:
     req = urllib.request.Request(
-        API_URL,
-        data=json.dumps(payload).encode("utf-8"),
+        url or API_URL,
+        data=_encode_body(payload, sizes),
         headers=headers,
         method="POST",
     )
     try:
         with urllib.request.urlopen(req, timeout=REQUEST_READ_TIMEOUT) as resp:
-            body = resp.read().decode("utf-8")
-        return json.loads(body)
+            body = resp.read()
+        _count_bytes_in(sizes, len(body))
+        return json.loads(body.decode("utf-8"))
     except urllib.error.HTTPError as e:
-        detail = e.read().decode("utf-8", errors="ignore")
-        raise RuntimeError(f"HTTP {e.code}: {detail[:300]}") from e
+        detail = e.read()
+        _count_bytes_in(sizes, len(detail))
+        raise RuntimeError(f"HTTP {e.code}: {detail.decode('utf-8', errors='ignore')[:300]}") from e
+
+
+def _post_json(
+    payload: dict, headers: dict, url: Optional[str] = None, sizes: Optional[_WireSizes] = None
+) -> dict:
+    if requests is not None:
+        response = _get_session().post(
+            url=url or API_URL,
+            headers=headers,
+            data=_encode_body(payload, sizes),
+            timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT),
+        )
+        _count_bytes_in(sizes, len(response.content))
+        response.raise_for_status()
+        return response.json()
+    return _post_with_urllib(payload, headers, url, sizes)
 
 
-def call_api(messages: list, file_name: str = "") -> str:
-    available_keys = _available_api_keys()
-    if not available_keys:
-        raise ValueError("API_KEYS 为空，请在脚本中填写有效 key")
+_stream_stats_lock = threading.Lock()
+_stream_stats = {"requests": 0, "ttft": 0.0, "chars": 0, "seconds": 0.0, "early_stops": 0}
 
-    payload = {
-        "model": MODEL,
+
+def _stream_stop_chars(words: int) -> Optional[int]:
+    if STREAM_STOP_RATIO <= 0:
+        return None
+    return int(words * STREAM_STOP_RATIO)
+
+
+class _StreamCollector:
+    """解析 SSE 数据行，累积增量内容并写入 partial 文件，超过长度上限时要求停止读取。"""
+
+    _SENTENCE_ENDS = "。！？!?…」”"
+
+    def __init__(self, name: str, partial_file: Optional[Path], stop_chars: Optional[int]):
+        self.name = name
+        self.partial_file = partial_file
+        self.stop_chars = stop_chars
+        self.parts: List[str] = []
+        self.visible_chars = 0
+        self.truncated = False
+        self.started = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self._out = None
+
+    def feed(self, raw_line) -> bool:
+        # 返回 True 表示流已结束或需要提前停止
+        line = raw_line.decode("utf-8", errors="replace") if isinstance(raw_line, bytes) else raw_line
+        line = line.strip()
+        if not line.startswith("data:"):
+            return False
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return True
+        chunk = json.loads(data)
+        if "error" in chunk:
+            raise RuntimeError(f"流式响应错误：{str(chunk['error'])[:300]}")
+        choices = chunk.get("choices") or [{}]
+        delta = (choices[0].get("delta") or {}).get("content") or ""
+        if not delta:
+            return False
+
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.parts.append(delta)
+        self.visible_chars += _summary_length(delta)
+        if self.partial_file is not None:
+            if self._out is None:
+                self.partial_file.parent.mkdir(parents=True, exist_ok=True)
+                self._out = self.partial_file.open("w", encoding="utf-8")
+            self._out.write(delta)
+            self._out.flush()
+        if self.stop_chars is not None and self.visible_chars >= self.stop_chars:
+            self.truncated = True
+            return True
+        return False
+
+    def close(self) -> None:
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+    def finish(self) -> dict:
+        self.close()
+        content = "".join(self.parts)
+        if self.truncated:
+            # 截到最后一个完整句子，避免半句话
+            cut = max(content.rfind(mark) for mark in self._SENTENCE_ENDS)
+            if cut >= len(content) // 2:
+                content = content[: cut + 1]
+
+        elapsed = time.monotonic() - self.started
+        ttft = (self.first_token_at or time.monotonic()) - self.started
+        generate_seconds = max(elapsed - ttft, 1e-6)
+        chars = _summary_length(content)
+        with _stream_stats_lock:
+            _stream_stats["requests"] += 1
+            _stream_stats["ttft"] += ttft
+            _stream_stats["chars"] += chars
+            _stream_stats["seconds"] += generate_seconds
+            _stream_stats["early_stops"] += int(self.truncated)
+        stop_hint = "，已超出目标长度提前结束" if self.truncated else ""
+        print(
+            f"{time.strftime('%H:%M:%S')} [{MODEL}] 流式完成 {self.name}：首字 {ttft:.1f}s，"
+            f"输出 {chars} 字，{chars / generate_seconds:.1f} 字/s{stop_hint}",
+            flush=True,
+        )
+        return {"choices": [{"message": {"content": content}}]}
+
+
+def _stream_stats_text() -> str:
+    with _stream_stats_lock:
+        count = _stream_stats["requests"]
+        if not count:
+            return "流式请求：0 次"
+        return (
+            f"流式请求：{count} 次，平均首字 {_stream_stats['ttft'] / count:.1f}s，"
+            f"平均 {_stream_stats['chars'] / max(_stream_stats['seconds'], 1e-6):.1f} 字/s，"
+            f"提前结束 {_stream_stats['early_stops']} 次"
+        )
+
+
+def _post_stream(
+    payload: dict,
+    headers: dict,
+    collector: _StreamCollector,
+    url: Optional[str] = None,
+    sizes: Optional[_WireSizes] = None,
+) -> dict:
+    payload = dict(payload, stream=True)
+    url = url or API_URL
+    try:
+        if requests is not None:
+            with _get_session().post(
+                url=url,
+                headers=headers,
+                data=_encode_body(payload, sizes),
+                timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT),
+                stream=True,
+            ) as response:
+                response.raise_for_status()
+                for raw_line in response.iter_lines():
+                    # iter_lines 去掉了换行符，按一个字节补上
+                    _count_bytes_in(sizes, len(raw_line) + 1)
+                    if collector.feed(raw_line):
+                        break
+        else:
+            req = urllib.request.Request(
+                url,
+                data=_encode_body(payload, sizes),
+                headers=headers,
+                method="POST",
+            )
+            try:
+                # 流式时超时作用于每次读取，长时间生成不会整体超时
+                with urllib.request.urlopen(req, timeout=REQUEST_READ_TIMEOUT) as resp:
+                    for raw_line in resp:
+                        _count_bytes_in(sizes, len(raw_line))
+                        if collector.feed(raw_line):
+                            break
+            except urllib.error.HTTPError as e:
+                detail = e.read()
+                _count_bytes_in(sizes, len(detail))
+                raise RuntimeError(f"HTTP {e.code}: {detail.decode('utf-8', errors='ignore')[:300]}") from e
+    finally:
+        collector.close()
+    return collector.finish()
+
+
+def _acquire_slot(provider: Provider, failed_key_indices: set) -> int:
+    # 先占服务商的并发名额再选 key：排队等名额的请求不算作 key 的在途请求
+    limiter = provider.limiter
+    if limiter is not None:
+        limiter.acquire()
+    try:
+        return provider.key_pool.acquire(failed_key_indices)
+    except BaseException:
+        if limiter is not None:
+            limiter.cancel()
+        raise
+
+
+def _send_request(
+    payload: dict, key_index: int, collector: Optional[_StreamCollector] = None, provider: Optional[Provider] = None
+) -> dict:
+    # 一次 HTTP 请求：名额和 key 由 _acquire_slot 占好，请求结果同时反馈给并发限制器和 APIKey 池
+    provider = provider or _active_provider()
+    key_pool = provider.key_pool
+    limiter = provider.limiter
+    _metrics.gauge_add("inflight_requests", 1)
+    sizes = _WireSizes()
+    started = time.monotonic()
+    try:
+        headers = _build_headers(key_pool.keys[key_index])
+        if collector is None:
+            result = _post_json(payload, headers, provider.url, sizes)
+        else:
+            result = _post_stream(payload, headers, collector, provider.url, sizes)
+    except Exception as exc:
+        latency = time.monotonic() - started
+        _metrics.gauge_add("inflight_requests", -1)
+        _record_request(payload, key_pool.keys[key_index], latency, sizes, exc)
+        key_pool.release(key_index, latency, exc)
+        if limiter is not None:
+            limiter.release(latency, exc)
+        raise
+    latency = time.monotonic() - started
+    _metrics.gauge_add("inflight_requests", -1)
+    _record_request(payload, key_pool.keys[key_index], latency, sizes)
+    key_pool.release(key_index, latency)
+    if limiter is not None:
+        limiter.release(latency)
+    return result
+
+
+def _build_payload(messages: list) -> dict:
+    return {
+        "model": _active_provider().model,
         "messages": messages,
         "temperature": 1.9,
         #"max_output_tokens": 1500,
     }
-    key_count = len(available_keys)
-    key_index = _pick_random_key_index(key_count, excluded_indices=set())
-    if key_index is None:
-        raise ValueError("未找到可用 APIKey")
-    headers = _build_headers(available_keys[key_index])
+
+
+def _next_retry(
+    exc: Exception,
+    attempt: int,
+    key_index: int,
+    failed_key_indices: set,
+    key_pool: APIKeyPool,
+    file_name: str,
+) -> Optional[int]:
+    # 判断本次失败是否重试；需要重试时记下失败的 key 并打印日志，返回等待秒数
+    file_hint = f" ({file_name})" if file_name else ""
+
+    # 401/403 只说明当前 key 不可用，还有其他 key 时换 key 重试
+    key_rejected = _extract_http_status(exc) in (401, 403) and len(key_pool) > 1
+    can_retry = _is_retryable_exception(exc) or key_rejected
+    if attempt < RETRY_TIMES and can_retry:
+        _metrics.inc("retries_total", reason=_failure_reason(exc))
+        failed_key_indices.add(key_index)
+        if len(failed_key_indices) >= len(key_pool):
+            # 本轮所有 key 都失败后，重置失败池再继续切换
+            failed_key_indices.clear()
+            failed_key_indices.add(key_index)
+
+        old_key = _mask_api_key(key_pool.keys[key_index])
+        # Retry-After 记在该 key 的冷却时间上，换用其他 key 时不必等待
+        wait_seconds = _retry_delay_seconds(attempt, RETRY_DELAY)
+
+        if _is_rate_limit_exception(exc):
+            retry_after_seconds = _extract_retry_after_seconds(exc)
+            retry_after_hint = (
+                f"（Retry-After={retry_after_seconds}s）"
+                if retry_after_seconds is not None
+                else ""
+            )
+            print(
+                f"{time.strftime('%H:%M:%S')} [{MODEL}] API 触发 Too Many Requests{file_hint}，"
+                f"APIKey {old_key} 进入冷却{retry_after_hint}；{wait_seconds}s 后换 key 重试",
+                flush=True,
+            )
+        else:
+            print(
+                f"{time.strftime('%H:%M:%S')} [{MODEL}] API 请求失败{file_hint}，"
+                f"第 {attempt}/{RETRY_TIMES} 次：{exc}；APIKey {old_key}；"
+                f"{wait_seconds}s 后换 key 重试",
+                flush=True,
+            )
+        return wait_seconds
+
+    if attempt < RETRY_TIMES and not can_retry:
+        print(
+            f"{time.strftime('%H:%M:%S')} [{MODEL}] API 请求错误不可重试：{exc}",
+            flush=True,
+        )
+    return None
+
+
+def call_api(
+    messages: list,
+    file_name: str = "",
+    partial_file: Optional[Path] = None,
+    stop_chars: Optional[int] = None,
+) -> str:
+    provider = _active_provider()
+    key_pool = provider.key_pool
+    payload = _build_payload(messages)
     failed_key_indices: set = set()
 
     last_err = None
     for attempt in range(1, RETRY_TIMES + 1):
+        key_index = _acquire_slot(provider, failed_key_indices)
+        collector = _StreamCollector(file_name, partial_file, stop_chars) if STREAM_MODE else None
         try:
-            if requests is not None:
-                response = requests.post(
-                    url=API_URL,
-                    headers=headers,
-                    data=json.dumps(payload),
-                    timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT),
-                )
+            result = _send_request(payload, key_index, collector, provider)
+            return result["choices"][0]["message"]["content"].strip()
+        except Exception as exc:
+            last_err = exc
+            wait_seconds = _next_retry(
+                exc, attempt, key_index, failed_key_indices, key_pool, file_name
+            )
+            if wait_seconds is None:
+                break
+            time.sleep(wait_seconds)
+
+    raise RuntimeError(f"API 调用失败（模型: {provider.model}）：{last_err}")
+
+
+class AsyncApiClient:
+    """asyncio 引擎使用的 HTTP 客户端：整个运行共享一个连接池。
+
+    安装了 httpx 时使用 httpx.AsyncClient（keep-alive，装有 h2 时启用 HTTP/2）；
+    否则退化为在线程池中调用共享 requests.Session 的同步请求。
+    """
+
+    def __init__(self, max_connections: int):
+        self._client = None
+        self._executor = None
+        if httpx is not None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                ),
+                timeout=httpx.Timeout(REQUEST_READ_TIMEOUT, connect=REQUEST_CONNECT_TIMEOUT),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=max_connections, thread_name_prefix="summary-http"
+            )
+
+    def describe(self) -> str:
+        if self._client is not None:
+            return "httpx HTTP/2" if HTTP2_AVAILABLE else "httpx HTTP/1.1 keep-alive"
+        if requests is not None:
+            return "requests.Session 线程池（未安装 httpx）"
+        return "urllib 线程池（未安装 httpx/requests）"
+
+    async def post_json(
+        self, payload: dict, headers: dict, url: Optional[str] = None, sizes: Optional[_WireSizes] = None
+    ) -> dict:
+        if self._client is not None:
+            response = await self._client.post(
+                url or API_URL, headers=headers, content=_encode_body(payload, sizes)
+            )
+            _count_bytes_in(sizes, len(response.content))
+            response.raise_for_status()
+            return response.json()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, _post_json, payload, headers, url, sizes)
+
+    async def post_stream(
+        self,
+        payload: dict,
+        headers: dict,
+        collector: _StreamCollector,
+        url: Optional[str] = None,
+        sizes: Optional[_WireSizes] = None,
+    ) -> dict:
+        if self._client is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, _post_stream, payload, headers, collector, url, sizes
+            )
+        try:
+            async with self._client.stream(
+                "POST",
+                url or API_URL,
+                headers=headers,
+                content=_encode_body(dict(payload, stream=True), sizes),
+            ) as response:
                 response.raise_for_status()
-                result = response.json()
-            else:
-                result = _post_with_urllib(payload, headers)
+                async for line in response.aiter_lines():
+                    # aiter_lines 去掉了换行符，按一个字节补上
+                    _count_bytes_in(sizes, len(line.encode("utf-8")) + 1)
+                    if collector.feed(line):
+                        break
+        finally:
+            collector.close()
+        return collector.finish()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+async def _acquire_slot_async(provider: Provider, failed_key_indices: set) -> int:
+    limiter = provider.limiter
+    if limiter is not None:
+        await limiter.acquire_async()
+    try:
+        return await provider.key_pool.acquire_async(failed_key_indices)
+    except BaseException:
+        # 等 key 冷却时被取消，名额要还给限制器
+        if limiter is not None:
+            limiter.cancel()
+        raise
+
+
+async def _send_request_async(
+    client: AsyncApiClient,
+    payload: dict,
+    key_index: int,
+    collector: Optional[_StreamCollector] = None,
+    provider: Optional[Provider] = None,
+) -> dict:
+    provider = provider or _active_provider()
+    key_pool = provider.key_pool
+    limiter = provider.limiter
+    _metrics.gauge_add("inflight_requests", 1)
+    sizes = _WireSizes()
+    started = time.monotonic()
+    try:
+        headers = _build_headers(key_pool.keys[key_index])
+        if collector is None:
+            result = await client.post_json(payload, headers, provider.url, sizes)
+        else:
+            result = await client.post_stream(payload, headers, collector, provider.url, sizes)
+    except (Exception, asyncio.CancelledError) as exc:
+        # 任务被取消时也要归还 key 和并发名额
+        latency = time.monotonic() - started
+        _metrics.gauge_add("inflight_requests", -1)
+        _record_request(payload, key_pool.keys[key_index], latency, sizes, exc)
+        key_pool.release(key_index, latency, exc)
+        if limiter is not None:
+            limiter.release(latency, exc)
+        raise
+    latency = time.monotonic() - started
+    _metrics.gauge_add("inflight_requests", -1)
+    _record_request(payload, key_pool.keys[key_index], latency, sizes)
+    key_pool.release(key_index, latency)
+    if limiter is not None:
+        limiter.release(latency)
+    return result
+
+
+async def call_api_async(
+    client: AsyncApiClient,
+    messages: list,
+    file_name: str = "",
+    partial_file: Optional[Path] = None,
+    stop_chars: Optional[int] = None,
+) -> str:
+    # 与 call_api 相同的重试与 APIKey 切换逻辑，等待期间不占用线程
+    provider = _active_provider()
+    key_pool = provider.key_pool
+    payload = _build_payload(messages)
+    failed_key_indices: set = set()
+
+    last_err = None
+    for attempt in range(1, RETRY_TIMES + 1):
+        key_index = await _acquire_slot_async(provider, failed_key_indices)
+        collector = _StreamCollector(file_name, partial_file, stop_chars) if STREAM_MODE else None
+        try:
+            result = await _send_request_async(client, payload, key_index, collector, provider)
             return result["choices"][0]["message"]["content"].strip()
         except Exception as exc:
             last_err = exc
-            file_hint = f" ({file_name})" if file_name else ""
-
-            can_retry = _is_retryable_exception(exc)
-            if attempt < RETRY_TIMES and can_retry:
-                failed_key_indices.add(key_index)
-                next_key_index = _pick_random_key_index(
-                    key_count=key_count,
-                    excluded_indices=failed_key_indices,
-                )
-                if next_key_index is None:
-                    # 本轮所有 key 都失败后，重置失败池再继续随机切换
-                    failed_key_indices = {key_index}
-                    next_key_index = _pick_random_key_index(
-                        key_count=key_count,
-                        excluded_indices=failed_key_indices,
-                    )
+            wait_seconds = _next_retry(
+                exc, attempt, key_index, failed_key_indices, key_pool, file_name
+            )
+            if wait_seconds is None:
+                break
+            await asyncio.sleep(wait_seconds)
 
-                if next_key_index is None:
-                    print(
-                        f"{time.strftime('%H:%M:%S')} [{MODEL}] API 请求失败{file_hint}："
-                        f"没有可切换的 APIKey，停止重试",
-                        flush=True,
-                    )
-                    break
+    raise RuntimeError(f"API 调用失败（模型: {provider.model}）：{last_err}")
 
-                old_key = _mask_api_key(available_keys[key_index])
-                key_index = next_key_index
-                new_key = _mask_api_key(available_keys[key_index])
-                headers = _build_headers(available_keys[key_index])
-                wait_seconds = _retry_delay_seconds(attempt, RETRY_DELAY)
-                retry_after_seconds = _extract_retry_after_seconds(exc)
-                if retry_after_seconds is not None:
-                    wait_seconds = max(wait_seconds, retry_after_seconds)
-
-                if _is_rate_limit_exception(exc):
-                    retry_after_hint = (
-                        f"（Retry-After={retry_after_seconds}s）"
-                        if retry_after_seconds is not None
-                        else ""
-                    )
-                    print(
-                        f"{time.strftime('%H:%M:%S')} [{MODEL}] API 触发 Too Many Requests{file_hint}，"
-                        f"切换 APIKey: {old_key} -> {new_key}；{wait_seconds}s 后重试{retry_after_hint}",
-                        flush=True,
-                    )
-                else:
-                    print(
-                        f"{time.strftime('%H:%M:%S')} [{MODEL}] API 请求失败{file_hint}，"
-                        f"第 {attempt}/{RETRY_TIMES} 次：{exc}；切换 APIKey: {old_key} -> {new_key}；"
-                        f"{wait_seconds}s 后重试",
-                        flush=True,
-                    )
-                time.sleep(wait_seconds)
-                continue
-            if attempt < RETRY_TIMES and not can_retry:
-                print(
-                    f"{time.strftime('%H:%M:%S')} [{MODEL}] API 请求错误不可重试：{exc}",
-                    flush=True,
-                )
-            break
 
-    raise RuntimeError(f"API 调用失败（模型: {MODEL}）：{last_err}")
+def _cache_lookup(messages: list) -> Tuple[Optional[SummaryCache], str, Optional[str]]:
+    cache = _get_summary_cache()
+    if cache is None:
+        return None, "", None
+    key = SummaryCache.make_key(_build_payload(messages))
+    cached = cache.get(key)
+    if cached is not None:
+        _metrics.inc("cache_hits_total")
+        _span_event("cache_hit")
+    return cache, key, cached
 
 
-def summarize_one_file(file_path: Path) -> str:
-    text = read_text(file_path, max_chars=MAX_INPUT_CHARS)
-    return call_api(build_messages(text), file_path.name)
+def _cache_store(
+    cache: Optional[SummaryCache], key: str, summary: str, min_length: Optional[int] = None
+) -> None:
+    # 过短的总结会被文件级重试丢弃，不写入缓存
+    if min_length is None:
+        min_length = _min_summary_length()
+    if cache is not None and _summary_length(summary) >= min_length:
+        cache.put(key, summary)
+
+
+def _read_file_pieces(file_path: Path) -> List[str]:
+    # 开启自动分段时完整读取并按分段上限切分，否则按 MAX_INPUT_CHARS 截断
+    if not AUTO_CHUNK:
+        return [read_text(file_path, max_chars=MAX_INPUT_CHARS)]
+    text = read_text(file_path, max_chars=0)
+    limit = _chunk_limit()
+    pieces = split_text_chunks(text, limit)
+    if len(pieces) > 1:
+        print(
+            f"{time.strftime('%H:%M:%S')} [{MODEL}] {file_path.name} 共 {len(text)} 字，超过分段上限 {limit} 字，"
+            f"按章节/段落切成 {len(pieces)} 段并行总结后合并",
+            flush=True,
+        )
+        _metrics.inc("chunked_files_total")
+        _span_event("chunked", pieces=len(pieces), chars=len(text))
+    return pieces
+
+
+def _chunk_messages(file_path: Path, pieces: List[str]) -> List[Tuple[list, str]]:
+    total = len(pieces)
+    return [
+        (build_messages(piece), f"{file_path.name}（第 {i}/{total} 段）")
+        for i, piece in enumerate(pieces, start=1)
+    ]
+
+
+def _chunk_reduce_messages(summaries: List[str]) -> list:
+    sections = [(f"第 {i} 段", summary) for i, summary in enumerate(summaries, start=1)]
+    return build_reduce_messages(sections, Words, "剧情总结")
+
+
+async def _in_thread(func, *args):
+    # asyncio 引擎中的磁盘读写、哈希、fsync 和 SQLite 都是阻塞操作，放到线程里执行，不拖住其他在途请求；
+    # to_thread 会复制当前上下文，追踪记录和当前服务商在线程里仍然有效
+    return await asyncio.to_thread(func, *args)
+
+
+def _prepare_file(file_path: Path) -> Tuple[List[str], Optional[list], Optional[SummaryCache], str, Optional[str]]:
+    """
+    读取文件并查询摘要缓存，两种引擎共用（asyncio 引擎经 _in_thread 调用）。
+
+    Returns:
+        (分段, 不分段时的请求消息, 缓存, 缓存键, 缓存命中的总结)
+    """
+    pieces = _read_file_pieces(file_path)
+    if len(pieces) > 1:
+        return pieces, None, None, "", None
+    messages = build_messages(pieces[0])
+    cache, key, cached = _cache_lookup(messages)
+    return pieces, messages, cache, key, cached
+
+
+def _summarize_chunks(file_path: Path, pieces: List[str]) -> str:
+    # 各段并行总结（复制当前上下文，请求计入本文件的追踪记录），再用一次合并请求汇总
+    with ThreadPoolExecutor(max_workers=len(pieces), thread_name_prefix="summary-chunk") as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, summarize_reduce, messages, name, Words)
+            for messages, name in _chunk_messages(file_path, pieces)
+        ]
+        summaries = [future.result() for future in futures]
+    return summarize_reduce(_chunk_reduce_messages(summaries), file_path.name, Words, validate=True)
+
+
+async def _summarize_chunks_async(client: AsyncApiClient, file_path: Path, pieces: List[str]) -> str:
+    summaries = await asyncio.gather(
+        *(
+            summarize_reduce_async(client, messages, name, Words)
+            for messages, name in _chunk_messages(file_path, pieces)
+        )
+    )
+    return await summarize_reduce_async(
+        client, _chunk_reduce_messages(list(summaries)), file_path.name, Words, validate=True
+    )
+
+
+def summarize_one_file(file_path: Path, partial_file: Optional[Path] = None) -> str:
+    pieces, messages, cache, key, cached = _prepare_file(file_path)
+    if messages is None:
+        return _summarize_chunks(file_path, pieces)
+    if cached is not None:
+        return cached
+    summary = call_api(messages, file_path.name, partial_file, _stream_stop_chars(Words))
+    summary = validate_and_repair(messages, summary, file_path.name)
+    _cache_store(cache, key, summary)
+    return summary
+
+
+async def summarize_one_file_async(
+    client: AsyncApiClient, file_path: Path, partial_file: Optional[Path] = None
+) -> str:
+    pieces, messages, cache, key, cached = await _in_thread(_prepare_file, file_path)
+    if messages is None:
+        return await _summarize_chunks_async(client, file_path, pieces)
+    if cached is not None:
+        return cached
+    summary = await call_api_async(client, messages, file_path.name, partial_file, _stream_stop_chars(Words))
+    summary = await validate_and_repair_async(client, messages, summary, file_path.name)
+    await _in_thread(_cache_store, cache, key, summary)
+    return summary
+
+
+def summarize_reduce(messages: list, name: str, words: int, validate: bool = False) -> str:
+    # validate=True 时在写入缓存前做质量校验与修复（用于直接作为文件总结的合并结果）
+    min_length = max(1, words // 4)
+    cache, key, cached = _cache_lookup(messages)
+    if cached is not None:
+        return cached
+    summary = call_api(messages, name, stop_chars=_stream_stop_chars(words))
+    if validate:
+        summary = validate_and_repair(messages, summary, name, words)
+    _cache_store(cache, key, summary, min_length)
+    return summary
+
+
+async def summarize_reduce_async(
+    client: AsyncApiClient, messages: list, name: str, words: int, validate: bool = False
+) -> str:
+    min_length = max(1, words // 4)
+    cache, key, cached = await _in_thread(_cache_lookup, messages)
+    if cached is not None:
+        return cached
+    summary = await call_api_async(client, messages, name, stop_chars=_stream_stop_chars(words))
+    if validate:
+        summary = await validate_and_repair_async(client, messages, summary, name, words)
+    await _in_thread(_cache_store, cache, key, summary, min_length)
+    return summary
 
 
 def _summary_length(summary: str) -> int:
@@ -341,81 +1903,1178 @@ def _min_summary_length() -> int:
     return max(1, Words // 4)
 
 
-def summarize_one_file_with_retry(
-    file_path: Path, idx: int, total: int, thread_id: int
+def _check_summary(summary: str) -> None:
+    summary_len = _summary_length(summary)
+    min_len = _min_summary_length()
+    if summary_len < min_len:
+        raise ValueError(
+            f"summary too short: {summary_len} < {min_len} (Words={Words})"
+        )
+
+
+# 质量问题类型及其中文名称；_FATAL_PROBLEMS 中的问题修复后仍存在时按文件级失败重试，其余只记录警告
+PROBLEM_LABELS = {
+    "too_short": "过短",
+    "too_long": "过长",
+    "banned": "禁用词",
+    "format": "标题/说明",
+    "refusal": "拒答",
+    "cjk_ratio": "中文占比低",
+    "repetition": "重复",
+}
+_FATAL_PROBLEMS = {"too_short", "refusal", "repetition"}
+_HEADING_LINE_RE = re.compile(
+    r"^[ \t　]*(?:#{1,6}[ \t]|\*\*[^*\n]{1,40}\*\*[:：]?[ \t]*$|【[^】\n]{1,40}】[ \t]*$)[^\n]*\n?", re.M
+)
+_PREAMBLE_RE = re.compile(r"\A[ \t　]*[^\n]{0,30}(?:总结|梗概|概要|摘要)[^\n]{0,10}[：:][ \t]*\n")
+_validation_stats_lock = threading.Lock()
+_validation_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _cjk_ratio(text: str) -> float:
+    # 只统计字母和汉字，标点与数字不影响比例
+    letters = re.findall(r"[^\W\d_]", text)
+    if not letters:
+        return 1.0
+    return sum(1 for ch in letters if _CJK_RE.match(ch)) / len(letters)
+
+
+def _repeat_ratio(text: str) -> float:
+    compact = re.sub(r"\s+", "", text)
+    total = len(compact) - REPEAT_NGRAM + 1
+    if total <= 0:
+        return 0.0
+    seen: set = set()
+    repeated = 0
+    for i in range(total):
+        gram = compact[i:i + REPEAT_NGRAM]
+        if gram in seen:
+            repeated += 1
+        else:
+            seen.add(gram)
+    return repeated / total
+
+
+def _banned_found(summary: str) -> List[str]:
+    return [phrase for phrase in BANNED_PHRASES if phrase in summary]
+
+
+def validate_summary(summary: str, words: int = Words) -> List[str]:
+    """检查总结质量，返回问题类型列表（见 PROBLEM_LABELS），合格时为空列表。"""
+    problems = []
+    length = _summary_length(summary)
+    if length < max(1, words // 4):
+        problems.append("too_short")
+    elif SUMMARY_MAX_RATIO > 0 and length > words * SUMMARY_MAX_RATIO:
+        problems.append("too_long")
+    if _banned_found(summary):
+        problems.append("banned")
+    if _PREAMBLE_RE.match(summary) or _HEADING_LINE_RE.search(summary):
+        problems.append("format")
+    head = summary[:200]
+    if any(phrase in head for phrase in REFUSAL_PHRASES):
+        problems.append("refusal")
+    if length and _cjk_ratio(summary) < MIN_CJK_RATIO:
+        problems.append("cjk_ratio")
+    if _repeat_ratio(summary) > MAX_REPEAT_RATIO:
+        problems.append("repetition")
+    return problems
+
+
+def _strip_summary_format(summary: str) -> str:
+    # 本地修复：去掉开头的“以下是总结：”之类的说明和单独成行的标题，不需要请求
+    summary = _PREAMBLE_RE.sub("", summary, count=1)
+    return _HEADING_LINE_RE.sub("", summary).strip()
+
+
+def _repair_messages(messages: list, summary: str, problems: List[str], words: int) -> Tuple[list, str]:
+    """
+    按问题类型构造修复请求：拒答和过短在原对话后追加一轮（续写只需生成缺少的部分），
+    其余问题只把总结本身发给模型改写，不再重复发送小说原文。
+
+    Returns:
+        (修复请求的消息, 方式：redo=替换原总结，continue=接在原总结后面，rewrite=替换原总结)
+    """
+    conversation = list(messages) + [{"role": "assistant", "content": summary}]
+    if "refusal" in problems:
+        return conversation + [{
+            "role": "user",
+            "content": f"请不要拒绝或解释，直接按上面的要求输出约 {words} 字的总结正文。",
+        }], "redo"
+    if "too_short" in problems:
+        missing = max(words - _summary_length(summary), words // 4)
+        return conversation + [{
+            "role": "user",
+            "content": (
+                f"总结太短，请紧接着上文继续写约 {missing} 字，只输出续写的部分，"
+                "不要重复已写的内容，也不要加标题或说明。"
+            ),
+        }], "continue"
+    issues = []
+    if "banned" in problems:
+        issues.append(f"出现了“{'、'.join(_banned_found(summary))}”等字眼")
+    if "format" in problems:
+        issues.append("带有标题或说明文字")
+    if "cjk_ratio" in problems:
+        issues.append("夹杂过多非中文内容，请全部改用中文表述")
+    if "repetition" in problems:
+        issues.append("有大段重复的内容，请删去重复部分")
+    if "too_long" in problems:
+        issues.append(f"篇幅过长，请压缩到约 {words} 字")
+    prompt = (
+        f"下面是一篇小说总结，存在以下问题：{'；'.join(issues)}。"
+        f"请在不改变情节内容的前提下改写，长度约 {words} 字，只输出改写后的总结正文。"
+        "\n\n总结：\n"
+        + summary
+    )
+    return [messages[0], {"role": "user", "content": prompt}], "rewrite"
+
+
+def _apply_repair(summary: str, repaired: str, mode: str) -> str:
+    if mode == "continue":
+        return summary.rstrip() + repaired.strip()
+    return repaired
+
+
+def _problems_text(problems: List[str]) -> str:
+    return "、".join(PROBLEM_LABELS.get(problem, problem) for problem in problems)
+
+
+def _finish_validation(
+    model: str, name: str, summary: str, found: List[str], remaining: List[str], repairs: int
 ) -> str:
+    # 记录按模型区分的校验统计；致命问题修复后仍存在时抛出异常交给文件级重试
+    result = "passed" if not found else ("unresolved" if remaining else "repaired")
+    with _validation_stats_lock:
+        stats = _validation_stats.setdefault(model, {})
+        for key in [result, "checked"] + [f"problem_{problem}" for problem in found]:
+            stats[key] = stats.get(key, 0) + 1
+        stats["repair_requests"] = stats.get("repair_requests", 0) + repairs
+    _metrics.inc("summary_checks_total", model=model, result=result)
+    for problem in found:
+        _metrics.inc("summary_problems_total", model=model, problem=problem)
+    if found:
+        _span_event("validation", found=found, remaining=remaining, repairs=repairs)
+        print(
+            f"{time.strftime('%H:%M:%S')} [{MODEL}] {name} 质量校验：{_problems_text(found)}，"
+            f"{'已修复' if not remaining else '仍有 ' + _problems_text(remaining)}（修复请求 {repairs} 次）",
+            flush=True,
+        )
+    fatal = [problem for problem in remaining if problem in _FATAL_PROBLEMS]
+    if fatal:
+        raise ValueError(f"summary failed validation: {','.join(fatal)} (model={model})")
+    return summary
+
+
+def validate_and_repair(messages: list, summary: str, name: str, words: int = Words) -> str:
+    """校验总结质量，不合格时先本地去掉标题，再在原对话上追加最多 REPAIR_TIMES 次修复请求。"""
+    if not VALIDATION_ENABLED:
+        return summary
+    model = _active_provider().model
+    found = validate_summary(summary, words)
+    problems = found
+    if found:
+        summary = _strip_summary_format(summary)
+        problems = validate_summary(summary, words)
+    repairs = 0
+    while problems and repairs < REPAIR_TIMES:
+        repair_messages, mode = _repair_messages(messages, summary, problems, words)
+        repairs += 1
+        _metrics.inc("repair_requests_total", model=model, mode=mode)
+        repaired = call_api(repair_messages, f"{name}（修复）", stop_chars=_stream_stop_chars(words))
+        summary = _strip_summary_format(_apply_repair(summary, repaired, mode))
+        problems = validate_summary(summary, words)
+    return _finish_validation(model, name, summary, found, problems, repairs)
+
+
+async def validate_and_repair_async(
+    client: AsyncApiClient, messages: list, summary: str, name: str, words: int = Words
+) -> str:
+    if not VALIDATION_ENABLED:
+        return summary
+    model = _active_provider().model
+    found = validate_summary(summary, words)
+    problems = found
+    if found:
+        summary = _strip_summary_format(summary)
+        problems = validate_summary(summary, words)
+    repairs = 0
+    while problems and repairs < REPAIR_TIMES:
+        repair_messages, mode = _repair_messages(messages, summary, problems, words)
+        repairs += 1
+        _metrics.inc("repair_requests_total", model=model, mode=mode)
+        repaired = await call_api_async(
+            client, repair_messages, f"{name}（修复）", stop_chars=_stream_stop_chars(words)
+        )
+        summary = _strip_summary_format(_apply_repair(summary, repaired, mode))
+        problems = validate_summary(summary, words)
+    return _finish_validation(model, name, summary, found, problems, repairs)
+
+
+def _validation_stats_text() -> List[str]:
+    lines = []
+    with _validation_stats_lock:
+        for model, stats in sorted(_validation_stats.items()):
+            problems = "，".join(
+                f"{label} {stats[f'problem_{problem}']}"
+                for problem, label in PROBLEM_LABELS.items()
+                if stats.get(f"problem_{problem}")
+            )
+            lines.append(
+                f"质量校验（{model}）：{stats.get('checked', 0)} 篇，合格 {stats.get('passed', 0)}，"
+                f"修复 {stats.get('repaired', 0)}，仍不合格 {stats.get('unresolved', 0)}，"
+                f"修复请求 {stats.get('repair_requests', 0)} 次" + (f"；问题：{problems}" if problems else "")
+            )
+    return lines
+
+
+def _log_file_failure(
+    worker_name: str, file_path: Path, idx: int, total: int, file_attempt: int, exc: Exception
+) -> Optional[int]:
+    # 打印文件级失败日志；还能重试时返回等待秒数，否则返回 None
+    _span_event("file_attempt_failed", attempt=file_attempt, error=str(exc)[:200])
+    if file_attempt < FILE_RETRY_TIMES:
+        _metrics.inc("file_retries_total", reason=type(exc).__name__)
+        wait_seconds = _retry_delay_seconds(file_attempt, FILE_RETRY_DELAY)
+        print(
+            f"{time.strftime('%H:%M:%S')} [{MODEL}] [{worker_name}] [{idx}/{total}] "
+            f"失败 {file_path.name}（文件级重试第 {file_attempt}/{FILE_RETRY_TIMES} 次）: {exc}；"
+            f"{wait_seconds}s 后重试",
+            flush=True,
+        )
+        return wait_seconds
+    print(
+        f"[{MODEL}] [{worker_name}] [{idx}/{total}] 失败 {file_path.name}: {exc}",
+        flush=True,
+    )
+    return None
+
+
+def _provider_hint(provider: Provider) -> str:
+    return f"（{provider.name}：{provider.model}）" if len(_get_providers()) > 1 else ""
+
+
+def summarize_one_file_with_retry(
+    file_path: Path, idx: int, total: int, thread_id: int, part_file: Optional[Path] = None
+) -> Tuple[str, str]:
+    """
+    总结单个文件，失败时按文件级重试；每次尝试分配一个服务商，重试时优先换到其他服务商。
+
+    Returns:
+        (总结, 生成该总结的模型)
+    """
     thread_name = f"线程{thread_id}"
     print(
         f"{time.strftime('%H:%M:%S')} [{MODEL}] [{thread_name}] [{idx}/{total}] 开始 {file_path.name}",
         flush=True,
     )
+    span, span_token = _start_span(file_path.name, idx, thread_name)
 
     summary = None
+    model = MODEL
     last_exc = None
+    failed_providers: set = set()
     for file_attempt in range(1, FILE_RETRY_TIMES + 1):
+        provider = _pick_provider(failed_providers)
+        provider_token = _current_provider.set(provider)
+        done = False
         try:
-            summary = summarize_one_file(file_path)
-            summary_len = _summary_length(summary)
-            min_len = _min_summary_length()
-            if summary_len < min_len:
-                raise ValueError(
-                    f"summary too short: {summary_len} < {min_len} (Words={Words})"
-                )
+            summary = summarize_one_file(file_path, _partial_path(part_file))
+            model = provider.model
+            _check_summary(summary)
+            done = True
             print(
-                f"{time.strftime('%H:%M:%S')} [{MODEL}] [{thread_name}] [{idx}/{total}] 完成 {file_path.name}",
+                f"{time.strftime('%H:%M:%S')} [{MODEL}] [{thread_name}] [{idx}/{total}] "
+                f"完成 {file_path.name}{_provider_hint(provider)}",
                 flush=True,
             )
             break
         except Exception as exc:
             last_exc = exc
-            if file_attempt < FILE_RETRY_TIMES:
-                wait_seconds = _retry_delay_seconds(file_attempt, FILE_RETRY_DELAY)
-                print(
-                    f"{time.strftime('%H:%M:%S')} [{MODEL}] [{thread_name}] [{idx}/{total}] "
-                    f"失败 {file_path.name}（文件级重试第 {file_attempt}/{FILE_RETRY_TIMES} 次）: {exc}；"
-                    f"{wait_seconds}s 后重试",
-                    flush=True,
-                )
+            failed_providers.add(provider.name)
+            wait_seconds = _log_file_failure(thread_name, file_path, idx, total, file_attempt, exc)
+            if wait_seconds is not None:
                 time.sleep(wait_seconds)
-            else:
-                print(
-                    f"[{MODEL}] [{thread_name}] [{idx}/{total}] 失败 {file_path.name}: {exc}",
-                    flush=True,
-                )
+        finally:
+            _current_provider.reset(provider_token)
+            _release_provider(provider, done)
 
     if summary is None:
         summary = f"[总结失败] {last_exc}"
-    return summary
+    _finish_span(span, span_token, summary)
+    return summary, model
+
+
+async def summarize_one_file_with_retry_async(
+    client: AsyncApiClient, file_path: Path, idx: int, total: int, part_file: Optional[Path] = None
+) -> Tuple[str, str]:
+    worker_name = "协程"
+    print(
+        f"{time.strftime('%H:%M:%S')} [{MODEL}] [{worker_name}] [{idx}/{total}] 开始 {file_path.name}",
+        flush=True,
+    )
+    span, span_token = _start_span(file_path.name, idx, worker_name)
+
+    summary = None
+    model = MODEL
+    last_exc = None
+    failed_providers: set = set()
+    for file_attempt in range(1, FILE_RETRY_TIMES + 1):
+        provider = _pick_provider(failed_providers)
+        provider_token = _current_provider.set(provider)
+        done = False
+        try:
+            summary = await summarize_one_file_async(client, file_path, _partial_path(part_file))
+            model = provider.model
+            _check_summary(summary)
+            done = True
+            print(
+                f"{time.strftime('%H:%M:%S')} [{MODEL}] [{worker_name}] [{idx}/{total}] "
+                f"完成 {file_path.name}{_provider_hint(provider)}",
+                flush=True,
+            )
+            break
+        except Exception as exc:
+            last_exc = exc
+            failed_providers.add(provider.name)
+            wait_seconds = _log_file_failure(worker_name, file_path, idx, total, file_attempt, exc)
+            if wait_seconds is not None:
+                await asyncio.sleep(wait_seconds)
+        finally:
+            _current_provider.reset(provider_token)
+            _release_provider(provider, done)
+
+    if summary is None:
+        summary = f"[总结失败] {last_exc}"
+    _finish_span(span, span_token, summary)
+    return summary, model
 
 
 def _index_width(total: int) -> int:
     return max(1, len(str(total)))
 
 
-def _tmp_part_path(tmp_dir: Path, idx: int, total: int) -> Path:
+def tmp_part_path(tmp_dir: Path, idx: int, total: int) -> Path:
     width = _index_width(total)
     return tmp_dir / f"{idx:0{width}d}.txt"
 
 
+def _partial_path(part_file: Optional[Path]) -> Optional[Path]:
+    # 流式输出的半成品另存，中断后不会被当作已完成的临时文件跳过
+    if part_file is None or not STREAM_MODE:
+        return None
+    return part_file.with_name(part_file.name + ".partial")
+
+
+def format_part(file_path: Path, summary: str, model: Optional[str] = None) -> str:
+    return f"第{file_path.name}章总结：{model or MODEL}\n{'=' * 40}\n{summary}"
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    # 先写同目录临时文件再改名，中途崩溃不会留下写了一半的文件
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PartManifest:
+    """tmp/manifest.jsonl：每写完一个临时文件追加一行记录，同一序号以最后一行为准。
+
+    记录字段：idx、total、part、source、source_sha256、source_mtime_ns、status（done/failed/stale）、
+    sha256、size、model、latency、time；stale 记录另有 reason（按重跑清单标记为需要重新总结）。
+    """
+
+    def __init__(self, tmp_dir: Path):
+        self.path = tmp_dir / MANIFEST_NAME
+        self.records: Dict[int, dict] = {}
+        self._lock = threading.Lock()
+        self._needs_newline = False
+        if self.path.exists():
+            with self.path.open("rb") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    self._needs_newline = f.read(1) != b"\n"
+            with self.path.open("r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时可能留下半行，忽略即可
+                        continue
+                    self.records[int(record["idx"])] = record
+
+    def record(
+        self,
+        idx: int,
+        total: int,
+        part_file: Path,
+        file_path: Path,
+        part: str,
+        latency: float,
+        model: Optional[str] = None,
+    ) -> dict:
+        source = file_path.read_bytes()
+        data = part.encode("utf-8")
+        record = {
+            "idx": idx,
+            "total": total,
+            "part": part_file.name,
+            "source": file_path.name,
+            "source_sha256": hashlib.sha256(source).hexdigest(),
+            "source_mtime_ns": file_path.stat().st_mtime_ns,
+            "status": "done" if _part_body_text(part) is not None else "failed",
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "size": len(data),
+            "model": model or MODEL,
+            "latency": round(latency, 3),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self._append(record)
+        return record
+
+    def _append(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._needs_newline:
+                # 上次崩溃留下的半行单独成行，不影响本条记录
+                line = "\n" + line
+                self._needs_newline = False
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.records[int(record["idx"])] = record
+
+    def mark_stale(self, idx: int, total: int, part_file: Path, reason: str) -> None:
+        # 追加一条 stale 记录：临时文件保留原样（重跑失败时仍可合并旧内容），但不再被当作已完成而跳过
+        record = self.valid_record(idx, part_file)
+        if record is None:
+            data = part_file.read_bytes()
+            record = {"idx": idx, "total": total, "part": part_file.name,
+                      "sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+        self._append(dict(record, status="stale", reason=reason, time=time.strftime("%Y-%m-%d %H:%M:%S")))
+
+    def valid_record(self, idx: int, part_file: Path) -> Optional[dict]:
+        # 清单记录与磁盘上的临时文件一致时返回该记录
+        record = self.records.get(idx)
+        if record is None or record.get("part") != part_file.name or not part_file.exists():
+            return None
+        if part_file.stat().st_size != record.get("size"):
+            return None
+        return record
+
+    def renumber(self, tmp_dir: Path, total: int) -> int:
+        # 流水线在总数确定前只能按临时宽度命名，结束后把文件名和记录统一为 tmp_part_path 的命名
+        renamed = 0
+        for idx, record in sorted(self.records.items()):
+            part_file = tmp_part_path(tmp_dir, idx, total)
+            if idx > total or (record.get("part") == part_file.name and record.get("total") == total):
+                continue
+            if record.get("part") != part_file.name:
+                old_file = tmp_dir / record.get("part", "")
+                if not old_file.is_file():
+                    continue
+                os.replace(old_file, part_file)
+                renamed += 1
+            self._append(dict(record, part=part_file.name, total=total))
+        return renamed
+
+    def remove(self) -> None:
+        with self._lock:
+            if self.path.exists():
+                self.path.unlink()
+            self.records.clear()
+
+
+def _write_part(part_file: Path, file_path: Path, summary: str, model: Optional[str] = None) -> str:
+    part = format_part(file_path, summary, model)
+    _atomic_write_text(part_file, part)
+    partial_file = _partial_path(part_file)
+    if partial_file is not None and partial_file.exists():
+        partial_file.unlink()
+    return part
+
+
+def save_part(
+    manifest: PartManifest,
+    idx: int,
+    total: int,
+    part_file: Path,
+    file_path: Path,
+    summary: str,
+    latency: float,
+    model: Optional[str] = None,
+) -> str:
+    part = _write_part(part_file, file_path, summary, model)
+    manifest.record(idx, total, part_file, file_path, part, latency, model)
+    return part
+
+
+def save_failed_part(
+    manifest: PartManifest,
+    idx: int,
+    total: int,
+    part_file: Path,
+    file_path: Path,
+    worker_name: str,
+    exc: Exception,
+    latency: float,
+) -> str:
+    """单个文件处理中出现未捕获的异常：记录日志，写入失败的临时文件和清单记录，返回该部分的内容。"""
+    print(
+        f"{time.strftime('%H:%M:%S')} [{MODEL}] [{worker_name}] [{idx}/{total}] "
+        f"处理 {file_path.name} 出错：{exc!r}",
+        flush=True,
+    )
+    _metrics.inc("files_total", status="failed")
+    summary = f"[总结失败] {exc}"
+    try:
+        return save_part(manifest, idx, total, part_file, file_path, summary, latency)
+    except Exception as save_exc:
+        # 原文已不可读时无法计算原文哈希，只记录临时文件本身
+        print(f"{time.strftime('%H:%M:%S')} [{MODEL}] [{worker_name}] 写入失败记录出错：{save_exc!r}", flush=True)
+    part = format_part(file_path, summary)
+    try:
+        _write_part(part_file, file_path, summary)
+        data = part.encode("utf-8")
+        manifest._append({
+            "idx": idx, "total": total, "part": part_file.name, "source": file_path.name, "status": "failed",
+            "sha256": hashlib.sha256(data).hexdigest(), "size": len(data), "model": MODEL,
+            "latency": round(latency, 3), "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+    except OSError as write_exc:
+        print(f"{time.strftime('%H:%M:%S')} [{MODEL}] [{worker_name}] 写入临时文件出错：{write_exc!r}", flush=True)
+    return part
+
+
+def should_skip_part(
+    manifest: PartManifest, idx: int, total: int, part_file: Path, file_path: Path, tmp_exists_mode: int
+) -> bool:
+    # 以清单为准：只有记录为成功且与磁盘文件一致的临时文件才跳过，失败的部分会重新总结
+    if tmp_exists_mode != 0 or not part_file.exists():
+        return False
+    record = manifest.valid_record(idx, part_file)
+    if record is None and idx not in manifest.records:
+        # 清单出现之前生成的临时文件：按内容补记一条
+        part = part_file.read_text(encoding="utf-8", errors="ignore")
+        model = part.split("\n", 1)[0].rpartition("总结：")[2].strip() or None
+        record = manifest.record(idx, total, part_file, file_path, part, 0.0, model)
+    return record is not None and record["status"] == "done"
+
+
+def _part_body_text(content: str) -> Optional[str]:
+    # 去掉临时文件的标题行，失败的部分返回 None
+    _, sep, body = content.partition(f"{'=' * 40}\n")
+    body = (body if sep else content).strip()
+    if not body or body.startswith("[总结失败]"):
+        return None
+    return body
+
+
+def _part_body(part_file: Path) -> Optional[str]:
+    if not part_file.exists():
+        return None
+    return _part_body_text(part_file.read_text(encoding="utf-8", errors="ignore"))
+
+
+class SummaryHierarchy:
+    """分卷 / 全书两级汇总的依赖跟踪。
+
+    某一卷包含的文件总结全部完成后立即汇总该卷，所有卷完成后再汇总全书，
+    不需要等待全部文件结束。结果写在 tmp/hierarchy/ 下，并经过摘要缓存。
+    """
+
+    def __init__(self, files: List[Path], tmp_dir: Path, pending_indices: set, arc_size: int = ARC_SIZE):
+        self.files = files
+        self.total = len(files)
+        self.tmp_dir = tmp_dir
+        self.part_dir = tmp_dir / "hierarchy"
+        arc_size = max(1, arc_size)
+        self.arcs = [
+            list(range(start, min(start + arc_size, self.total + 1)))
+            for start in range(1, self.total + 1, arc_size)
+        ]
+        self._arc_of = {idx: arc_idx for arc_idx, members in enumerate(self.arcs, start=1) for idx in members}
+        self._waiting_files = [sum(1 for idx in members if idx in pending_indices) for members in self.arcs]
+        self._waiting_arcs = len(self.arcs)
+        self._lock = threading.Lock()
+
+    def initial_ready_arcs(self) -> List[int]:
+        return [arc_idx for arc_idx, waiting in enumerate(self._waiting_files, start=1) if waiting == 0]
+
+    def file_done(self, idx: int) -> Optional[int]:
+        # 返回因此凑齐输入的卷号
+        with self._lock:
+            arc_idx = self._arc_of[idx]
+            self._waiting_files[arc_idx - 1] -= 1
+            return arc_idx if self._waiting_files[arc_idx - 1] == 0 else None
+
+    def arc_done(self) -> bool:
+        # 返回是否所有卷都已完成，可以汇总全书
+        with self._lock:
+            self._waiting_arcs -= 1
+            return self._waiting_arcs == 0
+
+    def arc_title(self, arc_idx: int) -> str:
+        members = self.arcs[arc_idx - 1]
+        return f"第{arc_idx}卷：{self.files[members[0] - 1].name} ~ {self.files[members[-1] - 1].name}"
+
+    def arc_part_path(self, arc_idx: int) -> Path:
+        return tmp_part_path(self.part_dir, arc_idx, len(self.arcs))
+
+    def book_part_path(self) -> Path:
+        return self.part_dir / "book.txt"
+
+    def arc_sections(self, arc_idx: int) -> List[Tuple[str, str]]:
+        sections = []
+        for idx in self.arcs[arc_idx - 1]:
+            body = _part_body(tmp_part_path(self.tmp_dir, idx, self.total))
+            if body is not None:
+                sections.append((self.files[idx - 1].name, body))
+        return sections
+
+    def book_sections(self) -> List[Tuple[str, str]]:
+        sections = []
+        for arc_idx in range(1, len(self.arcs) + 1):
+            body = _part_body(self.arc_part_path(arc_idx))
+            if body is not None:
+                sections.append((self.arc_title(arc_idx), body))
+        return sections
+
+    def _write(self, part_file: Path, title: str, summary: str) -> None:
+        _atomic_write_text(part_file, f"{title}梗概：{_active_provider().model}\n{'=' * 40}\n{summary}")
+
+    def _log(self, worker_name: str, title: str, action: str) -> None:
+        print(f"{time.strftime('%H:%M:%S')} [{MODEL}] [{worker_name}] {action} {title}梗概", flush=True)
+
+    def summarize_arc(self, arc_idx: int, worker_name: str) -> None:
+        title = self.arc_title(arc_idx)
+        self._log(worker_name, title, "开始")
+        sections = self.arc_sections(arc_idx)
+        try:
+            if not sections:
+                raise ValueError("该卷没有可用的分段总结")
+            summary = summarize_reduce(build_reduce_messages(sections, ARC_WORDS, "分卷梗概"), title, ARC_WORDS)
+        except Exception as exc:
+            summary = f"[总结失败] {exc}"
+        self._write(self.arc_part_path(arc_idx), title, summary)
+        self._log(worker_name, title, "完成")
+
+    async def summarize_arc_async(self, client: AsyncApiClient, arc_idx: int) -> None:
+        title = self.arc_title(arc_idx)
+        self._log("协程", title, "开始")
+        sections = await _in_thread(self.arc_sections, arc_idx)
+        try:
+            if not sections:
+                raise ValueError("该卷没有可用的分段总结")
+            summary = await summarize_reduce_async(
+                client, build_reduce_messages(sections, ARC_WORDS, "分卷梗概"), title, ARC_WORDS
+            )
+        except Exception as exc:
+            summary = f"[总结失败] {exc}"
+        await _in_thread(self._write, self.arc_part_path(arc_idx), title, summary)
+        self._log("协程", title, "完成")
+
+    def summarize_book(self, worker_name: str) -> None:
+        self._log(worker_name, "全书", "开始")
+        sections = self.book_sections()
+        try:
+            if not sections:
+                raise ValueError("没有可用的分卷梗概")
+            summary = summarize_reduce(build_reduce_messages(sections, BOOK_WORDS, "全书梗概"), "全书", BOOK_WORDS)
+        except Exception as exc:
+            summary = f"[总结失败] {exc}"
+        self._write(self.book_part_path(), "全书", summary)
+        self._log(worker_name, "全书", "完成")
+
+    async def summarize_book_async(self, client: AsyncApiClient) -> None:
+        self._log("协程", "全书", "开始")
+        sections = await _in_thread(self.book_sections)
+        try:
+            if not sections:
+                raise ValueError("没有可用的分卷梗概")
+            summary = await summarize_reduce_async(
+                client, build_reduce_messages(sections, BOOK_WORDS, "全书梗概"), "全书", BOOK_WORDS
+            )
+        except Exception as exc:
+            summary = f"[总结失败] {exc}"
+        await _in_thread(self._write, self.book_part_path(), "全书", summary)
+        self._log("协程", "全书", "完成")
+
+    def merge(self, output_file: Path) -> Tuple[Path, Path]:
+        arcs_file = output_file.with_name(f"{output_file.stem}_分卷{output_file.suffix}")
+        book_file = output_file.with_name(f"{output_file.stem}_全书{output_file.suffix}")
+        with arcs_file.open("w", encoding="utf-8") as out:
+            for arc_idx in range(1, len(self.arcs) + 1):
+                part_file = self.arc_part_path(arc_idx)
+                if part_file.exists():
+                    part_content = part_file.read_text(encoding="utf-8", errors="ignore")
+                else:
+                    part_content = (
+                        f"{self.arc_title(arc_idx)}梗概：{MODEL}\n{'=' * 40}\n"
+                        f"[总结失败] 缺少临时文件 {part_file.name}"
+                    )
+                if arc_idx > 1:
+                    out.write("\n\n")
+                out.write(part_content)
+        book_part = self.book_part_path()
+        if book_part.exists():
+            book_file.write_text(book_part.read_text(encoding="utf-8", errors="ignore"), encoding="utf-8")
+        else:
+            book_file.write_text(f"全书梗概：{MODEL}\n{'=' * 40}\n[总结失败] 缺少临时文件 {book_part.name}", encoding="utf-8")
+        return arcs_file, book_file
+
+
+def _order_pending(
+    pending_indexed_files: List[Tuple[int, Path]], order: str
+) -> List[Tuple[int, Path]]:
+    if order == "size":
+        return sorted(pending_indexed_files, key=lambda item: (-item[1].stat().st_size, item[0]))
+    return list(pending_indexed_files)
+
+
+def _load_retry_list(tmp_dir: Path, files: List[Path]) -> Optional[dict]:
+    # 读取 检查是否完整.py 写出的重跑清单；文件数或文件名对不上时说明 TXT 已重新分割，清单作废
+    retry_file = tmp_dir / RETRY_LIST_NAME
+    if not USE_RETRY_LIST or not retry_file.exists():
+        return None
+    try:
+        retry = json.loads(retry_file.read_text(encoding="utf-8"))
+    except ValueError:
+        print(f"[{MODEL}] 重跑清单无法解析，已忽略：{retry_file}", flush=True)
+        return None
+    items = retry.get("items") or []
+    if retry.get("total") != len(files) or any(
+        not 1 <= item["idx"] <= len(files) or files[item["idx"] - 1].name != item["source"] for item in items
+    ):
+        print(f"[{MODEL}] 重跑清单与当前 TXT 文件不一致，已忽略：{retry_file}", flush=True)
+        return None
+    return retry
+
+
+def _apply_retry_list(
+    retry: dict, manifest: PartManifest, tmp_dir: Path, total: int
+) -> Tuple[List[int], int]:
+    """
+    把重跑清单中仍有效的已完成部分标记为 stale，使其重新总结；清单生成之后已经重做过的部分不再重复。
+
+    Returns:
+        (清单中的序号, 本次新标记的数量)
+    """
+    indices = []
+    marked = 0
+    for item in retry.get("items") or []:
+        idx = item["idx"]
+        indices.append(idx)
+        part_file = tmp_part_path(tmp_dir, idx, total)
+        record = manifest.valid_record(idx, part_file)
+        if record is not None and record.get("status") == "done" and record.get("time", "") <= retry["created"]:
+            manifest.mark_stale(idx, total, part_file, item["status"])
+            marked += 1
+        elif record is None and idx not in manifest.records and part_file.exists():
+            manifest.mark_stale(idx, total, part_file, item["status"])
+            marked += 1
+    return indices, marked
+
+
+def _finish_retry_list(tmp_dir: Path, manifest: PartManifest, indices: List[int], total: int) -> None:
+    failed = [
+        idx for idx in indices
+        if (manifest.valid_record(idx, tmp_part_path(tmp_dir, idx, total)) or {}).get("status") != "done"
+    ]
+    if failed:
+        print(f"[{MODEL}] 重跑清单中仍有 {len(failed)} 个未完成，保留清单以便下次继续", flush=True)
+        return
+    (tmp_dir / RETRY_LIST_NAME).unlink(missing_ok=True)
+    print(f"[{MODEL}] 重跑清单中的 {len(indices)} 个部分已全部完成，清单已删除", flush=True)
+
+
+def _run_threads(
+    pending_indexed_files: List[Tuple[int, Path]],
+    tmp_dir: Path,
+    total: int,
+    tmp_exists_mode: int,
+    manifest: PartManifest,
+    hierarchy: Optional[SummaryHierarchy] = None,
+) -> None:
+    # 所有线程从同一个队列领取任务：谁空闲谁就取下一个文件，慢文件不会拖住其他文件。
+    # 分层汇总时，凑齐输入的分卷/全书任务以更高优先级插入同一队列。
+    thread_count = total_concurrency(THREAD_COUNT)
+    jobs: "queue.PriorityQueue[tuple]" = queue.PriorityQueue()
+    sequence = itertools.count()
+
+    def submit(priority: int, job: Optional[tuple]) -> None:
+        jobs.put((priority, next(sequence), job))
+
+    for idx, file_path in pending_indexed_files:
+        submit(1, ("file", idx, file_path))
+    if hierarchy is not None:
+        for arc_idx in hierarchy.initial_ready_arcs():
+            submit(0, ("arc", arc_idx))
+    print(
+        f"[{MODEL}] 共享队列 {jobs.qsize()} 个任务，{thread_count} 个线程按空闲领取",
+        flush=True,
+    )
+
+    worker_stats = [
+        {"done": 0, "skipped": 0, "busy": 0.0} for _ in range(thread_count)
+    ]
+
+    def run_file(thread_id: int, stats: dict, idx: int, file_path: Path) -> None:
+        part_file = tmp_part_path(tmp_dir, idx, total)
+        started = time.monotonic()
+        try:
+            if should_skip_part(manifest, idx, total, part_file, file_path, tmp_exists_mode):
+                print(
+                    f"{time.strftime('%H:%M:%S')} [{MODEL}] [线程{thread_id}] [{idx}/{total}] "
+                    f"跳过 {file_path.name}（临时文件已存在）",
+                    flush=True,
+                )
+                _metrics.inc("files_total", status="skipped")
+                stats["skipped"] += 1
+                return
+
+            summary, model = summarize_one_file_with_retry(file_path, idx, total, thread_id, part_file)
+            save_part(manifest, idx, total, part_file, file_path, summary, time.monotonic() - started, model)
+        except Exception as exc:
+            # 单个文件出错只记为失败，线程继续领取后续任务
+            save_failed_part(
+                manifest, idx, total, part_file, file_path, f"线程{thread_id}", exc, time.monotonic() - started
+            )
+        stats["done"] += 1
+
+    def run_job(thread_id: int, stats: dict, job: tuple) -> None:
+        started = time.monotonic()
+        kind = job[0]
+        if kind == "file":
+            _, idx, file_path = job
+            try:
+                run_file(thread_id, stats, idx, file_path)
+            finally:
+                arc_idx = hierarchy.file_done(idx) if hierarchy is not None else None
+                if arc_idx is not None:
+                    submit(0, ("arc", arc_idx))
+        elif kind == "arc":
+            try:
+                hierarchy.summarize_arc(job[1], f"线程{thread_id}")
+                stats["done"] += 1
+            finally:
+                if hierarchy.arc_done():
+                    submit(0, ("book",))
+        else:
+            hierarchy.summarize_book(f"线程{thread_id}")
+            stats["done"] += 1
+        stats["busy"] += time.monotonic() - started
+
+    def worker(thread_id: int) -> None:
+        stats = worker_stats[thread_id - 1]
+        while True:
+            _, _, job = jobs.get()
+            _metrics.gauge_set("queue_depth", jobs.qsize())
+            try:
+                if job is None:
+                    return
+                _metrics.gauge_add("active_workers", 1)
+                try:
+                    run_job(thread_id, stats, job)
+                except Exception as exc:
+                    # 分卷/全书汇总等任务出错时同样只记录日志，线程不能退出，否则 jobs.join() 会一直等待
+                    print(
+                        f"{time.strftime('%H:%M:%S')} [{MODEL}] [线程{thread_id}] 任务 {job[:2]} 出错：{exc!r}",
+                        flush=True,
+                    )
+                finally:
+                    _metrics.gauge_add("active_workers", -1)
+            finally:
+                jobs.task_done()
+
+    run_started = time.monotonic()
+    threads: List[threading.Thread] = []
+    for thread_id in range(1, thread_count + 1):
+        t = threading.Thread(
+            target=worker,
+            args=(thread_id,),
+            name=f"summary-worker-{thread_id}",
+            daemon=False,
+        )
+        t.start()
+        threads.append(t)
+
+    # 后续任务总是在前置任务 task_done 之前入队，join 返回时不会再有新任务
+    jobs.join()
+    for _ in threads:
+        submit(9, None)
+    for t in threads:
+        t.join()
+
+    _log_worker_utilization(worker_stats, time.monotonic() - run_started)
+
+
+def _log_worker_utilization(worker_stats: List[dict], elapsed: float) -> None:
+    print(f"[{MODEL}] 线程运行总耗时 {elapsed:.1f}s，各线程利用率：", flush=True)
+    elapsed = max(elapsed, 1e-9)
+    for thread_id, stats in enumerate(worker_stats, start=1):
+        print(
+            f"[{MODEL}]   线程{thread_id}：完成 {stats['done']} 个，跳过 {stats['skipped']} 个，"
+            f"忙碌 {stats['busy']:.1f}s，利用率 {stats['busy'] / elapsed:.0%}",
+            flush=True,
+        )
+
+
+async def _run_async(
+    pending_indexed_files: List[Tuple[int, Path]],
+    tmp_dir: Path,
+    total: int,
+    tmp_exists_mode: int,
+    manifest: PartManifest,
+    hierarchy: Optional[SummaryHierarchy] = None,
+) -> None:
+    # 单线程事件循环驱动所有请求，信号量限制同时在途的文件数
+    concurrency = total_concurrency(ASYNC_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+    client = AsyncApiClient(concurrency)
+    # _in_thread 使用的默认线程池：默认大小只与 CPU 数有关，落盘排队会拖慢整体吞吐；asyncio.run 结束时自动关闭
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=min(concurrency, 32), thread_name_prefix="summary-io")
+    )
+    print(f"[{MODEL}] 异步 HTTP 客户端：{client.describe()}", flush=True)
+
+    async def run_one(idx: int, file_path: Path) -> None:
+        part_file = tmp_part_path(tmp_dir, idx, total)
+        started = time.monotonic()
+        try:
+            await summarize_one(idx, file_path, part_file)
+        except Exception as exc:
+            # 单个文件出错只记为失败，其他文件继续
+            await _in_thread(
+                save_failed_part, manifest, idx, total, part_file, file_path, "协程", exc,
+                time.monotonic() - started,
+            )
+
+    async def summarize_one(idx: int, file_path: Path, part_file: Path) -> None:
+        _metrics.gauge_add("queue_depth", 1)
+        async with semaphore:
+            _metrics.gauge_add("queue_depth", -1)
+            # 跳过检查也在信号量内：同一时刻交给线程池的磁盘操作不超过并发数
+            if await _in_thread(should_skip_part, manifest, idx, total, part_file, file_path, tmp_exists_mode):
+                print(
+                    f"{time.strftime('%H:%M:%S')} [{MODEL}] [协程] [{idx}/{total}] "
+                    f"跳过 {file_path.name}（临时文件已存在）",
+                    flush=True,
+                )
+                _metrics.inc("files_total", status="skipped")
+                return
+            _metrics.gauge_add("active_workers", 1)
+            try:
+                started = time.monotonic()
+                summary, model = await summarize_one_file_with_retry_async(
+                    client, file_path, idx, total, part_file
+                )
+            finally:
+                _metrics.gauge_add("active_workers", -1)
+        await _in_thread(
+            save_part, manifest, idx, total, part_file, file_path, summary, time.monotonic() - started, model
+        )
+
+    file_tasks = {
+        idx: asyncio.ensure_future(run_one(idx, file_path)) for idx, file_path in pending_indexed_files
+    }
+    tasks = list(file_tasks.values())
+    labels = [("file", idx) for idx in file_tasks]
+    if hierarchy is not None:
+        # 每卷只等待自己的文件；分卷/全书任务不排文件信号量，避免排在所有文件之后
+        async def run_arc(arc_idx: int) -> None:
+            members = [file_tasks[idx] for idx in hierarchy.arcs[arc_idx - 1] if idx in file_tasks]
+            await asyncio.gather(*members, return_exceptions=True)
+            await hierarchy.summarize_arc_async(client, arc_idx)
+
+        arc_tasks = [asyncio.ensure_future(run_arc(arc_idx)) for arc_idx in range(1, len(hierarchy.arcs) + 1)]
+
+        async def run_book() -> None:
+            await asyncio.gather(*arc_tasks, return_exceptions=True)
+            await hierarchy.summarize_book_async(client)
+
+        tasks += arc_tasks + [asyncio.ensure_future(run_book())]
+        labels += [("arc", arc_idx) for arc_idx in range(1, len(hierarchy.arcs) + 1)] + [("book",)]
+
+    try:
+        # 某个任务出错时不能中断其他任务，等全部结束后逐个记录
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await client.aclose()
+    for label, result in zip(labels, results):
+        if isinstance(result, Exception):
+            print(f"{time.strftime('%H:%M:%S')} [{MODEL}] [协程] 任务 {label} 出错：{result!r}", flush=True)
+
+
+def _merge_parts(
+    indexed_files: List[Tuple[int, Path]],
+    tmp_dir: Path,
+    total: int,
+    output_file: Path,
+    manifest: PartManifest,
+) -> None:
+    # 增量合并：merge_state.json 记录上次写入输出文件的各部分哈希与结束偏移，
+    # 只从第一个变化的部分开始截断重写，前面未变化的部分不再读取
+    state_file = tmp_dir / MERGE_STATE_NAME
+    previous: List[list] = []
+    if state_file.exists() and output_file.exists():
+        try:
+            state = json.loads(state_file.read_text(encoding="utf-8"))
+        except ValueError:
+            state = {}
+        parts = state.get("parts") or []
+        end_offset = parts[-1][2] if parts else 0
+        if state.get("output") == str(output_file.resolve()) and output_file.stat().st_size == end_offset:
+            previous = parts
+
+    digests = []
+    for idx, file_path in indexed_files:
+        part_file = tmp_part_path(tmp_dir, idx, total)
+        record = manifest.valid_record(idx, part_file)
+        digests.append(record["sha256"] if record is not None else None)
+
+    keep = 0
+    while (
+        keep < len(previous)
+        and keep < len(digests)
+        and previous[keep][0] == indexed_files[keep][0]
+        and digests[keep] is not None
+        and previous[keep][1] == digests[keep]
+    ):
+        keep += 1
+
+    new_parts = previous[:keep]
+    offset = new_parts[-1][2] if new_parts else 0
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with output_file.open("r+b" if keep else "wb") as out:
+        out.seek(offset)
+        out.truncate()
+        for position in range(keep, len(indexed_files)):
+            idx, file_path = indexed_files[position]
+            part_file = tmp_part_path(tmp_dir, idx, total)
+            if part_file.exists():
+                part_content = part_file.read_text(encoding="utf-8", errors="ignore")
+            else:
+                part_content = (
+                    f"第{file_path.name}章总结：{MODEL}\n{'=' * 40}\n"
+                    f"[总结失败] 缺少临时文件 {part_file.name}"
+                )
+            data = (("\n\n" if idx > 1 else "") + part_content).encode("utf-8")
+            out.write(data)
+            offset += len(data)
+            new_parts.append([idx, digests[position] or _sha256_text(part_content), offset])
+
+    _atomic_write_text(
+        state_file,
+        json.dumps({"output": str(output_file.resolve()), "parts": new_parts}, ensure_ascii=False),
+    )
+    if keep:
+        print(
+            f"[{MODEL}] 增量合并：前 {keep} 个部分未变化，从第 {keep + 1} 个开始重写",
+            flush=True,
+        )
+
+
+def begin_run(max_concurrency: int) -> None:
+    # 一次运行开始：创建各服务商及其自适应并发限制器，并启动指标导出
+    global _providers, _metrics_exporter
+    _metrics_exporter = MetricsExporter(
+        _metrics, BASE_DIR / "tmp" / METRICS_SNAPSHOT_NAME, METRICS_PORT, METRICS_SNAPSHOT_SECONDS
+    )
+    _metrics_exporter.start()
+    with _providers_lock:
+        _providers = _build_providers(max_concurrency)
+    for provider in _providers:
+        if len(_providers) > 1:
+            print(
+                f"[{MODEL}] 服务商 {provider.name}：{provider.model} @ {provider.url}，"
+                f"{len(provider.key_pool)} 个 key，并发 {provider.concurrency}，权重 {provider.weight:g}",
+                flush=True,
+            )
+        if ADAPTIVE_CONCURRENCY:
+            provider.limiter = AdaptiveConcurrencyLimiter(provider.concurrency)
+            print(
+                f"[{MODEL}] 自适应并发{_provider_label(provider)}：上限 "
+                f"{provider.limiter.min_limit}~{provider.limiter.max_limit}，"
+                f"429 时 ×{ADAPTIVE_DECREASE_FACTOR}",
+                flush=True,
+            )
+
+
+def _provider_label(provider: Provider) -> str:
+    return f"（{provider.name}）" if len(_providers) > 1 else ""
+
+
+def end_run() -> None:
+    # 一次运行结束：输出各服务商的并发、APIKey 统计，以及缓存、流式、质量校验统计和指标汇总
+    global _providers, _metrics_exporter
+    for provider in _providers:
+        if provider.limiter is not None:
+            print(
+                f"[{MODEL}] 结束时并发上限{_provider_label(provider)} "
+                f"{int(provider.limiter.limit)}/{provider.limiter.max_limit}",
+                flush=True,
+            )
+        if len(_providers) > 1:
+            print(f"[{MODEL}] 服务商 {provider.name}：完成 {provider.done_files} 个文件", flush=True)
+        provider.key_pool.log_stats()
+    with _providers_lock:
+        _providers = []
+    cache = _get_summary_cache()
+    if cache is not None:
+        print(f"[{MODEL}] {cache.stats_text()}", flush=True)
+    if STREAM_MODE:
+        print(f"[{MODEL}] {_stream_stats_text()}", flush=True)
+    for line in _validation_stats_text():
+        print(f"[{MODEL}] {line}", flush=True)
+    print(f"[{MODEL}] {_metrics.summary_text()}", flush=True)
+    if _metrics_exporter is not None:
+        _metrics_exporter.stop()
+        print(f"[{MODEL}] 指标快照：{_metrics_exporter.snapshot_file.resolve()}", flush=True)
+    _metrics_exporter = None
+
+
 def summarize_files(
     files: List[Path],
     output_file: Path,
     start_index: int = 1,
     clean_tmp: bool = False,
     tmp_exists_mode: int = TMP_EXISTS_MODE,
+    engine: str = ENGINE,
+    queue_order: str = QUEUE_ORDER,
+    hierarchy_mode: bool = HIERARCHY_MODE,
 ) -> None:
-    available_keys = _available_api_keys()
-    if not available_keys:
-        raise ValueError("API_KEYS 为空，请在脚本中填写有效 key")
-
-    thread_count = THREAD_COUNT
     total = len(files)
     if start_index < 1 or start_index > total:
         raise ValueError(f"start_index 超出范围：{start_index}，应在 1~{total}")
     if tmp_exists_mode not in (0, 1):
         raise ValueError(f"tmp_exists_mode 仅支持 0 或 1，当前值：{tmp_exists_mode}")
+    if engine not in ("threads", "asyncio"):
+        raise ValueError(f"engine 仅支持 threads 或 asyncio，当前值：{engine}")
+    if queue_order not in ("index", "size"):
+        raise ValueError(f"queue_order 仅支持 index 或 size，当前值：{queue_order}")
 
-    print(f"[{MODEL}] 开始处理，共 {total} 个 TXT 文件，使用 {thread_count} 线程...", flush=True)
+    if engine == "asyncio":
+        print(
+            f"[{MODEL}] 开始处理，共 {total} 个 TXT 文件，使用 asyncio 引擎"
+            f"（并发 {total_concurrency(ASYNC_CONCURRENCY)}）...",
+            flush=True,
+        )
+    else:
+        print(
+            f"[{MODEL}] 开始处理，共 {total} 个 TXT 文件，使用 {total_concurrency(THREAD_COUNT)} 线程...",
+            flush=True,
+        )
     print(
         f"[{MODEL}] 从第 {start_index} 个文件开始：{files[start_index - 1].name}",
         flush=True,
@@ -424,8 +3083,12 @@ def summarize_files(
     tmp_dir = BASE_DIR / "tmp"
     tmp_dir.mkdir(parents=True, exist_ok=True)
     if clean_tmp:
-        for old_file in tmp_dir.glob("*.txt"):
+        for old_file in [*tmp_dir.glob("*.txt"), *tmp_dir.glob("*.txt.partial"), *tmp_dir.glob("hierarchy/*.txt")]:
             old_file.unlink()
+        PartManifest(tmp_dir).remove()
+        (tmp_dir / TRACE_NAME).unlink(missing_ok=True)
+        (tmp_dir / MERGE_STATE_NAME).unlink(missing_ok=True)
+        (tmp_dir / RETRY_LIST_NAME).unlink(missing_ok=True)
         print(f"[{MODEL}] 已清空临时目录：{tmp_dir.resolve()}", flush=True)
     else:
         mode_text = "跳过（不调用 API）" if tmp_exists_mode == 0 else "覆盖（重新调用 API）"
@@ -433,67 +3096,230 @@ def summarize_files(
 
     print(f"[{MODEL}] 输出文件: {output_file.resolve()}", flush=True)
     print(f"[{MODEL}] 临时目录: {tmp_dir.resolve()}", flush=True)
+    rate_text = f"每 key {KEY_RATE_PER_MINUTE} 次/分钟" if KEY_RATE_PER_MINUTE > 0 else "不限速"
+    if PROVIDERS:
+        print(
+            f"[{MODEL}] 多服务商：{len(PROVIDERS)} 个，按权重和空闲程度分配文件；APIKey {rate_text}，按在途请求最少选择",
+            flush=True,
+        )
+    else:
+        key_pool = _get_key_pool()
+        print(f"[{MODEL}] APIKey 池：{len(key_pool)} 个 key，{rate_text}，按在途请求最少选择", flush=True)
 
     indexed_files = list(enumerate(files, start=1))
-    pending_indexed_files = indexed_files[start_index - 1 :]
-    thread_buckets = [pending_indexed_files[i::thread_count] for i in range(thread_count)]
-    for thread_id, bucket in enumerate(thread_buckets, start=1):
+    manifest = PartManifest(tmp_dir)
+    retry = None if clean_tmp or tmp_exists_mode != 0 else _load_retry_list(tmp_dir, files)
+    if retry is not None:
+        retry_indices, marked = _apply_retry_list(retry, manifest, tmp_dir, total)
+        selected = set(retry_indices)
+        pending_indexed_files = _order_pending(
+            [(idx, file_path) for idx, file_path in indexed_files if idx in selected], queue_order
+        )
         print(
-            f"[{MODEL}] 线程{thread_id} 分配 {len(bucket)} 个文件（每次请求随机选择 key）",
+            f"[{MODEL}] 按重跑清单 {RETRY_LIST_NAME}（{retry['created']} 生成）只处理 {len(retry_indices)} 个部分，"
+            f"其中 {marked} 个已完成的部分将重新总结；忽略 START_INDEX",
             flush=True,
         )
+    else:
+        pending_indexed_files = _order_pending(indexed_files[start_index - 1 :], queue_order)
+    if queue_order == "size":
+        print(f"[{MODEL}] 按文件大小降序领取任务（大文件优先）", flush=True)
+    hierarchy = None
+    if hierarchy_mode:
+        hierarchy = SummaryHierarchy(
+            files, tmp_dir, {idx for idx, _ in pending_indexed_files}, arc_size=ARC_SIZE
+        )
+        print(
+            f"[{MODEL}] 分层汇总：每 {ARC_SIZE} 个文件一卷，共 {len(hierarchy.arcs)} 卷，"
+            f"卷梗概约 {ARC_WORDS} 字，全书梗概约 {BOOK_WORDS} 字",
+            flush=True,
+        )
+    begin_run(ASYNC_CONCURRENCY if engine == "asyncio" else THREAD_COUNT)
+    try:
+        if engine == "asyncio":
+            asyncio.run(
+                _run_async(pending_indexed_files, tmp_dir, total, tmp_exists_mode, manifest, hierarchy)
+            )
+        else:
+            _run_threads(pending_indexed_files, tmp_dir, total, tmp_exists_mode, manifest, hierarchy)
+    finally:
+        end_run()
 
-    def worker(thread_id: int, assigned_files: List[Tuple[int, Path]]) -> None:
-        if not assigned_files:
-            print(f"[{MODEL}] 线程{thread_id} 无任务", flush=True)
-            return
+    print(f"[{MODEL}] 所有任务完成，{_decode_stats_text()}", flush=True)
+    if retry is not None:
+        _finish_retry_list(tmp_dir, manifest, retry_indices, total)
+    print(f"[{MODEL}] 开始合并临时文件...", flush=True)
+    _merge_parts(indexed_files, tmp_dir, total, output_file, manifest)
 
-        for idx, file_path in assigned_files:
-            part_file = _tmp_part_path(tmp_dir, idx, total)
-            if part_file.exists() and tmp_exists_mode == 0:
-                print(
-                    f"{time.strftime('%H:%M:%S')} [{MODEL}] [线程{thread_id}] [{idx}/{total}] "
-                    f"跳过 {file_path.name}（临时文件已存在）",
-                    flush=True,
-                )
-                continue
+    print(f"[{MODEL}] 完成，已输出到：{output_file}", flush=True)
+    if hierarchy is not None:
+        arcs_file, book_file = hierarchy.merge(output_file)
+        print(f"[{MODEL}] 分卷梗概：{arcs_file}", flush=True)
+        print(f"[{MODEL}] 全书梗概：{book_file}", flush=True)
 
-            summary = summarize_one_file_with_retry(file_path, idx, total, thread_id)
-            part = f"第{file_path.name}章总结：{MODEL}\n{'=' * 40}\n{summary}"
-            part_file.parent.mkdir(parents=True, exist_ok=True)
-            part_file.write_text(part, encoding="utf-8")
 
-    threads: List[threading.Thread] = []
-    for thread_id, assigned_files in enumerate(thread_buckets, start=1):
-        t = threading.Thread(
-            target=worker,
-            args=(thread_id, assigned_files),
-            name=f"summary-worker-{thread_id}",
-            daemon=False,
-        )
-        t.start()
-        threads.append(t)
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]")
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
 
-    for t in threads:
-        t.join()
 
-    print(f"[{MODEL}] 所有线程完成，开始合并临时文件...", flush=True)
-    output_file.parent.mkdir(parents=True, exist_ok=True)
-    with output_file.open("w", encoding="utf-8") as out:
-        for idx, file_path in indexed_files:
-            part_file = _tmp_part_path(tmp_dir, idx, total)
-            if part_file.exists():
-                part_content = part_file.read_text(encoding="utf-8", errors="ignore")
-            else:
-                part_content = (
-                    f"第{file_path.name}章总结：{MODEL}\n{'=' * 40}\n"
-                    f"[总结失败] 缺少临时文件 {part_file.name}"
-                )
-            if idx > 1:
-                out.write("\n\n")
-            out.write(part_content)
+def _get_tokenizer():
+    # 配置了 TOKENIZER_NAME 且安装了 tiktoken 时返回编码器，否则返回 None
+    global _tokenizer
+    if not TOKENIZER_NAME or importlib.util.find_spec("tiktoken") is None:
+        return None
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            import tiktoken  # type: ignore
 
-    print(f"[{MODEL}] 完成，已输出到：{output_file}", flush=True)
+            _tokenizer = tiktoken.get_encoding(TOKENIZER_NAME)
+        return _tokenizer
+
+
+def estimate_tokens(text: str) -> int:
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    # 与 分割.py 按 token 预算分组使用同一估算，同一段文本在两边得到相同的 token 数
+    return _estimate_text_tokens(text)
+
+
+def _messages_tokens(messages: list) -> int:
+    # 每条消息另加少量格式开销
+    return sum(estimate_tokens(message["content"]) + 4 for message in messages)
+
+
+def _observed_request_seconds() -> Optional[float]:
+    # 上次运行的指标快照中成功请求的平均耗时
+    snapshot_file = BASE_DIR / "tmp" / METRICS_SNAPSHOT_NAME
+    try:
+        snapshot = json.loads(snapshot_file.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    for hist in snapshot.get("histograms", []):
+        if hist.get("name") == "request_seconds" and hist.get("labels", {}).get("outcome") == "ok":
+            if hist.get("count"):
+                return hist["sum"] / hist["count"]
+    return None
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def plan_files(files: List[Path], engine: str = ENGINE, hierarchy_mode: bool = HIERARCHY_MODE) -> dict:
+    """
+    运行前规划：不调用 API，估算提示词 token、费用和预计耗时，列出将自动分段和超出上下文窗口的文件。
+
+    Returns:
+        规划结果，包含 files、input_tokens、output_tokens、requests、cost、seconds、chunked、oversized
+    """
+    output_tokens_per_file = estimate_tokens("字" * Words)
+    chunk_limit = _chunk_limit() if AUTO_CHUNK else 0
+    rows = []
+    chunked = []
+    input_tokens = output_tokens = request_count = 0
+    for file_path in files:
+        text = file_path.read_text(encoding=detect_encoding(str(file_path), ENCODING_SNIFF_BYTES), errors="replace")
+        if not AUTO_CHUNK and MAX_INPUT_CHARS > 0:
+            text = text[:MAX_INPUT_CHARS]
+        pieces = split_text_chunks(text, chunk_limit)
+        tokens = sum(_messages_tokens(build_messages(piece)) for piece in pieces)
+        rows.append((file_path, len(text), tokens))
+        input_tokens += tokens
+        output_tokens += output_tokens_per_file * len(pieces)
+        request_count += len(pieces)
+        if len(pieces) > 1:
+            # 各段总结再合并一次
+            chunked.append((file_path, len(pieces)))
+            input_tokens += output_tokens_per_file * len(pieces)
+            output_tokens += output_tokens_per_file
+            request_count += 1
+
+    if hierarchy_mode and rows:
+        # 每卷输入为本卷各文件的总结，全书输入为各卷梗概
+        arc_count = -(-len(rows) // ARC_SIZE)
+        input_tokens += output_tokens + arc_count * estimate_tokens("字" * ARC_WORDS)
+        output_tokens += arc_count * estimate_tokens("字" * ARC_WORDS) + estimate_tokens("字" * BOOK_WORDS)
+        request_count += arc_count + 1
+
+    chunked_paths = {file_path for file_path, _ in chunked}
+    oversized = [
+        (file_path, tokens)
+        for file_path, _, tokens in rows
+        if file_path not in chunked_paths and tokens + output_tokens_per_file > CONTEXT_WINDOW_TOKENS
+    ]
+    cost = (input_tokens * PRICE_INPUT_PER_MTOKEN + output_tokens * PRICE_OUTPUT_PER_MTOKEN) / 1_000_000
+
+    observed = _observed_request_seconds()
+    request_seconds = observed if observed is not None else PLAN_REQUEST_SECONDS
+    providers = _build_providers(ASYNC_CONCURRENCY if engine == "asyncio" else THREAD_COUNT)
+    concurrency = sum(provider.concurrency for provider in providers)
+    seconds = -(-request_count // max(1, concurrency)) * request_seconds
+    rate_text = ""
+    if KEY_RATE_PER_MINUTE > 0:
+        # APIKey 限速下，每个服务商每秒最多完成 min(并发 / 单次耗时, key 数 × 每分钟次数 / 60) 个请求，
+        # 总请求数 / 各服务商之和 是耗时下限
+        throughput = sum(
+            min(provider.concurrency / max(request_seconds, 1e-6), len(provider.key_pool) * KEY_RATE_PER_MINUTE / 60)
+            for provider in providers
+        )
+        rate_seconds = request_count / max(throughput, 1e-9)
+        if rate_seconds > seconds:
+            seconds = rate_seconds
+            key_count = sum(len(provider.key_pool) for provider in providers)
+            rate_text = f"，受 APIKey 限速约束（{key_count} 个 key × {KEY_RATE_PER_MINUTE} 次/分钟）"
+
+    method = f"tiktoken {TOKENIZER_NAME}" if _get_tokenizer() is not None else "中文感知快速估算"
+    largest = max(rows, key=lambda row: row[2], default=None)
+    print(f"[{MODEL}] 运行前规划（{method}，不调用 API）：", flush=True)
+    if largest is not None:
+        # 平均与最大都按单个文件的提示词计算，分段合并与分层汇总的输入单独列出
+        file_tokens = sum(tokens for _, _, tokens in rows)
+        extra_text = f"，合并与汇总另需 {input_tokens - file_tokens:,}" if input_tokens > file_tokens else ""
+        print(
+            f"[{MODEL}]   {len(rows)} 个文件，输入约 {input_tokens:,} token"
+            f"（每个文件平均 {file_tokens // len(rows):,}，最大 {largest[2]:,}：{largest[0].name}{extra_text}），"
+            f"输出约 {output_tokens:,} token，共 {request_count} 次请求",
+            flush=True,
+        )
+    print(f"[{MODEL}]   预计费用：{cost:.2f} {PRICE_CURRENCY}", flush=True)
+    latency_source = "上次实测" if observed is not None else "配置值"
+    print(
+        f"[{MODEL}]   预计耗时：约 {_format_duration(seconds)}（并发 {concurrency}，"
+        f"单次请求约 {request_seconds:.1f}s，{latency_source}{rate_text}）",
+        flush=True,
+    )
+    if chunked:
+        print(
+            f"[{MODEL}]   超过分段上限（{chunk_limit:,} 字）、将自动分段的文件 {len(chunked)} 个："
+            + "，".join(f"{file_path.name}（{count} 段）" for file_path, count in chunked),
+            flush=True,
+        )
+    if oversized:
+        print(
+            f"[{MODEL}]   超出上下文窗口（{CONTEXT_WINDOW_TOKENS:,} token，含输出预留 "
+            f"{output_tokens_per_file:,}）的文件 {len(oversized)} 个：",
+            flush=True,
+        )
+        for file_path, tokens in oversized:
+            print(f"[{MODEL}]     {file_path.name}：约 {tokens:,} token", flush=True)
+
+    return {
+        "files": len(rows),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "requests": request_count,
+        "cost": cost,
+        "seconds": seconds,
+        "chunked": [file_path for file_path, _ in chunked],
+        "oversized": [file_path for file_path, _ in oversized],
+    }
 
 
 def main() -> None:
@@ -512,6 +3338,10 @@ def main() -> None:
             time.sleep(IDLE_RETRY_SECONDS)
 
     print(f"发现 {len(files)} 个 TXT 文件，开始生成总结...", flush=True)
+    if PLAN_BEFORE_RUN or PLAN_ONLY:
+        plan_files(files[START_INDEX - 1 :], ENGINE, HIERARCHY_MODE)
+        if PLAN_ONLY:
+            return
     output_file = BASE_DIR / f"总结_opencode_{MODEL}.txt"
     summarize_files(
         files,
@@ -519,6 +3349,9 @@ def main() -> None:
         start_index=START_INDEX,
         clean_tmp=CLEAN_TMP_ON_START,
         tmp_exists_mode=TMP_EXISTS_MODE,
+        engine=ENGINE,
+        queue_order=QUEUE_ORDER,
+        hierarchy_mode=HIERARCHY_MODE,
     )
 
 
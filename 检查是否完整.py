@@ -1,4 +1,26 @@
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
+
+import 总结opencode as summarizer
+
+# 并行检查的线程数
+CHECK_WORKERS = 16
+# 清单记录不可用时，每个临时文件只读取开头这么多字节（标题行、分隔线和正文开头，足以识别 [总结失败]）
+HEAD_BYTES = 512
+# 原文是否变化："mtime" = 修改时间不同即算过期；"sha256" = 修改时间不同时再比较内容哈希（只 touch 过不算变化）
+STALE_CHECK = "sha256"
+# 检查结果的分类及显示名称
+PART_STATUS_LABELS = {
+    "missing": "缺失",
+    "failed": "总结失败",
+    "short": "过短或被截断",
+    "stale": "原文已变化",
+}
+_SEPARATOR = ("=" * 40 + "\n").encode("utf-8")
 
 
 def collect_numbered_txt_files(folder: Path) -> tuple[list[int], list[str], int]:
@@ -18,6 +40,175 @@ def collect_numbered_txt_files(folder: Path) -> tuple[list[int], list[str], int]
     return sorted(set(numbers)), sorted(invalid_names), max_width
 
 
+def check_manifest(tmp_dir: Path, records: dict[int, dict]) -> None:
+    """按清单检查：缺少记录或文件与记录不一致的算缺失，状态为 failed 的算失败。"""
+    total = max(int(record.get("total", 0)) for record in records.values())
+    total = max(total, max(records))
+    width = max(1, len(str(total)))
+
+    missing: list[str] = []
+    failed: list[str] = []
+    for idx in range(1, total + 1):
+        record = records.get(idx)
+        part_name = record["part"] if record else f"{idx:0{width}d}.txt"
+        part_file = tmp_dir / part_name
+        if record is None:
+            missing.append(f"{part_name}（清单中无记录）")
+        elif not part_file.exists():
+            missing.append(f"{part_name}（文件不存在）")
+        elif part_file.stat().st_size != record.get("size"):
+            missing.append(f"{part_name}（文件与清单记录不一致）")
+        elif record.get("status") != "done":
+            failed.append(f"{part_name} <- {record.get('source', '')}")
+
+    print(f"检查清单: {tmp_dir / summarizer.MANIFEST_NAME}")
+    print(f"应有文件数: {total}")
+    print(f"成功: {total - len(missing) - len(failed)}")
+
+    if failed:
+        print(f"\n总结失败 ({len(failed)} 个):")
+        for name in failed:
+            print(f"- {name}")
+    if missing:
+        print(f"\n缺失文件 ({len(missing)} 个):")
+        for name in missing:
+            print(f"- {name}")
+    if not failed and not missing:
+        print("\n清单完整，全部成功。")
+
+
+def _sha256_file(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with file_path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _check_body(part_file: Path, body_bytes: int, min_chars: int) -> Optional[tuple[str, str]]:
+    # UTF-8 每个字符最多 4 字节：正文字节数足够大时不可能过短，不必读取；只有较小的文件才完整读取计数
+    if body_bytes >= 4 * min_chars:
+        return None
+    body = summarizer._part_body_text(part_file.read_text(encoding="utf-8", errors="ignore"))
+    if body is None:
+        return "short", "正文为空"
+    length = summarizer._summary_length(body)
+    if length < min_chars:
+        return "short", f"{length} 字 < {min_chars} 字"
+    return None
+
+
+def _check_source(source_file: Path, part_stat, record: Optional[dict]) -> Optional[tuple[str, str]]:
+    source_stat = source_file.stat()
+    if record is None:
+        # 没有清单记录（旧版本生成的 tmp）：原文比临时文件新就算过期
+        if source_stat.st_mtime_ns > part_stat.st_mtime_ns:
+            return "stale", "原文比临时文件新"
+        return None
+    if record.get("source") != source_file.name:
+        return "stale", f"对应的原文由 {record.get('source')} 变为 {source_file.name}"
+    if source_stat.st_mtime_ns == record.get("source_mtime_ns"):
+        return None
+    if STALE_CHECK == "mtime" or _sha256_file(source_file) != record.get("source_sha256"):
+        return "stale", "原文已修改"
+    return None
+
+
+def check_part(
+    idx: int, part_file: Path, source_file: Path, record: Optional[dict], min_chars: int
+) -> tuple[str, str]:
+    """
+    检查一个临时文件，返回 (状态, 说明)，状态为 ok 或 PART_STATUS_LABELS 中的一种。
+
+    清单记录与文件大小一致时直接采用记录的状态，只看文件大小；否则（没有记录，或文件在记录之后被截断、改写）
+    只读取文件开头判断内容，原文是否变化仍按记录中的原文修改时间和哈希判断。
+    """
+    try:
+        part_stat = part_file.stat()
+    except FileNotFoundError:
+        return "missing", "文件不存在"
+    if record is not None and record.get("part") != part_file.name:
+        # 文件总数变化导致序号位数不同，这条记录描述的不是这个文件
+        record = None
+    if record is not None and record.get("size") == part_stat.st_size:
+        status = record.get("status")
+        if status == "failed":
+            return "failed", "清单记录为失败"
+        if status == "stale":
+            return "stale", f"已标记为需要重新总结（{record.get('reason', '')}）"
+        header = f"第{record.get('source', '')}章总结：{record.get('model', '')}\n".encode("utf-8") + _SEPARATOR
+        body_bytes = part_stat.st_size - len(header)
+    else:
+        with part_file.open("rb") as f:
+            head = f.read(HEAD_BYTES)
+        header_end = head.find(_SEPARATOR)
+        body_start = header_end + len(_SEPARATOR) if header_end >= 0 else 0
+        if head[body_start:].lstrip().startswith("[总结失败]".encode("utf-8")):
+            return "failed", "内容为 [总结失败]"
+        body_bytes = part_stat.st_size - body_start
+    problem = _check_body(part_file, body_bytes, min_chars) or _check_source(source_file, part_stat, record)
+    return problem or ("ok", "")
+
+
+def verify_parts(tmp_dir: Path, files: list[Path], workers: int = CHECK_WORKERS) -> list[dict]:
+    """
+    并行检查 files 对应的全部临时文件，返回有问题的部分（按序号排列），
+    每项为 {"idx", "part", "source", "status", "detail"}。
+    """
+    # 与 总结opencode.py 共用清单的读取逻辑：同一编号以最后一条记录为准，崩溃留下的半行忽略
+    records = summarizer.PartManifest(tmp_dir).records
+    total = len(files)
+    min_chars = summarizer._min_summary_length()
+
+    def check(idx: int) -> dict:
+        part_file = summarizer.tmp_part_path(tmp_dir, idx, total)
+        status, detail = check_part(idx, part_file, files[idx - 1], records.get(idx), min_chars)
+        return {"idx": idx, "part": part_file.name, "source": files[idx - 1].name, "status": status, "detail": detail}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(check, range(1, total + 1)))
+    return [result for result in results if result["status"] != "ok"]
+
+
+def write_retry_list(tmp_dir: Path, files: list[Path], problems: list[dict]) -> Path:
+    """写出 总结opencode.py 读取的重跑清单；没有问题时删除旧清单。"""
+    retry_file = tmp_dir / summarizer.RETRY_LIST_NAME
+    if not problems:
+        retry_file.unlink(missing_ok=True)
+        return retry_file
+    retry = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "total": len(files),
+        "items": problems,
+    }
+    summarizer._atomic_write_text(retry_file, json.dumps(retry, ensure_ascii=False, indent=1))
+    return retry_file
+
+
+def check_parts(tmp_dir: Path, input_dir: Path, files: list[Path]) -> None:
+    """对照 TXT 目录检查全部临时文件，报告各类问题并写出重跑清单。"""
+    started = time.monotonic()
+    problems = verify_parts(tmp_dir, files)
+    elapsed = time.monotonic() - started
+
+    print(f"检查目录: {tmp_dir}（原文 {input_dir}）")
+    print(f"应有文件数: {len(files)}，用时 {elapsed:.2f}s")
+    print(f"正常: {len(files) - len(problems)}")
+    for status, label in PART_STATUS_LABELS.items():
+        group = [problem for problem in problems if problem["status"] == status]
+        if not group:
+            continue
+        print(f"\n{label} ({len(group)} 个):")
+        for problem in group:
+            print(f"- {problem['part']} <- {problem['source']}：{problem['detail']}")
+
+    retry_file = write_retry_list(tmp_dir, files, problems)
+    if problems:
+        print(f"\n已写出重跑清单: {retry_file}（{len(problems)} 个），直接运行 总结opencode.py 即可只重新总结这些部分")
+    else:
+        print("\n全部完整。")
+
+
 def main() -> None:
     base_dir = Path(__file__).resolve().parent
     tmp_dir = base_dir / "tmp"
@@ -26,6 +217,23 @@ def main() -> None:
         print(f"未找到目录: {tmp_dir}")
         return
 
+    try:
+        input_dir = summarizer.find_input_dir()
+        files = summarizer.list_txt_files(input_dir)
+    except FileNotFoundError:
+        files = []
+    if files:
+        check_parts(tmp_dir, input_dir, files)
+        return
+
+    # 找不到原文目录时只能按清单或文件编号检查
+    records = summarizer.PartManifest(tmp_dir).records
+    if records:
+        check_manifest(tmp_dir, records)
+        return
+
+    # 没有清单（旧版本生成的 tmp）时按文件编号检查
+
     numbers, invalid_names, detected_width = collect_numbered_txt_files(tmp_dir)
 
     if not numbers:
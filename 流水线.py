@@ -0,0 +1,192 @@
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import 分割
+import 总结opencode as summarizer
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# 输入小说文件（与 分割.py 的 INPUT_FILE 含义相同）
+INPUT_FILE = "校花的贴身高手.txt"
+# 分割结果目录
+OUTPUT_DIR = "TXT"
+# 汇总输出文件，格式与 总结opencode.py 的输出一致
+OUTPUT_FILE = BASE_DIR / f"总结_opencode_{summarizer.MODEL}.txt"
+# 临时目录：与 总结opencode.py 共用临时文件和清单，中断后重跑会跳过已完成的部分，检查是否完整.py 也可检查
+TMP_DIR = BASE_DIR / "tmp"
+# 总结线程数
+THREAD_COUNT = summarizer.total_concurrency(summarizer.THREAD_COUNT)
+
+
+class OrderedMerger:
+    """按文件序号顺序追加总结：前面的部分都到齐后立即写入输出文件，不必等全部完成。"""
+
+    def __init__(self, output_file: Path):
+        self.output_file = output_file
+        self.next_idx = 1
+        self._pending: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        self._out = output_file.open("w", encoding="utf-8")
+
+    @property
+    def merged_count(self) -> int:
+        return self.next_idx - 1
+
+    def add(self, idx: int, part: str) -> int:
+        # 返回本次写入输出文件的部分数
+        written = 0
+        with self._lock:
+            self._pending[idx] = part
+            while self.next_idx in self._pending:
+                if self.next_idx > 1:
+                    self._out.write("\n\n")
+                self._out.write(self._pending.pop(self.next_idx))
+                self.next_idx += 1
+                written += 1
+            if written:
+                self._out.flush()
+        return written
+
+    def close(self) -> None:
+        self._out.close()
+
+
+def _part_path(manifest: "summarizer.PartManifest", tmp_dir: Path, idx: int, total_hint: int) -> Path:
+    # 总数要等分割结束才知道：沿用清单里已有的文件名，否则按上次运行的总数定宽，结束时统一改名
+    record = manifest.records.get(idx)
+    if record is not None and record.get("part"):
+        return tmp_dir / record["part"]
+    return summarizer.tmp_part_path(tmp_dir, idx, max(total_hint, idx))
+
+
+def run_pipeline(
+    input_file: str = INPUT_FILE,
+    output_dir: str = OUTPUT_DIR,
+    output_file: Path = OUTPUT_FILE,
+    thread_count: int = THREAD_COUNT,
+    tmp_dir: Path = TMP_DIR,
+) -> int:
+    """
+    分割、总结、合并同时进行：分割器每写完一个文件就放入队列，总结线程立即领取，
+    合并器按顺序把已经连续完成的部分追加到输出文件。
+    每个部分经 save_part 写入临时目录并记入清单，重跑时跳过清单中已完成的部分。
+
+    Returns:
+        处理的文件数
+    """
+    splitter = 分割.NovelSplitter(
+        input_file=input_file,
+        output_dir=output_dir,
+        chapters_per_file=分割.CHAPTERS_PER_FILE,
+        heading_formats=分割.configured_heading_formats(),
+        **分割.configured_group_options(),
+    )
+    jobs: "queue.Queue" = queue.Queue()
+    merger = OrderedMerger(output_file)
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    manifest = summarizer.PartManifest(tmp_dir)
+    total_hint = max((record.get("total", 0) for record in manifest.records.values()), default=0)
+    started = time.monotonic()
+    split_count = 0
+    first_merge_at = None
+
+    def on_file(file_path: Path) -> None:
+        nonlocal split_count
+        split_count += 1
+        jobs.put((split_count, file_path))
+
+    def produce() -> None:
+        try:
+            splitter.process_streaming(on_file=on_file)
+        finally:
+            for _ in range(thread_count):
+                jobs.put(None)
+
+    def consume(thread_id: int) -> None:
+        nonlocal first_merge_at
+        while True:
+            item = jobs.get()
+            if item is None:
+                return
+            idx, file_path = item
+            part_total = max(total_hint, idx)
+            part_file = _part_path(manifest, tmp_dir, idx, total_hint)
+            file_started = time.monotonic()
+            try:
+                if summarizer.should_skip_part(
+                    manifest, idx, part_total, part_file, file_path, summarizer.TMP_EXISTS_MODE
+                ):
+                    print(
+                        f"{time.strftime('%H:%M:%S')} [{summarizer.MODEL}] [线程{thread_id}] [{idx}] "
+                        f"跳过 {file_path.name}（临时文件已存在）",
+                        flush=True,
+                    )
+                    part = part_file.read_text(encoding="utf-8", errors="ignore")
+                else:
+                    # 总数在分割结束前未知，日志里显示为“已分割的文件数”
+                    summary, model = summarizer.summarize_one_file_with_retry(
+                        file_path, idx, split_count, thread_id, part_file
+                    )
+                    part = summarizer.save_part(
+                        manifest, idx, part_total, part_file, file_path, summary,
+                        time.monotonic() - file_started, model,
+                    )
+            except Exception as exc:
+                # 出错的部分也要交给合并器，否则后面的部分会一直等待这个序号
+                part = summarizer.save_failed_part(
+                    manifest, idx, part_total, part_file, file_path, f"线程{thread_id}", exc,
+                    time.monotonic() - file_started,
+                )
+            if merger.add(idx, part) and first_merge_at is None:
+                first_merge_at = time.monotonic() - started
+                print(f"[{summarizer.MODEL}] 首个总结已写入输出文件，用时 {first_merge_at:.1f}s", flush=True)
+
+    print(
+        f"[{summarizer.MODEL}] 流水线启动：{input_file} -> {output_dir}/ -> {output_file}，"
+        f"{thread_count} 个总结线程",
+        flush=True,
+    )
+    summarizer.begin_run(thread_count)
+    threads: List[threading.Thread] = [
+        threading.Thread(target=produce, name="pipeline-splitter", daemon=False)
+    ]
+    for thread_id in range(1, thread_count + 1):
+        threads.append(
+            threading.Thread(
+                target=consume,
+                args=(thread_id,),
+                name=f"pipeline-worker-{thread_id}",
+                daemon=False,
+            )
+        )
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        merger.close()
+        summarizer.end_run()
+
+    renamed = manifest.renumber(tmp_dir, split_count)
+    if renamed:
+        print(f"[{summarizer.MODEL}] 已按总数 {split_count} 重命名 {renamed} 个临时文件", flush=True)
+
+    print(
+        f"[{summarizer.MODEL}] 流水线完成：共 {split_count} 个文件，已按顺序合并 {merger.merged_count} 个，"
+        f"总用时 {time.monotonic() - started:.1f}s，输出到：{output_file}",
+        flush=True,
+    )
+    return split_count
+
+
+def main() -> None:
+    run_pipeline()
+
+
+if __name__ == "__main__":
+    main()
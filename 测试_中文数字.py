@@ -0,0 +1,121 @@
+"""
+中文数字转换测试
+功能：校验 分割.py 的 chinese_to_num / num_to_chinese：两、〇、大写数字、全角数字、逐位写法等显式用例，
+      “一万二千三百”回归用例，各种写法的抽样往返，以及规范写法的穷举往返。
+      可直接运行（python 测试_中文数字.py），也可用 pytest 运行。
+"""
+
+import random
+import re
+import sys
+
+from 分割 import chinese_to_num, num_to_chinese
+
+# 规范写法往返校验：逐个校验 0 ~ EXHAUSTIVE_LIMIT-1，再随机抽查 RANDOM_SAMPLES 个大数
+EXHAUSTIVE_LIMIT = 1000000
+RANDOM_SAMPLES = 200000
+# 其他写法的抽样往返：0 ~ VARIANT_LIMIT-1 中每隔 VARIANT_STEP 取一个，再随机抽查 VARIANT_SAMPLES 个大数
+VARIANT_LIMIT = 100000
+VARIANT_STEP = 7
+VARIANT_SAMPLES = 20000
+
+# 显式用例：写法 -> 数值
+CASES = {
+    # 规范写法
+    '零': 0,
+    '十': 10,
+    '十一': 11,
+    '二十': 20,
+    '一百一十': 110,
+    '一千零五': 1005,
+    '一万二千三百': 12300,
+    '一万零五': 10005,
+    '三亿': 300000000,
+    '一亿零五万': 100050000,
+    # 两
+    '两': 2,
+    '两百': 200,
+    '两千零五': 2005,
+    '两万': 20000,
+    '兩萬兩千': 22000,
+    # 〇 与逐位写法
+    '〇': 0,
+    '一〇二四': 1024,
+    '二〇〇八': 2008,
+    '一千〇五': 1005,
+    # 大写数字
+    '壹': 1,
+    '壹佰贰拾': 120,
+    '叁仟零伍': 3005,
+    '壹万贰仟叁佰': 12300,
+    '玖億': 900000000,
+    # 阿拉伯数字与全角数字
+    '123': 123,
+    '１２３': 123,
+    '０': 0,
+}
+
+_FINANCIAL = str.maketrans('一二三四五六七八九十百千', '壹贰叁肆伍陆柒捌玖拾佰仟')
+_FULL_WIDTH = str.maketrans('0123456789', '０１２３４５６７８９')
+_LIANG_RE = re.compile('二(?=[百千万亿])')
+
+
+def _variants(num: int) -> dict:
+    """同一个数的各种写法"""
+    canonical = num_to_chinese(num)
+    return {
+        '规范': canonical,
+        '大写': canonical.translate(_FINANCIAL),
+        '两': _LIANG_RE.sub('两', canonical),
+        '〇': canonical.replace('零', '〇'),
+        '逐位': ''.join('〇一二三四五六七八九'[int(d)] for d in str(num)),
+        '全角': str(num).translate(_FULL_WIDTH),
+    }
+
+
+def test_explicit_cases():
+    for text, expected in CASES.items():
+        assert chinese_to_num(text) == expected, f"{text} -> {chinese_to_num(text)}，应为 {expected}"
+
+
+def test_wan_regression():
+    # 旧实现把“万”当作“十”一样直接乘到累计结果上，这个数会解析错
+    assert num_to_chinese(12300) == '一万二千三百'
+    assert chinese_to_num('一万二千三百') == 12300
+
+
+def test_variant_round_trip():
+    rng = random.Random(2)
+    samples = list(range(0, VARIANT_LIMIT, VARIANT_STEP))
+    samples.extend(rng.randrange(10 ** 12) for _ in range(VARIANT_SAMPLES))
+    for num in samples:
+        for name, text in _variants(num).items():
+            assert chinese_to_num(text) == num, f"{name}写法往返不一致: {num} -> {text} -> {chinese_to_num(text)}"
+
+
+def test_canonical_round_trip():
+    rng = random.Random(1)
+    samples = list(range(EXHAUSTIVE_LIMIT))
+    samples.extend(rng.randrange(10 ** 12) for _ in range(RANDOM_SAMPLES))
+    for num in samples:
+        chinese = num_to_chinese(num)
+        assert chinese_to_num(chinese) == num, f"往返不一致: {num} -> {chinese} -> {chinese_to_num(chinese)}"
+
+
+def main() -> int:
+    tests = [test_explicit_cases, test_wan_regression, test_variant_round_trip, test_canonical_round_trip]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"失败: {test.__name__}: {e}")
+        else:
+            print(f"通过: {test.__name__}")
+    print(f"共 {len(tests)} 项，失败 {failed} 项")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
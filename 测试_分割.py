@@ -0,0 +1,91 @@
+"""
+分割测试
+功能：校验 分割.py 的三种分割模式（整篇、流式、索引）对同一输入产生完全相同的输出文件，
+      覆盖各种行首缩进（含不间断空格等 Unicode 空白）的标题行；
+      以及同时启用多种标题格式时，重复章节号按格式分别判断。
+      可直接运行（python 测试_分割.py），也可用 pytest 运行。
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+from 分割 import EXTRA_HEADING_FORMATS, NovelSplitter
+
+# 混合缩进的输入：制表符、全角空格、不间断空格、em 空格缩进的标题，
+# 出现在文件开头、空章节之后和正文之后
+MIXED_INDENT_CASES = {
+    '复现': '\t第1章．标题\r\n\xa0第二章．标题',
+    '开头不间断空格': '\xa0第1章．开始\n正文一\n第2章．继续\n正文二\n',
+    '空章节之后': '第1章．甲\n正文一\n第2章．空\n\n\xa0第3章．乙\n正文三\n第4章．丙\n正文四\n',
+    '正文之后': '第1章．甲\n正文一\n 第2章．乙\n正文二\n　第3章．丙\n正文三\n',
+    '重复章节号': '第1章．甲\n正文一\n第1章．甲\n\xa0第2章．乙\n正文二\n\t第3章．丙\r\n正文三\r\n',
+    '多行空白': '前言\n\n第1章．甲\n正文一\n第2章\n \n　\n\xa0 第3章．丙\n正文三\n正文三续\n',
+}
+
+# 同时启用“卷X”与默认的“第X章”：卷号与章节号都从一开始，不能互相当作重复章节
+VOLUME_TEXT = (
+    '卷一 风起\n本卷简介一\n第一章 甲\n正文一\n第二章 乙\n正文二\n'
+    '卷二 云涌\n本卷简介二\n第三章 丙\n正文三\n第三章 丙\n正文三续\n'
+)
+
+
+def _split_outputs(text: str, mode: str, heading_formats=None, chapters_per_file: int = 1) -> dict:
+    """按指定模式分割 text，返回 {输出文件名: 内容}"""
+    with tempfile.TemporaryDirectory() as tmp:
+        input_file = Path(tmp) / 'novel.txt'
+        input_file.write_bytes(text.encode('utf-8'))
+        output_dir = Path(tmp) / 'out'
+        splitter = NovelSplitter(str(input_file), str(output_dir), chapters_per_file=chapters_per_file,
+                                 heading_formats=heading_formats)
+        if mode == 'index':
+            splitter.process_indexed()
+        elif mode == 'stream':
+            splitter.process_streaming()
+        else:
+            splitter.process()
+        if not output_dir.exists():
+            return {}
+        return {path.name: path.read_bytes() for path in sorted(output_dir.iterdir())}
+
+
+def test_modes_match_on_mixed_indent():
+    for name, text in MIXED_INDENT_CASES.items():
+        expected = _split_outputs(text, 'full')
+        for mode in ('stream', 'index'):
+            actual = _split_outputs(text, mode)
+            assert actual == expected, f"{name}：{mode} 模式输出 {sorted(actual)}，整篇模式输出 {sorted(expected)}"
+
+
+def test_volume_and_chapter_numbers_are_separate():
+    splitter = NovelSplitter('novel.txt', heading_formats=[EXTRA_HEADING_FORMATS['卷']])
+    chapters = splitter.split_chapters(VOLUME_TEXT)
+    assert [title for title, _ in chapters] == ['卷一 风起', '第一章 甲', '第二章 乙', '卷二 云涌', '第三章 丙'], chapters
+    assert chapters[0][1].strip() == '本卷简介一' and chapters[1][1].strip() == '正文一', chapters[:2]
+    # 同一格式下重复的章节号仍只保留第一次出现，其后正文并入该章
+    assert chapters[-1][1].split() == ['正文三', '正文三续'], chapters[-1]
+
+    formats = [EXTRA_HEADING_FORMATS['卷']]
+    expected = _split_outputs(VOLUME_TEXT, 'full', formats, chapters_per_file=10)
+    for mode in ('stream', 'index'):
+        actual = _split_outputs(VOLUME_TEXT, mode, formats, chapters_per_file=10)
+        assert actual == expected, f"{mode} 模式输出与整篇模式不一致：{actual} != {expected}"
+
+
+def main() -> int:
+    tests = [test_modes_match_on_mixed_indent, test_volume_and_chapter_numbers_are_separate]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"失败: {test.__name__}: {e}")
+        else:
+            print(f"通过: {test.__name__}")
+    print(f"共 {len(tests)} 项，失败 {failed} 项")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
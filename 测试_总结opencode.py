@@ -0,0 +1,70 @@
+"""
+总结分段测试
+功能：校验 总结opencode.py 的 split_text_chunks：正文中带章节标题行的超长文本在标题行处切分，
+      标题行识别与 分割.py 一致（含行首缩进），单章过长时退回段落切分，拼接后与原文完全相同。
+      可直接运行（python 测试_总结opencode.py），也可用 pytest 运行。
+"""
+
+import sys
+
+from 总结opencode import split_text_chunks
+
+CHAPTER_BODY = '林逸走进教室，看见了楚梦瑶。\n' * 20
+
+
+def _novel(headings) -> str:
+    # 各章长短不一，按段落切分时的切点不会恰好落在标题行上
+    bodies = [CHAPTER_BODY, CHAPTER_BODY[:len(CHAPTER_BODY) // 2]]
+    return ''.join(f'{heading}\n{bodies[i % 2]}' for i, heading in enumerate(headings))
+
+
+def test_split_on_chapter_lines():
+    # 大写数字、全角数字、行首缩进的标题行都与 分割.py 一样识别
+    headings = ['第一章 开学', '　第贰章 相遇', '第３章．误会', '\t第肆拾章 和好']
+    text = _novel(headings)
+    chapter_chars = len(_novel(headings[:1]))
+    chunks = split_text_chunks(text, chapter_chars * 2)
+    assert ''.join(chunks) == text
+    assert [chunk.split('\n', 1)[0] for chunk in chunks] == ['第一章 开学', '第３章．误会'], chunks
+    chunks = split_text_chunks(text, chapter_chars)
+    assert [chunk.split('\n', 1)[0] for chunk in chunks] == headings, chunks
+
+
+def test_non_heading_lines_are_not_boundaries():
+    # 正文中间提到“第二章”不是标题行，不能在此切分
+    text = '第一章 开学\n' + CHAPTER_BODY + '他翻到第二章继续读。\n' + CHAPTER_BODY + '第二章 相遇\n' + CHAPTER_BODY
+    chunks = split_text_chunks(text, len(text) - len(CHAPTER_BODY))
+    assert ''.join(chunks) == text
+    assert chunks[-1].startswith('第二章 相遇'), chunks
+
+
+def test_long_chapter_falls_back_to_lines():
+    text = _novel(['第一章 开学'])
+    max_chars = len(text) // 3 + 1
+    chunks = split_text_chunks(text, max_chars)
+    assert ''.join(chunks) == text
+    assert len(chunks) > 1 and all(len(chunk) <= max_chars for chunk in chunks), [len(c) for c in chunks]
+    assert all(chunk.endswith('\n') for chunk in chunks), chunks
+
+
+def main() -> int:
+    tests = [
+        test_split_on_chapter_lines,
+        test_non_heading_lines_are_not_boundaries,
+        test_long_chapter_falls_back_to_lines,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"失败: {test.__name__}: {e}")
+        else:
+            print(f"通过: {test.__name__}")
+    print(f"共 {len(tests)} 项，失败 {failed} 项")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())